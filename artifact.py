@@ -0,0 +1,331 @@
+import array, json, logging, mmap, numbers, os, shutil, time
+import gensim
+import numpy as np
+from scipy import sparse
+
+import cooccurrence
+import significance
+
+logger = logging.getLogger("glovex")
+
+FORMAT_VERSION = 2
+
+# Fields of a DocReader that live in their own files and are only read when first accessed
+LAZY_FIELDS = ("documents", "word_occurrence", "cooccurrence", "dictionary", "vocabulary", "doc_ids", "doc_titles", "doc_raws",
+			   "doc_famcats", "per_fc_keys_to_all_keys", "all_keys_to_per_fc_keys", "cooccurrence_p_values")
+
+# A read-only sequence of strings stored as byte ranges of a file, read through mmap on access.
+# starts/ends are byte offsets into the file; the file is only opened when a string is first requested.
+class StringColumn(object):
+	def __init__(self, path, starts, ends, encoding="utf-8"):
+		self.path = path
+		self.starts = starts
+		self.ends = ends
+		self.encoding = encoding
+		self._blob = None
+
+	def _open(self):
+		if self._blob is None:
+			with open(self.path, "rb") as f:
+				if os.fstat(f.fileno()).st_size:
+					self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				else:
+					self._blob = b""
+		return self._blob
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["_blob"] = None
+		return state
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __getitem__(self, i):
+		if not isinstance(i, numbers.Integral):
+			raise TypeError("StringColumn indices must be integers")
+		return self._open()[self.starts[i]:self.ends[i]].decode(self.encoding, "ignore")
+
+	def __iter__(self):
+		return (self[i] for i in range(len(self)))
+
+# Collects strings straight into a StringColumn's files, for metadata that should not be held in memory.
+# Behaves like the list it replaces while being appended to; close() returns the finished StringColumn.
+class StringColumnWriter(object):
+	def __init__(self, directory, name):
+		self.directory = directory
+		self.name = name
+		self.blob_path, self.offsets_path = _column_paths(directory, name)
+		self.f = open(self.blob_path, "wb")
+		self.offsets = array.array("l", [0])
+
+	def append(self, s):
+		encoded = _encode(s)
+		self.f.write(encoded)
+		self.offsets.append(self.offsets[-1] + len(encoded))
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def close(self):
+		self.f.close()
+		np.save(self.offsets_path, np.frombuffer(self.offsets, dtype="i%d" % self.offsets.itemsize).astype(np.int64))
+		return load_strings(self.directory, self.name)
+
+def _column_paths(directory, name):
+	return os.path.join(directory, name+".blob"), os.path.join(directory, name+".offsets.npy")
+
+def _encode(s):
+	return s.encode("utf-8") if isinstance(s, unicode) else str(s)
+
+def save_strings(directory, name, strings):
+	blob_path, offsets_path = _column_paths(directory, name)
+	offsets = [0]
+	with open(blob_path, "wb") as f:
+		for s in strings:
+			encoded = _encode(s)
+			f.write(encoded)
+			offsets.append(offsets[-1] + len(encoded))
+	np.save(offsets_path, np.array(offsets, dtype=np.int64))
+
+# Append strings to the column in directory.  With source_directory, the column is first taken from there: the blob
+# is hard-linked (or copied) and extended past the source's last offset, which leaves the source column as it was.
+def append_strings(directory, name, strings, source_directory=None):
+	blob_path, offsets_path = _column_paths(directory, name)
+	if source_directory is not None:
+		source_blob_path, source_offsets_path = _column_paths(source_directory, name)
+		_link_or_copy(source_blob_path, blob_path)
+	else:
+		source_offsets_path = offsets_path
+	old_offsets = np.load(source_offsets_path)
+	offsets = [int(old_offsets[-1])]
+	with open(blob_path, "r+b") as f:
+		f.truncate(offsets[0])
+		f.seek(offsets[0])
+		for s in strings:
+			encoded = _encode(s)
+			f.write(encoded)
+			offsets.append(offsets[-1] + len(encoded))
+	np.save(offsets_path, np.concatenate([old_offsets, np.array(offsets[1:], dtype=np.int64)]))
+
+def _link_or_copy(source, target):
+	try:
+		os.link(source, target)
+	except (AttributeError, OSError):
+		shutil.copyfile(source, target)
+
+def load_strings(directory, name):
+	blob_path, offsets_path = _column_paths(directory, name)
+	offsets = np.load(offsets_path, mmap_mode="r")
+	return StringColumn(blob_path, offsets[:-1], offsets[1:])
+
+def save_csr(directory, name, matrix):
+	np.save(os.path.join(directory, name+".indptr.npy"), matrix.indptr)
+	np.save(os.path.join(directory, name+".indices.npy"), matrix.indices)
+	np.save(os.path.join(directory, name+".data.npy"), matrix.data)
+
+def load_csr(directory, name, shape, data_name=None):
+	load = lambda part: np.load(os.path.join(directory, name+"."+part+".npy"), mmap_mode="r")
+	data = np.load(os.path.join(directory, (data_name or name)+".data.npy"), mmap_mode="r")
+	return sparse.csr_matrix((data, load("indices"), load("indptr")), shape=shape)
+
+# Write the co-occurrence counts (and p-values) of a DocReader, globally or per famcat, with the document famcats
+def _save_counts(reader, directory):
+	famcats = list(reader.famcats)
+	if famcats:
+		fc_index = {fc:i for i,fc in enumerate(famcats)}
+		indptr = np.cumsum([0] + [len(fcs) for fcs in reader.doc_famcats])
+		np.save(os.path.join(directory, "doc_famcats.indptr.npy"), indptr)
+		np.save(os.path.join(directory, "doc_famcats.indices.npy"), np.array([fc_index[fc] for fcs in reader.doc_famcats for fc in fcs], dtype=np.int32))
+		for i,fc in enumerate(famcats):
+			fc_path = os.path.join(directory, "fc%d" % i)
+			os.makedirs(fc_path)
+			np.save(os.path.join(fc_path, "local_to_global.npy"), reader.per_fc_keys_to_all_keys[fc].array)
+			np.save(os.path.join(fc_path, "word_occurrence.npy"), reader.word_occurrence[fc].counts)
+			save_csr(fc_path, "cooccurrence", reader.cooccurrence[fc].matrix)
+			if fc in reader.cooccurrence_p_values:
+				np.save(os.path.join(fc_path, "p_values.data.npy"), reader.cooccurrence_p_values[fc].matrix.data)
+	else:
+		np.save(os.path.join(directory, "word_occurrence.npy"), reader.word_occurrence.counts)
+		save_csr(directory, "cooccurrence", reader.cooccurrence.matrix)
+		if isinstance(reader.cooccurrence_p_values, cooccurrence.SparseCooccurrence):
+			np.save(os.path.join(directory, "p_values.data.npy"), reader.cooccurrence_p_values.matrix.data)
+
+def _save_meta(reader, directory):
+	famcats = list(reader.famcats)
+	meta = {"version": FORMAT_VERSION, "total_docs": reader.total_docs, "total_words": float(reader.total_words),
+			"n_words": len(reader.dictionary), "use_sglove": reader.use_sglove, "famcats": famcats,
+			"docs_per_fc": [reader.docs_per_fc[fc] for fc in famcats]}
+	with open(os.path.join(directory, "meta.json"), "w") as f:
+		json.dump(meta, f)
+
+def _fresh_directory(path):
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	os.makedirs(path)
+
+# Move the directory assembled at tmp_path to path.  An old artifact is renamed aside first and only removed
+# once the new one is in place.
+def _move_into_place(tmp_path, path):
+	old_path = path + ".old"
+	if os.path.exists(old_path):
+		shutil.rmtree(old_path)
+	if os.path.isdir(path):
+		os.rename(path, old_path)
+	elif os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp_path, path)
+	if os.path.exists(old_path):
+		shutil.rmtree(old_path)
+
+# Write the preprocessed state of a DocReader as a directory with one file per component.
+# The directory is assembled under a temporary name and renamed into place.
+def save(reader, path):
+	start = time.time()
+	tmp_path = path + ".tmp"
+	_fresh_directory(tmp_path)
+	n_words = len(reader.dictionary)
+	reader.dictionary.save(os.path.join(tmp_path, "dictionary"))
+	if getattr(reader, "vocabulary", None) is not None:
+		reader.vocabulary.save(os.path.join(tmp_path, "vocabulary"))
+	save_csr(tmp_path, "documents", cooccurrence.bow_matrix(reader.documents, n_words))
+	if all(isinstance(i, numbers.Integral) for i in reader.doc_ids):
+		np.save(os.path.join(tmp_path, "doc_ids.npy"), np.array(reader.doc_ids, dtype=np.int64))
+	else:
+		save_strings(tmp_path, "doc_ids", reader.doc_ids)
+	save_strings(tmp_path, "doc_titles", reader.doc_titles)
+	save_strings(tmp_path, "doc_raws", reader.doc_raws)
+	_save_counts(reader, tmp_path)
+	_save_meta(reader, tmp_path)
+	_move_into_place(tmp_path, path)
+	logger.info("   **** Wrote pre-processed artifact in %.2fs." % (time.time()-start))
+
+# Update the artifact at path after documents were appended to reader (see DocReader.append).  The updated
+# artifact is assembled under a temporary directory: the string columns share the old blobs (hard-linked where
+# possible) with the new documents' ids, titles and raw texts appended, and the other components are rewritten.
+# It then replaces the old directory as in save(), so that an interrupted append leaves the old artifact whole.
+# Readers that still map the old arrays keep seeing them.  Cached training sets of the old counts are dropped.
+# vocabulary_changes is appended to vocabulary_changes.jsonl.
+def append(reader, path, new_doc_ids, new_doc_titles, new_doc_raws, vocabulary_changes=None):
+	start = time.time()
+	tmp_path = path + ".tmp"
+	_fresh_directory(tmp_path)
+	reader.dictionary.save(os.path.join(tmp_path, "dictionary"))
+	if getattr(reader, "vocabulary", None) is not None:
+		reader.vocabulary.save(os.path.join(tmp_path, "vocabulary"))
+	save_csr(tmp_path, "documents", reader.documents.matrix)
+	ids_path = os.path.join(path, "doc_ids.npy")
+	if os.path.exists(ids_path):
+		if all(isinstance(i, numbers.Integral) for i in new_doc_ids):
+			np.save(os.path.join(tmp_path, "doc_ids.npy"), np.concatenate([np.load(ids_path), np.array(new_doc_ids, dtype=np.int64)]))
+		else:
+			save_strings(tmp_path, "doc_ids", np.load(ids_path).tolist())
+			append_strings(tmp_path, "doc_ids", new_doc_ids)
+	else:
+		append_strings(tmp_path, "doc_ids", new_doc_ids, path)
+	append_strings(tmp_path, "doc_titles", new_doc_titles, path)
+	append_strings(tmp_path, "doc_raws", new_doc_raws, path)
+	_save_counts(reader, tmp_path)
+	_save_meta(reader, tmp_path)
+	changes_path = os.path.join(path, "vocabulary_changes.jsonl")
+	if os.path.exists(changes_path):
+		shutil.copyfile(changes_path, os.path.join(tmp_path, "vocabulary_changes.jsonl"))
+	if vocabulary_changes is not None:
+		with open(os.path.join(tmp_path, "vocabulary_changes.jsonl"), "a") as f:
+			f.write(json.dumps(vocabulary_changes) + "\n")
+	_move_into_place(tmp_path, path)
+	logger.info("   **** Appended %d documents to the pre-processed artifact in %.2fs." % (len(new_doc_raws), time.time()-start))
+
+# A preprocessed artifact directory.  Small metadata is read up front; every other component is
+# read (and memory-mapped where it is an array) by load(name) when the reader first touches it.
+class Artifact(object):
+	def __init__(self, path):
+		self.path = path
+		with open(os.path.join(path, "meta.json")) as f:
+			self.meta = json.load(f)
+		self.famcats = self.meta["famcats"]
+		self.n_words = self.meta["n_words"]
+		self._dictionary = None
+
+	def _file(self, *parts):
+		return os.path.join(self.path, *parts)
+
+	def _fc_dir(self, fc):
+		return self._file("fc%d" % self.famcats.index(fc))
+
+	def _local_to_global(self, fc):
+		return np.load(os.path.join(self._fc_dir(fc), "local_to_global.npy"))
+
+	def load(self, name):
+		return getattr(self, "_load_"+name)()
+
+	def _load_dictionary(self):
+		if self._dictionary is None:
+			self._dictionary = gensim.corpora.Dictionary.load(self._file("dictionary"))
+		return self._dictionary
+
+	# The unfiltered dictionary (None for artifacts written before it was stored)
+	def _load_vocabulary(self):
+		if not os.path.exists(self._file("vocabulary")):
+			return None
+		return gensim.corpora.Dictionary.load(self._file("vocabulary"))
+
+	def _load_documents(self):
+		load = lambda part: np.load(self._file("documents."+part+".npy"), mmap_mode="r")
+		return cooccurrence.BowCorpus(load("indices"), load("data"), load("indptr"), self.n_words)
+
+	def _load_doc_ids(self):
+		if os.path.exists(self._file("doc_ids.npy")):
+			return np.load(self._file("doc_ids.npy")).tolist()
+		return load_strings(self.path, "doc_ids")
+
+	def _load_doc_titles(self):
+		return load_strings(self.path, "doc_titles")
+
+	def _load_doc_raws(self):
+		return load_strings(self.path, "doc_raws")
+
+	def _load_doc_famcats(self):
+		if not self.famcats:
+			return []
+		indptr = np.load(self._file("doc_famcats.indptr.npy"))
+		indices = np.load(self._file("doc_famcats.indices.npy"))
+		return [[self.famcats[i] for i in indices[indptr[d]:indptr[d+1]]] for d in range(len(indptr)-1)]
+
+	def _load_per_fc_keys_to_all_keys(self):
+		return {fc:cooccurrence.IdMap(self._local_to_global(fc)) for fc in self.famcats}
+
+	def _load_all_keys_to_per_fc_keys(self):
+		return {fc:cooccurrence.IdMap(self._local_to_global(fc)).inverse(self.n_words) for fc in self.famcats}
+
+	def _load_word_occurrence(self):
+		if not self.famcats:
+			return cooccurrence.WordOccurrence(np.load(self._file("word_occurrence.npy"), mmap_mode="r"), self._load_dictionary())
+		return {fc:cooccurrence.WordOccurrence(np.load(os.path.join(self._fc_dir(fc), "word_occurrence.npy"), mmap_mode="r"),
+											   self._load_dictionary(), self._local_to_global(fc)) for fc in self.famcats}
+
+	def _load_cooccurrence(self):
+		if not self.famcats:
+			return cooccurrence.SparseCooccurrence(load_csr(self.path, "cooccurrence", (self.n_words, self.n_words)))
+		views = {}
+		for fc in self.famcats:
+			n_fc_words = len(self._local_to_global(fc))
+			views[fc] = cooccurrence.SparseCooccurrence(load_csr(self._fc_dir(fc), "cooccurrence", (n_fc_words, n_fc_words)))
+		return views
+
+	def _load_cooccurrence_p_values(self):
+		if not self.famcats:
+			if not os.path.exists(self._file("p_values.data.npy")):
+				return {}
+			occ = np.rint(np.load(self._file("word_occurrence.npy"))).astype(np.int64)
+			matrix = load_csr(self.path, "cooccurrence", (self.n_words, self.n_words), data_name="p_values")
+			return cooccurrence.SparseCooccurrence(matrix, missing=significance.ZeroCooccurrencePValue(occ, int(round(self.meta["total_docs"]))))
+		p_values = {}
+		for fc,n_docs in zip(self.famcats, self.meta["docs_per_fc"]):
+			fc_dir = self._fc_dir(fc)
+			if os.path.exists(os.path.join(fc_dir, "p_values.data.npy")):
+				n_fc_words = len(self._local_to_global(fc))
+				occ = np.rint(np.load(os.path.join(fc_dir, "word_occurrence.npy"))).astype(np.int64)
+				matrix = load_csr(fc_dir, "cooccurrence", (n_fc_words, n_fc_words), data_name="p_values")
+				p_values[fc] = cooccurrence.SparseCooccurrence(matrix, missing=significance.ZeroCooccurrencePValue(occ, int(round(n_docs))))
+		return p_values
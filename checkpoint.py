@@ -0,0 +1,148 @@
+import cPickle as pickle
+import glob, importlib, json, logging, os, shutil, time
+import numpy as np
+
+import artifact
+
+logger = logging.getLogger("glovex")
+
+FORMAT_VERSION = 1
+
+# Model arrays stored in a checkpoint, one .npy file each
+PARAMS = ("W", "ContextW", "b", "ContextB", "gradsqW", "gradsqContextW", "gradsqb", "gradsqContextB")
+
+# Model attributes that are not part of a checkpoint: the training data, re-attached on load
+DATA = ("cooccurence", "p_values", "training_set")
+
+# Save a model's parameters and hyperparameters as a checkpoint directory at path (for the given epoch), leaving out
+# the co-occurrences and p-values it references.  The directory is written under a temporary name and renamed into
+# place, so an interrupted save never leaves a partial checkpoint behind.  tokens and counts (the word and document
+# count of each row) are stored with it if given, so that later models can warm-start from it.
+def save(model, path, epoch, tokens=None, counts=None):
+	start = time.time()
+	tmp_path = path + ".tmp"
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+	meta = {"version": FORMAT_VERSION, "class": type(model).__module__ + "." + type(model).__name__, "epoch": epoch,
+			"data": [name for name in DATA if name in vars(model)], "attributes": {}}
+	for name,value in vars(model).iteritems():
+		if name in PARAMS:
+			np.save(os.path.join(tmp_path, name + ".npy"), value)
+		elif name == "dtype":
+			meta["attributes"][name] = np.dtype(value).name
+		elif name not in DATA:
+			meta["attributes"][name] = value
+	if tokens is not None:
+		artifact.save_strings(tmp_path, "tokens", tokens)
+	if counts is not None:
+		np.save(os.path.join(tmp_path, "counts.npy"), np.asarray(counts))
+	with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+		json.dump(meta, f)
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+	elif os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp_path, path)
+	logger.info("   **** Saved checkpoint %s in %.3fs" % (path, time.time()-start))
+
+# Load the model checkpointed at path, attaching the co-occurrences, p-values and training set path to train it on.
+# Pickled models written by older versions are read too.  mmap_mode is passed on to np.load for the parameters.
+def load(path, cooccurrence=None, p_values=None, training_set_path=None, mmap_mode=None):
+	start = time.time()
+	data = {"cooccurence": cooccurrence, "p_values": p_values, "training_set": None}
+	if not os.path.isdir(path):
+		with open(path, "rb") as f:
+			model = pickle.load(f)
+		for name in DATA:
+			if data[name] is not None and hasattr(model, name):
+				setattr(model, name, data[name])
+	else:
+		with open(os.path.join(path, "meta.json")) as f:
+			meta = json.load(f)
+		module, name = meta["class"].rsplit(".", 1)
+		model = object.__new__(getattr(importlib.import_module(module), name))
+		state = dict((str(k), v) for k,v in meta["attributes"].iteritems())
+		if "dtype" in state:
+			state["dtype"] = np.dtype(str(state["dtype"]))
+		for name in PARAMS:
+			if os.path.exists(os.path.join(path, name + ".npy")):
+				state[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+		for name in meta["data"]:
+			state[str(name)] = data[name]
+		if hasattr(model, "__setstate__"):
+			model.__setstate__(state)
+		else:
+			model.__dict__.update(state)
+	if training_set_path is not None and hasattr(model, "training_set_path"):
+		model.training_set_path = training_set_path
+		model.training_set = None
+	logger.info("   **** Loaded checkpoint %s in %.3fs" % (path, time.time()-start))
+	return model
+
+# The tokens and counts of the rows of the model checkpointed at path (None where they were not stored)
+def vocabulary(path):
+	tokens = counts = None
+	if os.path.exists(os.path.join(path, "tokens.offsets.npy")):
+		tokens = list(artifact.load_strings(path, "tokens"))
+	if os.path.exists(os.path.join(path, "counts.npy")):
+		counts = np.load(os.path.join(path, "counts.npy"))
+	return tokens, counts
+
+# Whether the model checkpointed at path can be resumed as is for a model whose rows are tokens: older checkpoints
+# without a vocabulary are assumed to match
+def matches(path, tokens):
+	old_tokens, _ = vocabulary(path) if os.path.isdir(path) else (None, None)
+	return old_tokens is None or tokens is None or old_tokens == list(tokens)
+
+# Initialise model (whose rows are tokens) from the model checkpointed at path: the parameters of every word the two
+# share are copied over, the rest keep their fresh initialisation.  Returns a mask of the rows that are new, or whose
+# count differs from the checkpoint's if counts are given.
+def warm_start(model, path, tokens, counts=None):
+	old_tokens, old_counts = vocabulary(path)
+	if old_tokens is None:
+		raise ValueError("Checkpoint %s has no vocabulary to warm-start from" % path)
+	old_rows = dict((w, i) for i,w in enumerate(old_tokens))
+	rows = np.array([i for i,w in enumerate(tokens) if w in old_rows], dtype=np.int64)
+	old = np.array([old_rows[tokens[i]] for i in rows], dtype=np.int64)
+	for name in PARAMS:
+		if os.path.exists(os.path.join(path, name + ".npy")):
+			values = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+			if values.shape[1:] != getattr(model, name).shape[1:]:
+				raise ValueError("Cannot warm-start %s of shape %s from %s of shape %s" % (name, getattr(model, name).shape, path, values.shape))
+			getattr(model, name)[rows] = values[old]
+	changed = np.ones(len(tokens), dtype=bool)
+	changed[rows] = False
+	if counts is not None and old_counts is not None:
+		changed[rows] = np.asarray(counts)[rows] != old_counts[old]
+	logger.info("   **** Warm-started from %s: %d of %d words carried over, %d new or changed" % (path, len(rows), len(tokens), changed.sum()))
+	return changed
+
+# The checkpoints (directories or older pickles) of a run as (epoch, path) pairs, oldest first
+def checkpoints(prefix, suffix=".glovex"):
+	found = []
+	for path in glob.glob(prefix + "_epochs*" + suffix):
+		epoch = path[len(prefix + "_epochs"):-len(suffix)]
+		if epoch.isdigit():
+			found.append((int(epoch), path))
+	return sorted(found)
+
+# Delete all but the newest keep checkpoints of a run
+def prune(prefix, keep, suffix=".glovex"):
+	for epoch,path in checkpoints(prefix, suffix)[:-keep]:
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		else:
+			os.remove(path)
+		logger.info("   **** Removed old checkpoint %s" % path)
+
+# Move the checkpoints of a run out of the way, to <prefix>_previous_epochsN<suffix> (replacing any moved there
+# before), so that a run restarting from epoch 0 is not resumed from them
+def retire(prefix, suffix=".glovex"):
+	for path in glob.glob(prefix + "_previous_epochs*" + suffix):
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		else:
+			os.remove(path)
+	for epoch,path in checkpoints(prefix, suffix):
+		os.rename(path, prefix + "_previous_epochs" + str(epoch) + suffix)
@@ -0,0 +1,350 @@
+import logging, multiprocessing, numbers, resource, time
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("glovex")
+
+# Peak resident set size of this process in MB (Linux reports ru_maxrss in KB)
+def peak_rss_mb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# Read-only view of one row of a sparse matrix that behaves like the {wk2: value} dicts it replaces.
+# If missing is given, lookups of absent columns return missing(wk, wk2) instead of raising KeyError.
+class SparseRow(object):
+	def __init__(self, wk, indices, data, missing=None):
+		self.wk = wk
+		self.indices = indices
+		self.data = data
+		self.missing = missing
+
+	def _find(self, wk2):
+		i = np.searchsorted(self.indices, wk2)
+		if i < len(self.indices) and self.indices[i] == wk2:
+			return i
+		return -1
+
+	def __getitem__(self, wk2):
+		i = self._find(wk2)
+		if i < 0:
+			if self.missing is None:
+				raise KeyError(wk2)
+			return self.missing(self.wk, wk2)
+		return float(self.data[i])
+
+	def get(self, wk2, default=None):
+		i = self._find(wk2)
+		return default if i < 0 else float(self.data[i])
+
+	def __contains__(self, wk2):
+		return self._find(wk2) >= 0
+
+	def __len__(self):
+		return len(self.indices)
+
+	def __iter__(self):
+		return iter(self.indices.tolist())
+
+	def keys(self):
+		return self.indices.tolist()
+
+	def values(self):
+		return self.data.tolist()
+
+	def iteritems(self):
+		return iter(zip(self.indices.tolist(), self.data.tolist()))
+
+	def items(self):
+		return list(self.iteritems())
+
+	iterkeys = __iter__
+
+# Dict-of-dicts view over a square CSR matrix, so that code written against {wk: {wk2: value}}
+# (s_glove.Glove, glove.Glove, evaluate.py) keeps working on the sparse representation.
+class SparseCooccurrence(object):
+	def __init__(self, matrix, missing=None):
+		self.matrix = matrix
+		self.missing = missing
+
+	@property
+	def nnz(self):
+		return self.matrix.nnz
+
+	def __len__(self):
+		return self.matrix.shape[0]
+
+	def __iter__(self):
+		return iter(range(self.matrix.shape[0]))
+
+	def __contains__(self, wk):
+		return isinstance(wk, numbers.Integral) and 0 <= wk < self.matrix.shape[0]
+
+	def __getitem__(self, wk):
+		if wk not in self:
+			raise KeyError(wk)
+		start, end = self.matrix.indptr[wk], self.matrix.indptr[wk+1]
+		return SparseRow(wk, self.matrix.indices[start:end], self.matrix.data[start:end], self.missing)
+
+	def get(self, wk, default=None):
+		return self[wk] if wk in self else default
+
+	def keys(self):
+		return list(self)
+
+	def iteritems(self):
+		return ((wk, self[wk]) for wk in self)
+
+	def items(self):
+		return list(self.iteritems())
+
+	iterkeys = __iter__
+
+	# The stored entries as parallel (wk, wk2, value) arrays in row-major order
+	def pairs(self):
+		rows = np.repeat(np.arange(self.matrix.shape[0], dtype=np.int32), np.diff(self.matrix.indptr))
+		return rows, self.matrix.indices, self.matrix.data
+
+	# The values stored at each (wks[i], wk2s[i]), 0 where there are none, found by a vectorised binary search of the
+	# rows' indices.  scipy's own point lookup scans whole rows unless asked for a large fraction of the entries.
+	def lookup(self, wks, wk2s):
+		wks, wk2s = np.asarray(wks, dtype=np.int64), np.asarray(wk2s, dtype=np.int64)
+		if not self.matrix.has_sorted_indices or not self.matrix.nnz:
+			return np.asarray(self.matrix[wks, wk2s], dtype=np.float64).ravel()
+		indices = self.matrix.indices
+		last = len(indices) - 1
+		lo, end = self.matrix.indptr[wks].astype(np.int64), self.matrix.indptr[wks + 1].astype(np.int64)
+		hi = end.copy()
+		searching = lo < hi
+		while searching.any():
+			mid = (lo + hi) // 2
+			right = indices[np.minimum(mid, last)] < wk2s
+			lo = np.where(searching & right, mid + 1, lo)
+			hi = np.where(searching & ~right, mid, hi)
+			searching = lo < hi
+		found = (lo < end) & (indices[np.minimum(lo, last)] == wk2s)
+		return np.where(found, self.matrix.data[np.minimum(lo, last)], 0).astype(np.float64)
+
+# Array-backed {from_id: to_id} mapping (e.g. between global and per-famcat word ids); entries holding -1 are absent
+class IdMap(object):
+	def __init__(self, array):
+		self.array = array
+
+	def __getitem__(self, k):
+		if isinstance(k, numbers.Integral) and 0 <= k < len(self.array) and self.array[k] >= 0:
+			return int(self.array[k])
+		raise KeyError(k)
+
+	def get(self, k, default=None):
+		return self[k] if k in self else default
+
+	def __contains__(self, k):
+		return isinstance(k, numbers.Integral) and 0 <= k < len(self.array) and self.array[k] >= 0
+
+	def __len__(self):
+		return int(np.count_nonzero(self.array >= 0))
+
+	def __iter__(self):
+		return iter(np.flatnonzero(self.array >= 0).tolist())
+
+	def keys(self):
+		return list(self)
+
+	def iteritems(self):
+		return ((k, int(self.array[k])) for k in self)
+
+	def items(self):
+		return list(self.iteritems())
+
+	iterkeys = __iter__
+
+	# The reverse mapping over to_ids [0, size)
+	def inverse(self, size):
+		inverse = np.full(size, -1, dtype=np.int32)
+		keys = np.flatnonzero(self.array >= 0)
+		inverse[self.array[keys]] = keys
+		return IdMap(inverse)
+
+# Document-frequency array, viewable as the {token: count} dict it replaces.  Counts are indexed by token id,
+# or, for a famcat, by the famcat's local ids given local_to_global; tokens outside the famcat raise KeyError.
+# Lookups accept either the token string or its integer (local) id.
+class WordOccurrence(object):
+	def __init__(self, counts, dictionary, local_to_global=None):
+		self.counts = counts
+		self.dictionary = dictionary
+		self.local_to_global = local_to_global
+		if local_to_global is not None:
+			self.global_to_local = IdMap(local_to_global).inverse(len(dictionary))
+
+	def _id(self, k):
+		if isinstance(k, numbers.Integral):
+			if not 0 <= k < len(self.counts):
+				raise KeyError(k)
+			return k
+		if self.local_to_global is None:
+			return self.dictionary.token2id[k]
+		return self.global_to_local[self.dictionary.token2id[k]]
+
+	def _token(self, wk):
+		return self.dictionary[wk if self.local_to_global is None else int(self.local_to_global[wk])]
+
+	def __getitem__(self, k):
+		return float(self.counts[self._id(k)])
+
+	def get(self, k, default=None):
+		try:
+			return self[k]
+		except KeyError:
+			return default
+
+	def __contains__(self, k):
+		try:
+			self._id(k)
+		except KeyError:
+			return False
+		return True
+
+	def __len__(self):
+		return len(self.counts)
+
+	def __iter__(self):
+		return (self._token(wk) for wk in range(len(self.counts)))
+
+	def keys(self):
+		return list(self)
+
+	def iteritems(self):
+		return ((self._token(wk), float(c)) for wk,c in enumerate(self.counts))
+
+	def items(self):
+		return list(self.iteritems())
+
+	iterkeys = __iter__
+
+# BoW documents stored as a (documents x words) CSR matrix of counts, behaving like the list of
+# doc2bow [(wk, wc), ...] lists it replaces.
+class BowCorpus(object):
+	def __init__(self, indices, counts, indptr, n_words):
+		self.matrix = sparse.csr_matrix((counts, indices, indptr), shape=(len(indptr)-1, n_words))
+
+	def __len__(self):
+		return self.matrix.shape[0]
+
+	def __getitem__(self, i):
+		start, end = self.matrix.indptr[i], self.matrix.indptr[i+1]
+		return zip(self.matrix.indices[start:end].tolist(), self.matrix.data[start:end].tolist())
+
+	def __iter__(self):
+		return (self[i] for i in range(len(self)))
+
+# Stack BoW documents into a (documents x words) CSR matrix of word counts
+def bow_matrix(documents, n_words):
+	if isinstance(documents, BowCorpus):
+		return documents.matrix
+	lengths = np.fromiter((len(doc) for doc in documents), dtype=np.int64, count=len(documents))
+	indptr = np.zeros(len(documents)+1, dtype=np.int64)
+	np.cumsum(lengths, out=indptr[1:])
+	indices = np.fromiter((wk for doc in documents for wk,wc in doc), dtype=np.int32, count=indptr[-1])
+	data = np.fromiter((wc for doc in documents for wk,wc in doc), dtype=np.float64, count=indptr[-1])
+	return sparse.csr_matrix((data, indices, indptr), shape=(len(documents), n_words))
+
+# Document co-occurrence counts of every word pair (diagonal excluded) and per-word document frequencies
+def sparse_cooccurrence(bow):
+	incidence = bow.copy()
+	incidence.data = np.ones(len(incidence.data), dtype=np.float64)
+	cooc = (incidence.T * incidence).tocoo()
+	off_diagonal = cooc.row != cooc.col
+	cooc = sparse.csr_matrix((cooc.data[off_diagonal], (cooc.row[off_diagonal], cooc.col[off_diagonal])), shape=cooc.shape)
+	cooc.sort_indices()
+	word_occurrence = np.asarray(incidence.sum(axis=0), dtype=np.float64).ravel()
+	return cooc, word_occurrence
+
+# Scale each row of the co-occurrence matrix by the document frequency of its word
+def normalise_rows(cooc, word_occurrence):
+	scale = np.where(word_occurrence > 0, 1.0/np.maximum(word_occurrence, 1.0), 0.0)
+	normalised = sparse.diags(scale) * cooc
+	normalised.sort_indices()
+	return normalised.tocsr()
+
+# Per-famcat co-occurrence over each famcat's own (local) word ids.  Local ids are handed out in order of
+# first appearance among the famcat's documents (by global id within a document), as the original dict
+# builder did.  Famcats listed in known_words (fc -> existing local_to_global) keep their ids and only new
+# words are appended, so the results can be added to counts built earlier.  builder(local_bow, i) counts the
+# i-th famcat (sparse_cooccurrence by default).  Returns {fc: (cooc, word_occurrence, local_to_global, n_docs)}.
+def famcat_cooccurrence(bow, doc_famcats, known_words=None, builder=None):
+	builder = builder or (lambda local_bow, i: sparse_cooccurrence(local_bow))
+	known_words = known_words or {}
+	famcats = {}
+	for d,fcs in enumerate(doc_famcats):
+		for fc in set(fcs):
+			famcats.setdefault(fc, []).append(d)
+	results = {}
+	for i,(fc,docs) in enumerate(famcats.iteritems()):
+		fc_bow = bow[np.array(docs)]
+		fc_bow.sort_indices()
+		if not fc_bow.nnz and fc not in known_words:
+			continue
+		words, first = np.unique(fc_bow.indices, return_index=True)
+		local_to_global = words[np.argsort(first, kind="mergesort")].astype(np.int32)
+		if fc in known_words:
+			known = np.asarray(known_words[fc], dtype=np.int32)
+			local_to_global = np.concatenate([known, local_to_global[~np.in1d(local_to_global, known)]])
+		global_to_local = IdMap(local_to_global).inverse(bow.shape[1]).array
+		local_bow = sparse.csr_matrix((fc_bow.data, global_to_local[fc_bow.indices], fc_bow.indptr), shape=(fc_bow.shape[0], len(local_to_global)))
+		local_bow.sort_indices()
+		cooc, word_occurrence = builder(local_bow, i)
+		results[fc] = (cooc, word_occurrence, local_to_global, float(len(docs)))
+	return results
+
+# Grow a square matrix to size x size with empty rows and columns
+def pad_square(matrix, size):
+	indptr = np.concatenate([matrix.indptr, np.repeat(matrix.indptr[-1], size - matrix.shape[0])])
+	return sparse.csr_matrix((matrix.data, matrix.indices, indptr), shape=(size, size))
+
+# The original dict-of-dicts builder, kept as the reference for benchmark()
+def dict_cooccurrence(documents, dictionary):
+	word_occurrence = {k:0.0 for k in dictionary.token2id.keys()}
+	cooccurrence = {wk:{} for wk in range(len(dictionary))}
+	for doc in documents:
+		for wk,wc in doc:
+			word_occurrence[dictionary[wk]] += 1.0
+			for wk2,wc2 in doc:
+				if wk != wk2:
+					try:
+						cooccurrence[wk][wk2] += 1.0
+					except KeyError:
+						cooccurrence[wk][wk2] = 1.0
+	return cooccurrence, word_occurrence
+
+def _benchmark_worker(name, builder, results):
+	rss_before = peak_rss_mb()
+	start = time.time()
+	builder()
+	results.put((name, time.time()-start, peak_rss_mb()-rss_before))
+
+# Time both builders on the same documents, each in its own forked process so that their peak RSS growth can be compared
+def benchmark(documents, dictionary):
+	builders = [("dict-of-dicts", lambda: dict_cooccurrence(documents, dictionary)),
+				("sparse", lambda: sparse_cooccurrence(bow_matrix(documents, len(dictionary))))]
+	results = multiprocessing.Queue()
+	report = {}
+	for name,builder in builders:
+		p = multiprocessing.Process(target=_benchmark_worker, args=(name, builder, results))
+		p.start()
+		name, seconds, rss = results.get()
+		p.join()
+		report[name] = (seconds, rss)
+		logger.info("   **** %s co-occurrence: %.2fs, peak RSS growth %.1f MB" % (name, seconds, rss))
+	return report
+
+if __name__ == "__main__":
+	import argparse
+	import preprocessor
+	parser = argparse.ArgumentParser(description="Compare the dict-of-dicts and sparse co-occurrence builders.")
+	parser.add_argument("inputfile", help='The ACMDL file path to work with (omit the ".csv")')
+	parser.add_argument("--no_below", default = 0.001, type=float,
+						help="Min fraction of documents a word must appear in to be included.")
+	parser.add_argument("--no_above", default = 0.5, type=float,
+						help="Max fraction of documents a word can appear in to be included.")
+	args = parser.parse_args()
+	reader = preprocessor.ACMDL_DocReader(args.inputfile, "title", "abstract", "ID")
+	reader.preprocess(no_below=args.no_below, no_above=args.no_above)
+	benchmark(reader.documents, reader.dictionary)
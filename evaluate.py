@@ -1,8 +1,11 @@
-import argparse, logging, scipy, itertools
+import argparse, collections, heapq, json, logging, multiprocessing, os, scipy, itertools, time
 
 import preprocessor
+import s_glove
+import vector_index
 
 import numpy as np
+from scipy import stats
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 logger = logging.getLogger("glovex")
@@ -14,29 +17,228 @@ def eval_dataset_surprise(model, acm, top_n_per_doc = 0, log_every=1000, ignore_
 	for id,title,doc,raw_doc in zip(acm.doc_ids, acm.doc_titles, acm.documents, acm.doc_raws):
 		if count and count % log_every == 0:
 			logger.info("    **** Evaluated "+str(count)+" documents.")
-		if len(doc):
-			surps = estimate_document_surprise_pairs(doc, model, acm, ignore_order=ignore_order)
-			if top_n_per_doc and len(surps) > top_n_per_doc:
-				surps = surps[:top_n_per_doc]
-			dataset_surps.append({"id": id,"title":title,"raw":raw_doc, "surprises":surps, "surprise": document_surprise(surps)})
-		else:
-			dataset_surps.append({"id": id,"title":title,"raw":raw_doc, "surprises":[], "surprise": float("inf")})
+		dataset_surps.append(document_record(id, title, doc, raw_doc, model, acm, top_n_per_doc))
 		count+=1
 	logger.info("  ** Evaluation complete.")
 	return dataset_surps
 
+def document_record(id, title, doc, raw_doc, model, acm, top_n_per_doc = 0):
+	if len(doc):
+		w1s, w2s, surps = estimate_document_pair_surprises(doc, model, acm.cooccurrence, acm.word_occurrence, acm.dictionary,
+														   len(acm.documents), use_sglove=acm.use_sglove, top_n=top_n_per_doc)
+		return {"id": id,"title":title,"raw":raw_doc, "surprises":surprise_tuples(w1s, w2s, surps, dictionary=acm.dictionary),
+				"surprise": document_surprise(surps)}
+	return {"id": id,"title":title,"raw":raw_doc, "surprises":[], "surprise": float("inf")}
+
+# Model, reader and top_n_per_doc the evaluation workers score documents with.  It is set before the pool forks, so the
+# workers share the model's arrays (and the reader's memory-mapped artifact) with this process instead of each
+# receiving a pickled copy.
+_evaluation = None
+
+# Records of documents [start, end) as JSON lines, with their surprises (inf for documents without pairs)
+def _evaluate_documents(chunk):
+	start, end = chunk
+	model, acm, top_n_per_doc = _evaluation
+	lines, surprises = [], []
+	for i in range(start, end):
+		record = document_record(acm.doc_ids[i], acm.doc_titles[i], acm.documents[i], acm.doc_raws[i], model, acm, top_n_per_doc)
+		surprises.append(record["surprise"])
+		if record["surprise"] == float("inf"):
+			record["surprise"] = None
+		lines.append(json.dumps(record))
+	return lines, surprises
+
+# Evaluate every document like eval_dataset_surprise, but on workers processes (default: all cores) that each score
+# chunks of chunk_size documents, streaming the records to the JSON-lines file at path in document order as they come
+# back (a document without pairs has a null surprise).  At most a few chunks per worker are in flight, so memory does
+# not grow with the corpus.  Returns the records of the top_docs most surprising documents.
+def eval_dataset_surprise_to_file(model, acm, path, top_n_per_doc = 25, workers=None, chunk_size=500, top_docs=10, log_every=10000):
+	global _evaluation
+	logger.info("  ** Evaluating dataset.")
+	start = time.time()
+	workers = workers or multiprocessing.cpu_count()
+	n_docs = len(acm.documents)
+	chunks = ((first, min(first + chunk_size, n_docs)) for first in range(0, n_docs, chunk_size))
+	top = TopN(top_docs)
+	count = 0
+	_evaluation = (model, acm, top_n_per_doc)
+	pool = None
+	try:
+		with open(path + ".tmp", "w") as f:
+			def write_chunk(first, lines, surprises):
+				for i,(line,surprise) in enumerate(zip(lines, surprises), first):
+					f.write(line + "\n")
+					if surprise != float("inf") and top.accepts(surprise):
+						top.add(i, surprise, json.loads(line))
+				if (first + len(lines)) // log_every > first // log_every:
+					logger.info("    **** Evaluated "+str(first + len(lines))+" documents.")
+				return len(lines)
+			if workers > 1:
+				pool = multiprocessing.Pool(workers)
+				pending = collections.deque()
+				for chunk in chunks:
+					pending.append((chunk[0], pool.apply_async(_evaluate_documents, (chunk,))))
+					if len(pending) > 2 * workers:
+						first, result = pending.popleft()
+						count += write_chunk(first, *result.get())
+				while pending:
+					first, result = pending.popleft()
+					count += write_chunk(first, *result.get())
+				pool.close()
+				pool.join()
+			else:
+				for chunk in chunks:
+					count += write_chunk(chunk[0], *_evaluate_documents(chunk))
+	except:
+		# Stop the workers still scoring and leave no partial file behind
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		if os.path.exists(path + ".tmp"):
+			os.remove(path + ".tmp")
+		raise
+	finally:
+		_evaluation = None
+	os.rename(path + ".tmp", path)
+	elapsed = max(time.time() - start, 1e-9)
+	logger.info("  ** Evaluation complete: %d documents in %.2fs on %d workers (%.0f documents/sec)." % (count, elapsed, workers, count / elapsed))
+	return top.items()
+
+# surps are (w1, w2, surprise) tuples or an array of surprises (or of rows of them, each giving a surprise).  Only the
+# two values around the percentile are selected (interpolated as np.percentile does), rather than sorting all of them.
 def document_surprise(surps, percentile=95):
 	if len(surps):
-		return np.percentile([x[2] for x in surps], 100-percentile) #note that percentile calculates the highest.
+		values = surps if isinstance(surps, np.ndarray) else np.array([x[2] for x in surps])
+		position = (100 - percentile) / 100.0 * (values.shape[-1] - 1) #note that percentile calculates the highest.
+		below = int(position)
+		selected = np.partition(values, below, axis=-1)
+		above = selected[..., below+1:].min(axis=-1) if below + 1 < values.shape[-1] else selected[..., below]
+		return selected[..., below] * (1.0 - (position - below)) + above * (position - below)
 	return float("inf")
 
+# The n items with the lowest scores of those added, keeping one item per key (later items with a key already kept
+# are ignored).  A bounded heap, so each item costs O(log n) rather than a sort of everything seen so far.
+class TopN(object):
+	def __init__(self, n):
+		self.n = n
+		self.heap = []
+		self.keys = set()
+		self.count = 0
+
+	def __len__(self):
+		return len(self.heap)
+
+	# Whether an item with this score would currently be kept
+	def accepts(self, score):
+		return self.n > 0 and (len(self.heap) < self.n or -score > self.heap[0][0])
+
+	def add(self, key, score, item):
+		if key in self.keys or not self.accepts(score):
+			return False
+		entry = (-score, -self.count, key, item)
+		self.count += 1
+		if len(self.heap) < self.n:
+			heapq.heappush(self.heap, entry)
+		else:
+			self.keys.discard(heapq.heapreplace(self.heap, entry)[2])
+		self.keys.add(key)
+		return True
+
+	# The kept items from lowest to highest score, ties in the order they were added
+	def items(self):
+		return [item for _,_,_,item in sorted(self.heap, reverse=True)]
+
 def estimate_document_surprise_pairs(doc, model, acm, top_n_per_doc = 0, ignore_order=True):
-	est_cooc_mat = estimate_document_cooccurrence_matrix(doc, model, acm.cooccurrence, use_sglove=acm.use_sglove)
-	surps = document_cooccurrence_to_surprise(doc, est_cooc_mat, acm.word_occurrence, acm.dictionary, len(acm.documents), ignore_order=ignore_order)
-	surps.sort(key = lambda x: x[2])
-	if top_n_per_doc and len(surps) > top_n_per_doc:
-		return surps[:top_n_per_doc]
-	return surps
+	w1s, w2s, surps = estimate_document_pair_surprises(doc, model, acm.cooccurrence, acm.word_occurrence, acm.dictionary, len(acm.documents),
+													   use_sglove=acm.use_sglove, top_n=top_n_per_doc)
+	return surprise_tuples(w1s, w2s, surps, acm.dictionary)
+
+# Estimated surprise of every pair of distinct words in doc (the top_n most surprising if given) as parallel (w1 ids,
+# w2 ids, surprises) arrays, most surprising first.  Gives what estimate_document_cooccurrence_matrix followed by
+# document_cooccurrence_to_surprise does, but scores the whole document with one matrix product and array operations
+# instead of pair by pair.
+def estimate_document_pair_surprises(doc, model, cooccurrence, word_occurrence, dictionary, n_docs, use_sglove = False, top_n = 0):
+	return most_surprising(*document_pair_surprises(doc, model, cooccurrence, word_occurrence, dictionary, n_docs, use_sglove), n=top_n)
+
+# The pairs of estimate_document_pair_surprises, unordered (in np.triu_indices order)
+def document_pair_surprises(doc, model, cooccurrence, word_occurrence, dictionary, n_docs, use_sglove = False):
+	ids = np.array([w for w,_ in doc], dtype=np.int64)
+	rows, cols = np.triu_indices(len(ids), k=1)
+	distinct = ids[rows] != ids[cols]
+	rows, cols = rows[distinct], cols[distinct]
+	est = (model.W[ids].dot(model.ContextW[ids].T) + model.b[ids] + model.ContextB[ids].T)[rows, cols]
+	if not use_sglove:
+		correct_rare_pairs(est, document_cooccurrences(ids, cooccurrence)[rows, cols], model)
+	if getattr(word_occurrence, "local_to_global", True) is None:
+		occurrence = np.asarray(word_occurrence.counts, dtype=np.float64)[ids]
+	else:
+		occurrence = np.array([word_occurrence[dictionary[w]] for w in ids], dtype=np.float64)
+	return ids[rows], ids[cols], pair_surprises(np.exp(est).astype(np.float64), occurrence[rows], occurrence[cols], n_docs)
+
+# document_pair_surprises of each of a batch of documents, as a list of (w1 ids, w2 ids, surprises).  The estimates of
+# the whole batch come from one stacked matrix product over the documents padded to the longest, and the observed
+# co-occurrences and surprises of all their pairs are looked up and computed together.
+def batch_pair_surprises(docs, model, cooccurrence, word_occurrence, dictionary, n_docs, use_sglove = False):
+	ids = [np.array([w for w,_ in doc], dtype=np.int64) for doc in docs]
+	padded = np.zeros((len(docs), max([len(doc_ids) for doc_ids in ids] + [1])), dtype=np.int64)
+	pairs = []
+	for i,doc_ids in enumerate(ids):
+		padded[i,:len(doc_ids)] = doc_ids
+		rows, cols = np.triu_indices(len(doc_ids), k=1)
+		distinct = doc_ids[rows] != doc_ids[cols]
+		pairs.append((np.full(np.count_nonzero(distinct), i, dtype=np.int64), rows[distinct], cols[distinct]))
+	docs_of_pairs, rows, cols = [np.concatenate(column) for column in zip(*pairs)]
+	w1s, w2s = padded[docs_of_pairs, rows], padded[docs_of_pairs, cols]
+	est = np.matmul(model.W[padded], model.ContextW[padded].transpose(0, 2, 1))[docs_of_pairs, rows, cols]
+	est += model.b[w1s, 0] + model.ContextB[w2s, 0]
+	if not use_sglove:
+		if hasattr(cooccurrence, "matrix"):
+			observed = cooccurrence.lookup(w1s, w2s)
+		else:
+			observed = np.array([cooccurrence[w1].get(w2, 0) for w1,w2 in zip(w1s.tolist(), w2s.tolist())], dtype=np.float64)
+		correct_rare_pairs(est, observed, model)
+	if getattr(word_occurrence, "local_to_global", True) is None:
+		occurrence = np.asarray(word_occurrence.counts, dtype=np.float64)
+	else:
+		occurrence = np.zeros(len(dictionary))
+		words = np.union1d(w1s, w2s)
+		occurrence[words] = [word_occurrence[dictionary[w]] for w in words.tolist()]
+	surprises = pair_surprises(np.exp(est).astype(np.float64), occurrence[w1s], occurrence[w2s], n_docs)
+	splits = np.cumsum([len(doc_rows) for _,doc_rows,_ in pairs])[:-1]
+	return zip(np.split(w1s, splits), np.split(w2s, splits), np.split(surprises, splits))
+
+# Correct estimated (log) co-occurrences est of pairs observed together observed times, in place, for the rare feature
+# scaling described in https://nlp.stanford.edu/pubs/glove.pdf.  The correction is undefined for pairs never observed
+# together, which are left as estimated.
+def correct_rare_pairs(est, observed, model):
+	rare = (observed > 0) & (observed < model.x_max)
+	est[rare] *= 1.0 / np.power(observed[rare] / model.x_max, model.alpha)
+	return est
+
+# The n (all if 0) most surprising of parallel word id and surprise arrays, most surprising first and ties in their
+# original order (of pairs tied at the cut, the first are kept, as a stable sort would).  Only the n are sorted, after
+# partially selecting the n-th surprise with np.partition.
+def most_surprising(w1s, w2s, surps, n = 0):
+	if n and n < len(surps):
+		cut = np.partition(surps, n - 1)[n - 1]
+		below = np.flatnonzero(surps < cut)
+		chosen = np.concatenate([below, np.flatnonzero(surps == cut)[:n - len(below)]])
+		order = chosen[np.lexsort((chosen, surps[chosen]))]
+	else:
+		order = np.argsort(surps, kind="mergesort")
+	return w1s[order], w2s[order], surps[order]
+
+# Observed co-occurrence counts between the words ids of a document, as a dense matrix
+def document_cooccurrences(ids, cooccurrence):
+	if hasattr(cooccurrence, "matrix"):
+		return cooccurrence.matrix[ids][:, ids].toarray()
+	return np.array([[cooccurrence[w1].get(w2, 0) for w2 in ids] for w1 in ids], dtype=np.float64)
+
+# The first top_n (all if 0) of parallel word id and surprise arrays as (w1, w2, surprise) tuples
+def surprise_tuples(w1s, w2s, surps, dictionary, top_n = 0):
+	if top_n:
+		w1s, w2s, surps = w1s[:top_n], w2s[:top_n], surps[:top_n]
+	return [(dictionary[w1], dictionary[w2], s) for w1,w2,s in zip(w1s.tolist(), w2s.tolist(), surps.tolist())]
 
 def word_pair_surprise(w1_w2_cooccurrence, w1_occurrence, w2_occurrence, n_docs, offset = 1):
 	# Offset is Laplacian smoothing
@@ -45,6 +247,11 @@ def word_pair_surprise(w1_w2_cooccurrence, w1_occurrence, w2_occurrence, n_docs,
 	p_w1 = (w1_occurrence + offset) / (n_docs + offset)
 	return p_w1_given_w2 / p_w1
 
+# word_pair_surprise over arrays of estimated co-occurrences and word occurrences
+def pair_surprises(w1_w2_cooccurrence, w1_occurrence, w2_occurrence, n_docs, offset = 1):
+	w1_w2_cooccurrence = np.minimum(np.minimum(w1_occurrence, w2_occurrence), np.fmax(0, w1_w2_cooccurrence))
+	return ((w1_w2_cooccurrence + offset) / (w2_occurrence + offset)) / ((w1_occurrence + offset) / (np.asarray(n_docs, dtype=np.float64) + offset))
+
 def extract_document_cooccurrence_matrix(doc, coocurrence):
 	cooc_mat = np.zeros([len(doc),len(doc)])
 	for i1,i2 in itertools.combinations(range(len(doc)),2):
@@ -65,7 +272,7 @@ def estimate_word_pair_cooccurrence(wk1, wk2, model, cooccurrence, use_sglove =
 	return cooc[0]
 
 def estimate_document_cooccurrence_matrix(doc, model, cooccurrence, use_sglove = False):
-	cooc_mat = np.zeros([len(doc),len(doc)])
+	cooc_mat = np.zeros([len(doc),len(doc)], dtype=model.W.dtype)
 	for i1,i2 in itertools.combinations(range(len(doc)),2):
 		d1 = doc[i1][0]
 		d2 = doc[i2][0]
@@ -74,10 +281,10 @@ def estimate_document_cooccurrence_matrix(doc, model, cooccurrence, use_sglove =
 
 def top_n_surps_from_doc(doc, model, cooccurrence, word_occurrence, dictionary, n_docs, top_n = 10, use_sglove = False):
 	if len(doc):
-		est_cooc_mat = estimate_document_cooccurrence_matrix(doc,model,cooccurrence, use_sglove=use_sglove)
-		surps = document_cooccurrence_to_surprise(doc, est_cooc_mat, word_occurrence, dictionary, n_docs)
-		surps.sort(key = lambda x: x[2], reverse=False)
-		return surps[:min(top_n,len(surps))]
+		if top_n <= 0:
+			return []
+		return surprise_tuples(*estimate_document_pair_surprises(doc, model, cooccurrence, word_occurrence, dictionary, n_docs, use_sglove=use_sglove,
+																 top_n=top_n), dictionary=dictionary)
 	else:
 		return []
 
@@ -93,43 +300,85 @@ def document_cooccurrence_to_surprise(doc, cooc_mat, word_occurrence, dictionary
 	surp_list.sort(key = lambda x: x[2], reverse=False)
 	return surp_list
 
+# Nearest-neighbour index over the surprises of surp_list by the vector of their feature word (i.e. w1, "features"), of
+# their context word (i.e. w2, "contexts") or by their vector difference ("differences"), for repeated most_similar_*
+# queries.  Exact by default; with n_lists, approximate through a vector_index.VectorIndex of that many lists.
+class SimilarSurprises(object):
+	def __init__(self, surp_list, model, dictionary, kind="differences", n_lists=0, n_probe=8):
+		self.surps = list(surp_list)
+		self.model = model
+		self.dictionary = dictionary
+		self.kind = kind
+		self.positions = collections.defaultdict(list)
+		for i,surp in enumerate(self.surps):
+			self.positions[surp[:2]].append(i)
+		self.vectors = self._vectors(self.surps)
+		self.index = vector_index.VectorIndex(self.vectors, n_lists=n_lists, n_probe=n_probe)
+
+	def _vectors(self, surps):
+		token2id = self.dictionary.token2id
+		if self.kind == "features":
+			return self.model.W[[token2id[surp[0]] for surp in surps]]
+		if self.kind == "contexts":
+			return self.model.W[[token2id[surp[1]] for surp in surps]]
+		return self.model.W[[token2id[surp[0]] for surp in surps]] - self.model.W[[token2id[surp[1]] for surp in surps]]
+
+	# The n (all if 0) surprises most similar to surp, in the form most_similar_features/contexts/differences return
+	def most_similar(self, surp, n = 10):
+		vector = self._vectors([surp])[0]
+		n = n or len(self.surps)
+		indices, distances = self.index.search(vector, n, exclude=[self.positions.get(surp[:2], [])])
+		results = []
+		for i,distance in zip(indices[0].tolist(), distances[0].tolist()):
+			if i < 0:
+				break
+			if self.kind == "differences":
+				results.append([surp, self.surps[i], vector, self.vectors[i], distance])
+			else:
+				results.append([surp, self.surps[i], distance])
+		return results
+
 #Return the surprises from the given list that have the most similar feature word (i.e. w1) to the one in the given surp.
 def most_similar_features(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_feat = model.W[dictionary.token2id[surp[0]]]
-			surp2_feat = model.W[dictionary.token2id[surp2[0]]]
-			results.append([surp,surp2,scipy.spatial.distance.euclidean(surp_feat, surp2_feat)])
-	results.sort(key = lambda x: x[2])
-	if n and n < len(results):
-		return results[:n]
-	return results
+	return SimilarSurprises(surp_list, model, dictionary, "features").most_similar(surp, n)
 
 #Return the surprises from the given list that have the most similar context word(s) (i.e. w2) to the one in the given surp.
 def most_similar_contexts(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_context = model.W[dictionary.token2id[surp[1]]]
-			surp2_context = model.W[dictionary.token2id[surp2[1]]]
-			results.append([surp,surp2,scipy.spatial.distance.euclidean(surp_context, surp2_context)])
-	results.sort(key = lambda x: x[2])
-	if n and n < len(results):
-		return results[:n]
-	return results
+	return SimilarSurprises(surp_list, model, dictionary, "contexts").most_similar(surp, n)
 
 #Return the surprises from the given list that have the most similar vector difference to the one in the given surp.
 def most_similar_differences(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_diff = model.W[dictionary.token2id[surp[0]]] -  model.W[dictionary.token2id[surp[1]]]
-			surp2_diff = model.W[dictionary.token2id[surp2[0]]] -  model.W[dictionary.token2id[surp2[1]]]
-			results.append([surp,surp2,surp_diff,surp2_diff,scipy.spatial.distance.euclidean(surp_diff, surp2_diff)])
-	results.sort(key = lambda x: x[4])
-	if n and n < len(results):
-		return results[:n]
+	return SimilarSurprises(surp_list, model, dictionary, "differences").most_similar(surp, n)
+
+# Surprise of word pairs (rows[i], cols[i]) estimated by an s_glove model, as word_pair_surprise does pair by pair
+def estimate_pair_surprises(rows, cols, model, word_occurrence, n_docs, offset = 1):
+	est = np.exp(np.einsum("ij,ij->i", model.W[rows], model.ContextW[cols]) + model.b[rows,0] + model.ContextB[cols,0]).astype(np.float64)
+	return pair_surprises(est, word_occurrence[rows], word_occurrence[cols], n_docs, offset)
+
+# Train float64 and float32 s_glove models from the same initialisation and compare their final error and the
+# surprise they estimate for (a sample of at most sample) co-occurring pairs: Spearman rank correlation and overlap
+# of the top_n most surprising pairs.  Also reports time and parameter memory per precision.
+def compare_precision(acm, dims=100, epochs=25, step_size=0.1, step_size_decay=25.0, workers=None, top_n=1000, sample=1000000, seed=1234):
+	rows, cols, _ = acm.cooccurrence.pairs()
+	if len(rows) > sample:
+		chosen = np.sort(np.random.RandomState(seed).choice(len(rows), sample, replace=False))
+		rows, cols = rows[chosen], cols[chosen]
+	results = {}
+	for dtype in (np.float64, np.float32):
+		model = s_glove.Glove(acm.cooccurrence, acm.cooccurrence_p_values, d=dims, dtype=dtype, seed=seed)
+		start = time.time()
+		errors = model.train_epochs(epochs, step_size, step_size_decay, workers=workers)
+		params = (model.W, model.ContextW, model.b, model.ContextB, model.gradsqW, model.gradsqContextW, model.gradsqb, model.gradsqContextB)
+		results[np.dtype(dtype).name] = {"error": errors[-1], "seconds": time.time() - start, "bytes": sum(a.nbytes for a in params),
+										 "surprises": estimate_pair_surprises(rows, cols, model, acm.word_occurrence.counts, len(acm.documents))}
+	s64, s32 = results["float64"].pop("surprises"), results["float32"].pop("surprises")
+	top_n = min(top_n, len(s64))
+	results["spearman"] = stats.spearmanr(s64, s32).correlation
+	results["top_n_overlap"] = len(set(np.argsort(s64, kind="mergesort")[:top_n]) & set(np.argsort(s32, kind="mergesort")[:top_n])) / float(max(top_n, 1))
+	results["max_relative_difference"] = float(np.max(np.abs(s32 - s64) / np.abs(s64)))
+	for name in ("float64", "float32"):
+		logger.info("   **** %s: final error %.6f, %.2fs, %.1f MB of parameters" % (name, results[name]["error"], results[name]["seconds"], results[name]["bytes"]/2.0**20))
+	logger.info("   **** Surprise of %d pairs: Spearman %.6f, top-%d overlap %.4f, max relative difference %.2e" % (len(s64), results["spearman"], top_n, results["top_n_overlap"], results["max_relative_difference"]))
 	return results
 
 if __name__ == "__main__":
@@ -139,20 +388,43 @@ if __name__ == "__main__":
 						help="Min fraction of documents a word must appear in to be included.")
 	parser.add_argument("--no_above", default = 0.75, type=float,
 						help="Max fraction of documents a word can appear in to be included.")
+	parser.add_argument("--compare_precision", action="store_true",
+						help="Instead of evaluating, train s_glove in float64 and float32 and compare the results.")
+	parser.add_argument("--dims", default = 100, type=int, help="The number of dimensions in the GloVe vectors (--compare_precision).")
+	parser.add_argument("--epochs", default = 25, type=int, help="The number of epochs to train GloVe for (--compare_precision).")
+	parser.add_argument("--output", default=None, type=str,
+						help="Stream every document's surprises to this JSON-lines file, evaluating on --workers processes.")
+	parser.add_argument("--workers", default=None, type=int, help="Number of processes used with --output (default: all cores).")
+	parser.add_argument("--similarity_lists", default=0, type=int,
+						help="Find similar surprises approximately, through an inverted index of this many lists (default: exactly).")
 	args = parser.parse_args()
-	acm = preprocessor.ACMDL_DocReader(args.inputfile)
+	acm = preprocessor.ACMDL_DocReader(args.inputfile, "title", "abstract", "ID", use_sglove=args.compare_precision)
 	acm.preprocess(no_below=args.no_below, no_above=args.no_above)
+	if args.compare_precision:
+		if not len(acm.cooccurrence_p_values):
+			acm.calc_cooccurrence_significance_parallel()
+		compare_precision(acm, dims=args.dims, epochs=args.epochs)
+		raise SystemExit
 	model = preprocessor.glovex_model(args.inputfile, acm.argstring, acm.cooccurrence)
 	logger.info(" ** Loaded GloVe")
-	dataset_surps = eval_dataset_surprise(model, acm, top_n_per_doc=25)
-	dataset_surps.sort(key = lambda x: x["surprise"])
+	if args.output:
+		# Only the most surprising documents are kept in memory, so similar surprises are looked for among theirs
+		dataset_surps = eval_dataset_surprise_to_file(model, acm, args.output, top_n_per_doc=25, workers=args.workers)
+		for doc in dataset_surps:
+			doc["surprises"] = [tuple(p) for p in doc["surprises"]]
+	else:
+		dataset_surps = eval_dataset_surprise(model, acm, top_n_per_doc=25)
 	unique_surps = set((p for s in dataset_surps for p in s["surprises"]))
-	for doc in dataset_surps[:10]:
+	similar = SimilarSurprises(unique_surps, model, acm.dictionary, "differences", n_lists=args.similarity_lists)
+	top_docs = TopN(10)
+	for i,doc in enumerate(dataset_surps):
+		top_docs.add(i, doc["surprise"], doc)
+	for doc in top_docs.items():
 		print doc["id"]+":", doc["title"]
 		print "  ** 95th percentile surprise:",doc["surprise"]
 		print "  ** Abstract:",doc["raw"]
 		print "  ** Surprising pairs:",doc["surprises"]
-		most_similar = most_similar_differences(doc["surprises"][0],unique_surps,model, acm.dictionary)
+		most_similar = similar.most_similar(doc["surprises"][0])
 		print "  ** Most similar to top surprise:("+str(doc["surprises"][0])+")"
 		for pair in most_similar:
 			print "    ** ",pair[4],":",pair[1]
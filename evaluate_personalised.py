@@ -1,32 +1,118 @@
-import argparse, logging, scipy, itertools, random, sys
+import argparse, logging, scipy, itertools, random, sys, time
 
 import preprocessor
+import evaluate
+from evaluate import most_similar_features, most_similar_contexts, most_similar_differences
 
 import numpy as np
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 logger = logging.getLogger("glovex")
 
-def eval_personalised_dataset_surprise(models, acm, user, log_every=1000, ignore_order=True):
+# Score every document for every user (a famcat familiarity profile, or a users x famcats matrix of them) at once.
+# Returns, for each user, the records of their top_docs most surprising documents, most surprising first, each with its
+# top_n_per_doc pairs by combined surprise.
+def eval_personalised_dataset_surprise(models, acm, users, top_n_per_doc=25, top_docs=10, log_every=1000):
 	logger.info("  ** Evaluating dataset..")
-	dataset_surps = []
-	count = 0
-	for id,title,doc,raw_doc in zip(acm.doc_ids, acm.doc_titles, acm.documents, acm.doc_raws):
-		if count and count % log_every == 0:
-			logger.info("    **** Evaluated "+str(count)+" documents.")
-		if len(doc):
-			surps = estimate_personalised_document_surprise_pairs(doc, models, acm, user, ignore_order=ignore_order)
-			dataset_surps.append({"id": id,"title":title,"raw":raw_doc, "surprises":surps, "surprise": document_surprise(surps)})
-		else:
-			dataset_surps.append({"id": id,"title":title,"raw":raw_doc, "surprises":[], "surprise": float("inf")})
-		count+=1
-	logger.info("  ** Evaluation complete.")
-	return dataset_surps
-
-def document_surprise(surps, percentile=95):
-	if len(surps):
-		return np.percentile([x[2] for x in surps], 100-percentile) #note that percentile calculates the highest.
-	return float("inf")
+	start = time.time()
+	scorer = PersonalisedScorer(models, acm)
+	users = np.atleast_2d(np.asarray(users, dtype=np.float64))
+	best = np.full((len(users), top_docs), np.inf)
+	best_docs = np.full((len(users), top_docs), -1, dtype=np.int64)
+	for i,doc in enumerate(acm.documents):
+		if i and i % log_every == 0:
+			logger.info("    **** Evaluated "+str(i)+" documents.")
+		_, _, combined = scorer.combined_surprises(doc, users)
+		if combined.shape[1]:
+			# Keep each user's top_docs lowest document surprises, earlier documents first among ties
+			candidates = np.concatenate([best, evaluate.document_surprise(combined)[:, None]], axis=1)
+			candidate_docs = np.concatenate([best_docs, np.full((len(users), 1), i)], axis=1)
+			chosen = np.sort(np.argsort(candidates, axis=1, kind="mergesort")[:, :top_docs], axis=1)
+			best, best_docs = np.take_along_axis(candidates, chosen, 1), np.take_along_axis(candidate_docs, chosen, 1)
+	results = [[] for _ in users]
+	for i in np.unique(best_docs[best_docs >= 0]).tolist():
+		w1s, w2s, combined = scorer.combined_surprises(acm.documents[i], users)
+		for u in np.flatnonzero((best_docs == i).any(axis=1)).tolist():
+			pairs = evaluate.surprise_tuples(*evaluate.most_surprising(w1s, w2s, combined[u], top_n_per_doc), dictionary=acm.dictionary)
+			results[u].append({"id": acm.doc_ids[i], "title": acm.doc_titles[i], "raw": acm.doc_raws[i], "surprises": pairs,
+							   "surprise": evaluate.document_surprise(combined[u])})
+	for records in results:
+		records.sort(key = lambda x: x["surprise"])
+	logger.info("  ** Evaluation complete: %d documents for %d users in %.2fs." % (len(acm.documents), len(users), time.time()-start))
+	return results
+
+# All famcat models stacked over the global vocabulary, so that a document is scored by every famcat in a few batched
+# operations.  Slice f of each array holds famcat f's parameters for every global word id, zero (and not present)
+# where the famcat's model has no such word.
+class PersonalisedScorer(object):
+	def __init__(self, models, acm, offset=0.5):
+		self.famcats = list(acm.famcats)
+		self.offset = offset
+		n_words = len(acm.dictionary)
+		dims = models[0].W.shape[1]
+		dtype = np.result_type(*[model.W.dtype for model in models])
+		self.W = np.zeros((len(models), n_words, dims), dtype=dtype)
+		self.ContextW = np.zeros((len(models), n_words, dims), dtype=dtype)
+		self.b = np.zeros((len(models), n_words), dtype=dtype)
+		self.ContextB = np.zeros((len(models), n_words), dtype=dtype)
+		self.occurrence = np.zeros((len(models), n_words))
+		self.local = np.full((len(models), n_words), -1, dtype=np.int64)
+		self.cooccurrence = []
+		for f,(model,fc) in enumerate(zip(models, self.famcats)):
+			local_to_global = np.asarray(acm.per_fc_keys_to_all_keys[fc].array)
+			known = np.flatnonzero(local_to_global >= 0)
+			words = local_to_global[known]
+			self.W[f, words] = model.W[known]
+			self.ContextW[f, words] = model.ContextW[known]
+			self.b[f, words] = model.b[known, 0]
+			self.ContextB[f, words] = model.ContextB[known, 0]
+			self.occurrence[f, words] = np.asarray(acm.word_occurrence[fc].counts)[known]
+			self.local[f, words] = known
+			self.cooccurrence.append(acm.cooccurrence[fc])
+		self.present = self.local >= 0
+		self.n_docs = np.array([acm.docs_per_fc[fc] for fc in self.famcats], dtype=np.float64)
+		self.x_max = np.array([model.x_max for model in models], dtype=np.float64)
+		self.alpha = np.array([model.alpha for model in models], dtype=np.float64)
+
+	# Observed co-occurrence counts between the words ids in each famcat (famcats x len(ids) x len(ids)), offset where
+	# a famcat has no count for a pair
+	def _observed(self, ids):
+		observed = np.zeros((len(self.famcats), len(ids), len(ids)))
+		for f,cooccurrence in enumerate(self.cooccurrence):
+			local = self.local[f, ids]
+			known = np.flatnonzero(local >= 0)
+			observed[f][np.ix_(known, known)] = evaluate.document_cooccurrences(local[known], cooccurrence)
+		observed[observed == 0] = self.offset
+		return observed
+
+	# Surprise of every pair of distinct words in doc according to each famcat, as parallel w1 ids, w2 ids and a
+	# famcats x pairs array, nan where a famcat's model lacks either word.  Pairs are ordered and estimated as
+	# estimate_personalised_document_surprise_pairs does one by one.
+	def famcat_surprises(self, doc):
+		ids = np.array([w for w,_ in doc], dtype=np.int64)
+		rows, cols = np.triu_indices(len(ids), k=1)
+		distinct = ids[rows] != ids[cols]
+		rows, cols = rows[distinct], cols[distinct]
+		est = np.matmul(self.W[:, ids], self.ContextW[:, ids].transpose(0, 2, 1))[:, rows, cols]
+		est = est + self.b[:, ids][:, rows] + self.ContextB[:, ids][:, cols]
+		# correct for the rare feature scaling described in https://nlp.stanford.edu/pubs/glove.pdf
+		observed = self._observed(ids)[:, rows, cols]
+		rare = observed < self.x_max[:, None]
+		est[rare] *= (1.0 / np.power(observed / self.x_max[:, None], self.alpha[:, None]))[rare]
+		occurrence = self.occurrence[:, ids]
+		with np.errstate(over="ignore"):
+			surprises = evaluate.pair_surprises(np.exp(est).astype(np.float64), occurrence[:, rows], occurrence[:, cols], self.n_docs[:, None],
+												offset=self.offset)
+		surprises[~(self.present[:, ids][:, rows] & self.present[:, ids][:, cols])] = np.nan
+		return ids[rows], ids[cols], surprises
+
+	# The famcat surprises of doc's pairs combined for each of users (a users x famcats matrix of familiarity profiles)
+	# by weighted sum, in one product: parallel w1 ids, w2 ids and a users x pairs array.  Pairs no famcat knows are left out.
+	def combined_surprises(self, doc, users):
+		w1s, w2s, surprises = self.famcat_surprises(doc)
+		known = ~np.isnan(surprises)
+		scored = known.any(axis=0)
+		return w1s[scored], w2s[scored], np.dot(users, np.where(known, surprises, 0.0)[:, scored])
 
 #Investigate whether we need to rekey the document rather than the cooc
 def estimate_personalised_document_surprise_pairs(doc, models, acm, user, top_n_per_doc = 0, ignore_order=True):
@@ -111,45 +197,6 @@ def document_cooccurrence_to_surprise(surps, fc, doc, cooc_mat, word_occurrence,
 			else:
 				surps[key_map[w1]][key_map[w2]].append((fc,s))
 
-#Return the surprises from the given list that have the most similar feature word (i.e. w1) to the one in the given surp.
-def most_similar_features(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_feat = model.W[dictionary.token2id[surp[0]]]
-			surp2_feat = model.W[dictionary.token2id[surp2[0]]]
-			results.append([surp,surp2,scipy.spatial.distance.euclidean(surp_feat, surp2_feat)])
-	results.sort(key = lambda x: x[2])
-	if n and n < len(results):
-		return results[:n]
-	return results
-
-#Return the surprises from the given list that have the most similar context word(s) (i.e. w2) to the one in the given surp.
-def most_similar_contexts(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_context = model.W[dictionary.token2id[surp[1]]]
-			surp2_context = model.W[dictionary.token2id[surp2[1]]]
-			results.append([surp,surp2,scipy.spatial.distance.euclidean(surp_context, surp2_context)])
-	results.sort(key = lambda x: x[2])
-	if n and n < len(results):
-		return results[:n]
-	return results
-
-#Return the surprises from the given list that have the most similar vector difference to the one in the given surp.
-def most_similar_differences(surp, surp_list, model, dictionary, n = 10):
-	results = []
-	for surp2 in surp_list:
-		if not surp[:2] == surp2[:2]:
-			surp_diff = model.W[dictionary.token2id[surp[0]]] -  model.W[dictionary.token2id[surp[1]]]
-			surp2_diff = model.W[dictionary.token2id[surp2[0]]] -  model.W[dictionary.token2id[surp2[1]]]
-			results.append([surp,surp2,surp_diff,surp2_diff,scipy.spatial.distance.euclidean(surp_diff, surp2_diff)])
-	results.sort(key = lambda x: x[4])
-	if n and n < len(results):
-		return results[:n]
-	return results
-
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Evaluate a dataset using a trained GloVex model.")
 	parser.add_argument("inputfile", help='The input file path to work with (omit the args and suffix)')
@@ -157,27 +204,25 @@ if __name__ == "__main__":
 						help="Min fraction of documents a word must appear in to be included.")
 	parser.add_argument("--no_above", default = 0.75, type=float,
 						help="Max fraction of documents a word can appear in to be included.")
+	parser.add_argument("--familiarity_categories", default=None, type=str,
+						help='The path to the file containing IDs and familiarity categories (omit the ".csv")')
+	parser.add_argument("--use_sglove", action="store_true", help="Evaluate the models trained with the modified version of GloVe.")
+	parser.add_argument("--users", default=1, type=int, help="The number of (fake) user familiarity profiles to evaluate for.")
 	args = parser.parse_args()
-	acm = preprocessor.ACMDL_DocReader(args.inputfile,"title", "abstract", "ID")
+	acm = preprocessor.ACMDL_DocReader(args.inputfile,"title", "abstract", "ID", famcat_path=args.familiarity_categories, use_sglove=args.use_sglove)
 	acm.preprocess(no_below=args.no_below, no_above=args.no_above)
 	models = preprocessor.load_personalised_models(args.inputfile, acm)
 	logger.info(" ** Loaded GloVe")
 
-	user = [random.random() for fc in acm.famcats]
-	logger.info(" ** Generated fake user familiarity profile: "+", ".join([str(fc)+": "+str(f) for f,fc in zip(user,acm.famcats)]))
+	users = [[random.random() for fc in acm.famcats] for u in range(args.users)]
+	for user in users[:10]:
+		logger.info(" ** Generated fake user familiarity profile: "+", ".join([str(fc)+": "+str(f) for f,fc in zip(user,acm.famcats)]))
 
-	dataset_surps = eval_personalised_dataset_surprise(models, acm, user, top_n_per_doc=25)
-	dataset_surps.sort(key = lambda x: x["surprise"])
-	unique_surps = set((p for s in dataset_surps for p in s["surprises"]))
-	for doc in dataset_surps[:10]:
+	dataset_surps = eval_personalised_dataset_surprise(models, acm, users, top_n_per_doc=25)
+	for doc in dataset_surps[0]:
 		print doc["id"]+":", doc["title"]
 		print "  ** 95th percentile surprise:",doc["surprise"]
 		print "  ** Abstract:",doc["raw"]
 		print "  ** Surprising pairs:",doc["surprises"]
-		most_similar = most_similar_differences(doc["surprises"][0],unique_surps,model, acm.dictionary)
-		print "  ** Most similar to top surprise:("+str(doc["surprises"][0])+")"
-		for pair in most_similar:
-			print "    ** ",pair[4],":",pair[1]
 		print
 
-
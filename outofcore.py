@@ -0,0 +1,125 @@
+import logging, os, shutil, struct, time
+import numpy as np
+from scipy import sparse
+
+import cooccurrence
+
+logger = logging.getLogger("glovex")
+
+# Rough bytes of memory needed per co-occurrence entry while it is counted or merged (row/col/count arrays
+# plus the workspace of scipy's sparse product and duplicate summing)
+BYTES_PER_PAIR = 48
+
+# Fixed size of the .npy headers written by NpyWriter, so the header can be rewritten once the length is known
+HEADER_SIZE = 128
+
+# Writes a 1-d .npy file piece by piece without holding it in memory.  The header is written up front with
+# room to spare and rewritten with the final length by close(); the file can then be loaded with np.load(mmap_mode="r").
+class NpyWriter(object):
+	def __init__(self, path, dtype):
+		self.path = path
+		self.dtype = np.dtype(dtype)
+		self.count = 0
+		self.f = open(path, "wb")
+		self._write_header()
+
+	def _write_header(self):
+		header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (self.dtype.str, self.count)
+		header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+		self.f.seek(0)
+		self.f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header)
+
+	def write(self, array):
+		array = np.ascontiguousarray(array, dtype=self.dtype)
+		self.f.seek(0, 2)
+		array.tofile(self.f)
+		self.count += len(array)
+
+	def close(self):
+		self._write_header()
+		self.f.close()
+		return np.load(self.path, mmap_mode="r")
+
+# In-memory counterpart of NpyWriter
+class ArrayWriter(object):
+	def __init__(self, dtype):
+		self.dtype = np.dtype(dtype)
+		self.arrays = []
+
+	def write(self, array):
+		self.arrays.append(np.asarray(array, dtype=self.dtype))
+
+	def close(self):
+		return np.concatenate(self.arrays) if self.arrays else np.zeros(0, dtype=self.dtype)
+
+# Number of pairs a memory budget of memory_mb allows in memory at once
+def pair_budget(memory_mb):
+	return max(int(memory_mb * 2**20 / BYTES_PER_PAIR), 1)
+
+# Consecutive [start, end) ranges over items with the given costs, each costing at most budget where possible
+def batches(costs, budget):
+	ends = np.cumsum(costs)
+	start = 0
+	while start < len(costs):
+		end = np.searchsorted(ends, (ends[start-1] if start else 0) + budget, side="right")
+		end = max(end, start+1)
+		yield start, end
+		start = end
+
+# Document co-occurrence counts of every word pair (diagonal excluded) and per-word document frequencies, like
+# cooccurrence.sparse_cooccurrence, but built in bounded memory.  Batches of documents whose pairs fit the budget
+# are counted into sorted CSR runs (shards) on disk; the shards are then merged block by block of rows into the
+# final CSR arrays in directory, which are returned memory-mapped.
+def external_cooccurrence(bow, directory, memory_mb=1024):
+	start_time = time.time()
+	budget = pair_budget(memory_mb)
+	n_words = bow.shape[1]
+	shard_path = os.path.join(directory, "shards")
+	if os.path.exists(shard_path):
+		shutil.rmtree(shard_path)
+	os.makedirs(shard_path)
+	lengths = np.diff(bow.indptr)
+	word_occurrence = np.zeros(n_words)
+	row_bound = np.zeros(n_words, dtype=np.int64)
+	shards = []
+	for start, end in batches(lengths * lengths, budget):
+		cooc, batch_occurrence = cooccurrence.sparse_cooccurrence(bow[start:end])
+		word_occurrence += batch_occurrence
+		if not cooc.nnz:
+			continue
+		name = os.path.join(shard_path, "%d" % len(shards))
+		np.save(name+".indptr.npy", cooc.indptr.astype(np.int64))
+		np.save(name+".indices.npy", cooc.indices.astype(np.int32))
+		np.save(name+".data.npy", cooc.data.astype(np.int32))
+		row_bound += np.diff(cooc.indptr)
+		shards.append(name)
+	logger.info("   **** Counted %d documents into %d co-occurrence shards in %.2fs" % (len(lengths), len(shards), time.time()-start_time))
+	matrix = merge_shards(shards, n_words, directory, "cooccurrence", row_bound, budget)
+	shutil.rmtree(shard_path)
+	logger.info("   **** Out-of-core co-occurrence: %d pairs in %.2fs, peak RSS %.1f MB" % (matrix.nnz, time.time()-start_time, cooccurrence.peak_rss_mb()))
+	return matrix, word_occurrence
+
+# k-way merge of sorted CSR shards (summing entries present in several of them) into name.{indptr,indices,data}.npy
+# in directory.  Rows are merged in blocks whose total shard entries (bounded by row_bound) fit the budget.
+def merge_shards(shards, n_words, directory, name, row_bound, budget):
+	shards = [[np.load(shard+"."+part+".npy", mmap_mode="r") for part in ("indptr", "indices", "data")] for shard in shards]
+	indptr = np.zeros(n_words+1, dtype=np.int64)
+	indices = NpyWriter(os.path.join(directory, name+".indices.npy"), np.int32)
+	data = NpyWriter(os.path.join(directory, name+".data.npy"), np.float64)
+	for start, end in batches(row_bound, budget):
+		rows, cols, counts = [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int32)]
+		for shard_indptr, shard_indices, shard_data in shards:
+			lo, hi = shard_indptr[start], shard_indptr[end]
+			rows.append(np.repeat(np.arange(start, end, dtype=np.int32), np.diff(shard_indptr[start:end+1])))
+			cols.append(shard_indices[lo:hi])
+			counts.append(shard_data[lo:hi])
+		block = sparse.coo_matrix((np.concatenate(counts).astype(np.float64), (np.concatenate(rows) - start, np.concatenate(cols))),
+								  shape=(end-start, n_words)).tocsr()
+		block.sum_duplicates()
+		block.sort_indices()
+		indices.write(block.indices)
+		data.write(block.data)
+		indptr[start+1:end+1] = indptr[start] + block.indptr[1:]
+	np.save(os.path.join(directory, name+".indptr.npy"), indptr)
+	return sparse.csr_matrix((data.close(), indices.close(), np.load(os.path.join(directory, name+".indptr.npy"), mmap_mode="r")),
+							 shape=(n_words, n_words))
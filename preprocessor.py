@@ -6,13 +6,24 @@ import numpy as np
 from nltk.corpus import stopwords,wordnet
 from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.tokenize import RegexpTokenizer
-from joblib import Parallel, delayed
 from inflection import singularize
 from prettytable import PrettyTable
 import evaluate
 import random
 import fisher
 import itertools
+import array
+import copy
+import shutil
+import time
+import cooccurrence
+import significance
+import tokeniser
+import outofcore
+import artifact
+import checkpoint
+import scheduler
+import surprise_index
 
 # Logging info from Glovex messages
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
@@ -31,19 +42,7 @@ def get_wordnet_pos(treebank_tag):
 	else:
 		return wordnet.NOUN
 
-def significance(w1_occurrence, w2_occurrence, cooccurrences, n_docs):
-	table = [[cooccurrences,w2_occurrence-cooccurrences],[w1_occurrence,(n_docs-w1_occurrence)]]
-	oddsratio, pvalue = fisher_exact(table, alternative="less")
-	return pvalue
-
-''' Old, slow scipy-based significance test.
-def significance_on_tuple(sig_tuple):
-	_, _, w1_occurrence, w2_occurrence, cooccurrences, n_docs = sig_tuple
-	table = [[cooccurrences,w2_occurrence-cooccurrences],[w1_occurrence,(n_docs-w1_occurrence)]]
-	oddsratio, pvalue = fisher_exact(table, alternative="less")
-	return pvalue
-'''
-
+# Reference implementation of the left-tail test computed by significance.left_tail
 def significance_on_tuple(sig_tuple):
 	_, _, w1_occurrence, w2_occurrence, cooccurrences, n_docs = sig_tuple
 	pvalue = fisher.pvalue(cooccurrences,w2_occurrence-cooccurrences,w1_occurrence-cooccurrences,(n_docs-w1_occurrence-w2_occurrence+cooccurrences))
@@ -52,9 +51,6 @@ def significance_on_tuple(sig_tuple):
 	return pvalue.left_tail
 
 
-def significance_on_tuple_batch(sig_tuple_batch):
-	return [significance_on_tuple(sig_tuple) for sig_tuple in sig_tuple_batch]
-
 #Document reader class
 class DocReader(object):
 	def __init__(self,path,famcat_path, run_name=None, use_sglove=False):
@@ -78,40 +74,191 @@ class DocReader(object):
 		self.docs_per_fc = {}
 		self.cooccurrence_p_values = {}
 		self.use_sglove = use_sglove
+		self.lowercase = True
+		self.memory_budget_mb = None
+		self.scratch_path = None
 
-	# Document reader iterator not implemented
-	def __iter__(self):
+	# Yields the text of each document after the first skip, recording their metadata on the first pass.  Not implemented
+	def texts(self, skip=0):
 		raise NotImplementedError
 
-	# Load function (using pickle) for document reader
-	def load(self,preprocessed_path):
-		with open(preprocessed_path,"rb") as pro_f:
-			self.documents,self.word_occurrence, self.cooccurrence,self.dictionary, self.total_docs, self.doc_ids, self.doc_titles, self.doc_raws, self.doc_famcats, self.per_fc_keys_to_all_keys, self.all_keys_to_per_fc_keys, self.docs_per_fc, self.cooccurrence_p_values, self.use_sglove = pickle.load(pro_f)
+	# Document reader iterator: the normalised tokens of each document
+	def __iter__(self):
+		for text in self.texts():
+			yield tokeniser.normalise_text(text, self.lowercase)
+
+	# Tokenise the whole corpus once, across a process pool
+	def tokenise(self, workers=None):
+		chunk_tokens = None if self.memory_budget_mb is None else outofcore.pair_budget(self.memory_budget_mb)
+		streams = tokeniser.tokenise(self.texts(), lowercase=self.lowercase, workers=workers, directory=self.scratch_path, chunk_tokens=chunk_tokens)
+		for name in ("doc_titles", "doc_raws"):
+			if isinstance(getattr(self, name), artifact.StringColumnWriter):
+				setattr(self, name, getattr(self, name).close())
+		self.total_docs = float(len(streams))
+		return streams
+
+	# Work out of core under a memory budget of memory_budget_mb: token ids, the BoW corpus, co-occurrence shards
+	# and raw texts go to files in scratch_path instead of memory
+	def start_out_of_core(self, memory_budget_mb, scratch_path):
+		self.memory_budget_mb = memory_budget_mb
+		self.scratch_path = scratch_path
+		if os.path.exists(scratch_path):
+			shutil.rmtree(scratch_path)
+		os.makedirs(scratch_path)
+		self.doc_titles = artifact.StringColumnWriter(scratch_path, "doc_titles")
+		self.doc_raws = artifact.StringColumnWriter(scratch_path, "doc_raws")
+
+	# Tokens of the unfiltered vocabulary that filter_extremes(no_below, no_above) would now keep but the dictionary
+	# lacks ("entered"), and dictionary tokens it would now drop ("left")
+	def vocabulary_threshold_crossings(self, no_below, no_above):
+		dfs = np.zeros(len(self.vocabulary), dtype=np.int64)
+		dfs[np.fromiter(self.vocabulary.dfs.iterkeys(), dtype=np.int64)] = np.fromiter(self.vocabulary.dfs.itervalues(), dtype=np.int64)
+		passes = (dfs >= max(2,no_below*self.total_docs)) & (dfs <= int(no_above*self.total_docs))
+		in_dictionary = np.zeros(len(dfs), dtype=bool)
+		in_dictionary[[self.vocabulary.token2id[w] for w in self.dictionary.token2id]] = True
+		id2token = {wk:w for w,wk in self.vocabulary.token2id.iteritems()}
+		entered = [id2token[wk] for wk in np.flatnonzero(passes & ~in_dictionary)]
+		left = [id2token[wk] for wk in np.flatnonzero(~passes & in_dictionary)]
+		return sorted(entered), sorted(left)
+
+	# Add the documents appended to the corpus since the artifact at preprocessed_path was written, updating the
+	# artifact in place.  Only the new rows are tokenised; their co-occurrence counts are added to the stored ones.
+	# The dictionary is kept as it is so that word ids stay valid for trained models; words crossing the
+	# no_below/no_above thresholds are logged and recorded in the artifact's vocabulary_changes.jsonl instead.
+	def append(self, preprocessed_path, no_below=0.001, no_above=0.5, workers=None):
+		self.load(preprocessed_path)
+		n_old = int(round(self.total_docs))
+		old_doc_famcats = self.doc_famcats
+		self.doc_ids, self.doc_titles, self.doc_raws, self.doc_famcats = [], [], [], []
+		self.first_pass = True
+		streams = tokeniser.tokenise(self.texts(skip=n_old), lowercase=self.lowercase, workers=workers)
+		new_doc_ids, new_doc_titles, new_doc_raws, new_doc_famcats = self.doc_ids, self.doc_titles, self.doc_raws, self.doc_famcats
+		if not len(streams):
+			logger.info("   **** No new documents to append.")
+			self.load(preprocessed_path)
+			return
+		start = time.time()
+		self.total_docs = float(n_old + len(streams))
+		new_bow = streams.bow_corpus(self.dictionary).matrix
+		old_bow = self.documents.matrix
+		self.documents = cooccurrence.BowCorpus(np.concatenate([old_bow.indices, new_bow.indices]), np.concatenate([old_bow.data, new_bow.data]),
+												np.concatenate([old_bow.indptr, old_bow.indptr[-1] + new_bow.indptr[1:]]), len(self.dictionary))
+		self.total_words += new_bow.data.sum()
+		vocabulary_changes = None
+		if self.vocabulary is not None:
+			streams.update_dictionary(self.vocabulary)
+			entered, left = self.vocabulary_threshold_crossings(no_below, no_above)
+			logger.info("   **** %d words now pass the no_below/no_above thresholds, %d dictionary words no longer do" % (len(entered), len(left)))
+			vocabulary_changes = {"total_docs": self.total_docs, "appended_docs": len(streams), "no_below": no_below, "no_above": no_above,
+								  "entered": entered, "left": left}
+		else:
+			logger.info("   **** Artifact has no unfiltered vocabulary; threshold crossings are not tracked.")
+		if self.famcat_filepath is None:
+			cooc, word_occurrence = cooccurrence.sparse_cooccurrence(new_bow)
+			cooc = self.cooccurrence.matrix + cooc
+			cooc.sort_indices()
+			self.cooccurrence = cooccurrence.SparseCooccurrence(cooc)
+			self.word_occurrence = cooccurrence.WordOccurrence(self.word_occurrence.counts + word_occurrence, self.dictionary)
+			changed = None
+		else:
+			self.doc_famcats = list(old_doc_famcats) + new_doc_famcats
+			known_words = {fc:self.per_fc_keys_to_all_keys[fc].array for fc in self.famcats}
+			deltas = cooccurrence.famcat_cooccurrence(new_bow, new_doc_famcats, known_words)
+			changed = deltas.keys()
+			for fc,(cooc, word_occurrence, local_to_global, n_docs) in deltas.iteritems():
+				if fc in known_words:
+					cooc = cooccurrence.pad_square(self.cooccurrence[fc].matrix, len(local_to_global)) + cooc
+					cooc.sort_indices()
+					old_counts = self.word_occurrence[fc].counts
+					word_occurrence = word_occurrence + np.concatenate([old_counts, np.zeros(len(local_to_global) - len(old_counts))])
+					n_docs += self.docs_per_fc[fc]
+				self.cooccurrence[fc] = cooccurrence.SparseCooccurrence(cooc)
+				self.word_occurrence[fc] = cooccurrence.WordOccurrence(word_occurrence, self.dictionary, local_to_global)
+				self.per_fc_keys_to_all_keys[fc] = cooccurrence.IdMap(local_to_global)
+				self.all_keys_to_per_fc_keys[fc] = self.word_occurrence[fc].global_to_local
+				self.docs_per_fc[fc] = n_docs
 			self.famcats = self.cooccurrence.keys()
-			self.first_pass = False
+		logger.info("   **** Co-occurrence updated with %d documents in %.2fs." % (len(streams), time.time()-start))
+		if self.use_sglove:
+			self.calc_cooccurrence_significance_parallel(changed)
+			logger.info("   **** Co-occurrence signficance recalculated.")
+		artifact.append(self, preprocessed_path, new_doc_ids, new_doc_titles, new_doc_raws, vocabulary_changes)
+		self.load(preprocessed_path)
+
+	# Where the packed s_glove training set of the (famcat's) co-occurrence is cached: inside the artifact, so that
+	# it goes away with it.  None for pickled pre-processed files.
+	def training_set_path(self, fc=None):
+		if not os.path.isdir(getattr(self, "preprocessed_path", "")):
+			return None
+		if fc is None:
+			return os.path.join(self.preprocessed_path, "training")
+		return os.path.join(self.preprocessed_path, "fc%d" % list(self.famcats).index(fc), "training")
+
+	# Token and document count of each row of the (famcat's) model, used to match rows across vocabularies
+	def model_vocabulary(self, fc=None):
+		occurrence = self.word_occurrence if fc is None else self.word_occurrence[fc]
+		return list(occurrence), np.asarray(occurrence.counts)
+
+	# Components of a loaded artifact are read from disk the first time they are accessed
+	def __getattr__(self, name):
+		if name in artifact.LAZY_FIELDS and "_artifact" in self.__dict__:
+			value = self._artifact.load(name)
+			setattr(self, name, value)
+			return value
+		raise AttributeError(name)
+
+	# Load function for document reader: a (lazily loaded) artifact directory, or a pickle written by older versions
+	def load(self,preprocessed_path):
+		if os.path.isdir(preprocessed_path):
+			self._artifact = artifact.Artifact(preprocessed_path)
+			for field in artifact.LAZY_FIELDS:
+				self.__dict__.pop(field, None)
+			self.total_docs = self._artifact.meta["total_docs"]
+			self.total_words = self._artifact.meta["total_words"]
+			self.use_sglove = self._artifact.meta["use_sglove"]
+			self.famcats = self._artifact.famcats
+			self.docs_per_fc = dict(zip(self.famcats, self._artifact.meta["docs_per_fc"]))
+		else:
+			with open(preprocessed_path,"rb") as pro_f:
+				self.documents,self.word_occurrence, self.cooccurrence,self.dictionary, self.total_docs, self.doc_ids, self.doc_titles, self.doc_raws, self.doc_famcats, self.per_fc_keys_to_all_keys, self.all_keys_to_per_fc_keys, self.docs_per_fc, self.cooccurrence_p_values, self.use_sglove = pickle.load(pro_f)
+				self.famcats = self.cooccurrence.keys()
+		self.first_pass = False
 
 	# Preprocessing function of the Document reader
-	def preprocess(self,suffix=".preprocessed", no_below=0.001, no_above=0.5, force_overwrite = False):
+	def preprocess(self,suffix=".preprocessed", no_below=0.001, no_above=0.5, force_overwrite = False, workers=None, normalisation_cache=None, append=False, memory_budget_mb=None):
 		if self.run_name is not None:
 			self.argstring = "_"+self.run_name+"_below"+str(no_below)+"_above"+str(no_above)
 		else:
 			self.argstring = "_below"+str(no_below)+"_above"+str(no_above)
 		preprocessed_path = self.filepath+self.argstring+suffix
+		self.preprocessed_path = preprocessed_path
 		if not os.path.exists(preprocessed_path) or force_overwrite:
 			logger.info(" ** Pre-processing started.")
-			self.dictionary = gensim.corpora.Dictionary(self)
+			tokeniser.configure_cache(normalisation_cache)
+			if memory_budget_mb is not None:
+				self.start_out_of_core(memory_budget_mb, preprocessed_path+".scratch")
+			streams = self.tokenise(workers)
+			self.vocabulary = streams.dictionary()
+			self.dictionary = copy.deepcopy(self.vocabulary)
 			logger.info("   **** Dictionary created.")
 			self.dictionary.filter_extremes(no_below=max(2,no_below*self.total_docs),no_above=no_above,keep_n=None)
 			logger.info("   **** Dictionary filtered.")
-			self.documents = [self.dictionary.doc2bow(d) for d in self]
+			self.documents = streams.bow_corpus(self.dictionary)
 			logger.info("   **** BoW representations constructed.")
 			self.calc_cooccurrence()
 			logger.info("   **** Co-occurrence matrix constructed.")
 			if self.use_sglove:
 				self.calc_cooccurrence_significance_parallel()
 				logger.info("   **** Co-occurrence signficance matrix calculated.")
-			with open(preprocessed_path,"wb") as pro_f:
-				pickle.dump((self.documents,self.word_occurrence, self.cooccurrence,self.dictionary, self.total_docs, self.doc_ids, self.doc_titles, self.doc_raws, self.doc_famcats, self.per_fc_keys_to_all_keys, self.all_keys_to_per_fc_keys, self.docs_per_fc, self.cooccurrence_p_values, self.use_sglove),pro_f)
+			artifact.save(self, preprocessed_path)
+			if self.scratch_path is not None:
+				self.load(preprocessed_path)
+				shutil.rmtree(self.scratch_path)
+				self.scratch_path = None
+		elif append:
+			logger.info(" ** Appending new documents to the existing pre-processed file.")
+			tokeniser.configure_cache(normalisation_cache)
+			self.append(preprocessed_path, no_below=no_below, no_above=no_above, workers=workers)
 		else:
 			logger.info(" ** Existing pre-processed file found.  Rerun with --overwrite_preprocessing"+
 						" if you did not intend to reuse it.")
@@ -122,126 +269,52 @@ class DocReader(object):
 	#Note: Normalisation not implemented for personalised version (w/ famcats)
 	def calc_cooccurrence(self, normalise = False):
 		if self.famcat_filepath is None:
-			self.word_occurrence = {k:0.0 for k in self.dictionary.token2id.keys()}
-			self.cooccurrence = {wk:{} for wk in range(len(self.dictionary))}
-			for doc in self.documents:
-				for wk,wc in doc:
-					self.total_words += wc
-					self.word_occurrence[self.dictionary[wk]] += 1.0
-					for wk2,wc2 in doc:
-						if wk != wk2:
-							try:
-								self.cooccurrence[wk][wk2] += 1.0
-							except KeyError:
-								self.cooccurrence[wk][wk2] = 1.0
+			start = time.time()
+			bow = cooccurrence.bow_matrix(self.documents, len(self.dictionary))
+			self.total_words += bow.data.sum()
+			if self.memory_budget_mb is not None:
+				cooc, word_occurrence = outofcore.external_cooccurrence(bow, self.scratch_path, self.memory_budget_mb)
+			else:
+				cooc, word_occurrence = cooccurrence.sparse_cooccurrence(bow)
 			if normalise:
-				for wk,wv in self.dictionary.iteritems():
-					self.cooccurrence[wk] = {wk2:float(wv2)/self.word_occurrence[wv] for wk2,wv2 in self.cooccurrence[wk].iteritems()}
+				cooc = cooccurrence.normalise_rows(cooc, word_occurrence)
+			self.word_occurrence = cooccurrence.WordOccurrence(word_occurrence, self.dictionary)
+			self.cooccurrence = cooccurrence.SparseCooccurrence(cooc)
+			logger.info("   **** Sparse co-occurrence: %d pairs in %.2fs, peak RSS %.1f MB" % (cooc.nnz, time.time()-start, cooccurrence.peak_rss_mb()))
 
 		else:
+			start = time.time()
+			bow = cooccurrence.bow_matrix(self.documents, len(self.dictionary))
+			self.total_words += bow.data.sum()
 			self.cooccurrence = {}
 			self.word_occurrence = {}
-
-			for doc,doc_fcs in zip(self.documents,self.doc_famcats):
-				for wk,wc in doc:
-					self.total_words += wc
-					for fc in doc_fcs:
-						if fc not in self.cooccurrence.keys():
-							self.cooccurrence[fc] = {}
-							self.word_occurrence[fc] = {}
-							self.per_fc_keys_to_all_keys[fc] = {}
-							self.all_keys_to_per_fc_keys[fc] = {}
-							self.docs_per_fc[fc] = 0
-						self.docs_per_fc[fc] += 1
-						try:
-							self.word_occurrence[fc][self.dictionary[wk]] += 1.0
-						except KeyError:
-							self.word_occurrence[fc][self.dictionary[wk]] = 1.0
-						if wk not in self.all_keys_to_per_fc_keys[fc].keys():
-							new_id = len(self.all_keys_to_per_fc_keys[fc])
-							self.per_fc_keys_to_all_keys[fc][new_id] = wk
-							self.all_keys_to_per_fc_keys[fc][wk] = new_id
-						if self.all_keys_to_per_fc_keys[fc][wk] not in self.cooccurrence[fc].keys():
-							self.cooccurrence[fc][self.all_keys_to_per_fc_keys[fc][wk]] = {}
-						already_rekeyed_words = set(self.all_keys_to_per_fc_keys[fc].keys())
-						for wk2,wc2 in doc:
-							if wk != wk2:
-								if wk2 not in already_rekeyed_words:
-									new_id = len(self.all_keys_to_per_fc_keys[fc])
-									self.all_keys_to_per_fc_keys[fc][wk2] = new_id
-									self.per_fc_keys_to_all_keys[fc][new_id] = wk2
-								try:
-									self.cooccurrence[fc][self.all_keys_to_per_fc_keys[fc][wk]][self.all_keys_to_per_fc_keys[fc][wk2]] += 1.0
-								except KeyError:
-									self.cooccurrence[fc][self.all_keys_to_per_fc_keys[fc][wk]][self.all_keys_to_per_fc_keys[fc][wk2]] = 1.0
-
+			builder = None
+			if self.memory_budget_mb is not None:
+				builder = lambda local_bow, i: outofcore.external_cooccurrence(local_bow, os.path.join(self.scratch_path, "fc%d" % i), self.memory_budget_mb)
+			for fc,(cooc, word_occurrence, local_to_global, n_docs) in cooccurrence.famcat_cooccurrence(bow, self.doc_famcats, builder=builder).iteritems():
+				self.cooccurrence[fc] = cooccurrence.SparseCooccurrence(cooc)
+				self.word_occurrence[fc] = cooccurrence.WordOccurrence(word_occurrence, self.dictionary, local_to_global)
+				self.per_fc_keys_to_all_keys[fc] = cooccurrence.IdMap(local_to_global)
+				self.all_keys_to_per_fc_keys[fc] = self.word_occurrence[fc].global_to_local
+				self.docs_per_fc[fc] = n_docs
+			logger.info("   **** Sparse co-occurrence for %d famcats in %.2fs, peak RSS %.1f MB" % (len(self.cooccurrence), time.time()-start, cooccurrence.peak_rss_mb()))
 			self.famcats = self.cooccurrence.keys()
 
-	def calc_cooccurrence_significance(self):
+	# Left-tail Fisher p-values for every co-occurring pair, computed once per distinct contingency table.
+	# Given the famcats whose counts changed, the p-values of the other famcats are kept.
+	def calc_cooccurrence_significance_parallel(self, famcats=None):
 		if len(self.famcats):
-			for fc in self.famcats:
-				self.cooccurrence_p_values[fc] = {}
-				for w1 in self.cooccurrence[fc].keys():
-					if w1 not in self.cooccurrence_p_values[fc].keys():
-						self.cooccurrence_p_values[fc][w1] = {}
-					for w2 in self.cooccurrence[fc].keys():
-						if w1 != w2:
-							self.cooccurrence_p_values[fc][w1][w2] = significance(
-								self.word_occurrence[fc][self.dictionary[self.per_fc_keys_to_all_keys[fc][w1]]],
-								self.word_occurrence[fc][self.dictionary[self.per_fc_keys_to_all_keys[fc][w2]]],
-								self.cooccurrence[fc][w1][w2] if w2 in self.cooccurrence[fc][w1] else 0,
-								self.docs_per_fc[fc]
-							)
+			for i,fc in enumerate(self.famcats if famcats is None else famcats):
+				self.cooccurrence_p_values[fc] = self.p_values(self.cooccurrence[fc].matrix, self.word_occurrence[fc].counts, self.docs_per_fc[fc], "fc%d" % i)
 		else:
-			self.cooccurrence_p_values = {}
-			for w1 in self.cooccurrence.keys():
-				if w1 not in self.cooccurrence_p_values.keys():
-					self.cooccurrence_p_values[w1] = {}
-				for w2 in self.cooccurrence.keys():
-					if w1 != w2:
-						self.cooccurrence_p_values[w1][w2] = significance(
-							self.word_occurrence[self.dictionary[w1]],
-							self.word_occurrence[self.dictionary[w2]],
-							self.cooccurrence[w1][w2] if w2 in self.cooccurrence[w1] else 0,
-							self.total_docs
-						)
-
-	def calc_cooccurrence_significance_parallel(self):
-		if len(self.famcats):
-			for fc in self.famcats:
-				self.cooccurrence_p_values[fc] = {}
-				for w1 in self.cooccurrence[fc].keys():
-					if w1 not in self.cooccurrence_p_values[fc].keys():
-						self.cooccurrence_p_values[fc][w1] = {}
-					for w2 in self.cooccurrence[fc].keys():
-						if w1 != w2:
-							self.cooccurrence_p_values[fc][w1][w2] = significance(
-								self.word_occurrence[fc][self.dictionary[self.per_fc_keys_to_all_keys[fc][w1]]],
-								self.word_occurrence[fc][self.dictionary[self.per_fc_keys_to_all_keys[fc][w2]]],
-								self.cooccurrence[fc][w1][w2] if w2 in self.cooccurrence[fc][w1] else 0,
-								self.docs_per_fc[fc]
-							)
-		else:
-			sigs_to_compute = []
-			self.cooccurrence_p_values = {}
-			for w1 in self.cooccurrence.keys():
-				if w1 not in self.cooccurrence_p_values.keys():
-					self.cooccurrence_p_values[w1] = {}
-				for w2 in self.cooccurrence.keys():
-					if w1 != w2:
-						sigs_to_compute.append((w1,
-												w2,
-												self.word_occurrence[self.dictionary[w1]],
-												self.word_occurrence[self.dictionary[w2]],
-												self.cooccurrence[w1][w2] if w2 in self.cooccurrence[w1] else 0,
-												self.total_docs))
-			#computed_sigs = Parallel(n_jobs=-1)(delayed(significance_on_tuple)(sig) for sig in sigs_to_compute)
-
-			sigs_sublists = [list(sl) for sl in np.array_split(sigs_to_compute,multiprocessing.cpu_count()/2)]
-			computed_sigs = itertools.chain.from_iterable(Parallel(n_jobs=multiprocessing.cpu_count()/2, max_nbytes=1e12)(delayed(significance_on_tuple_batch)(sigs) for sigs in sigs_sublists))
-			for sig,p in zip(sigs_to_compute,computed_sigs):
-				#print sig, p
-				self.cooccurrence_p_values[sig[0]][sig[1]] = p
+			self.cooccurrence_p_values = self.p_values(self.cooccurrence.matrix, self.word_occurrence.counts, self.total_docs, "cooccurrence")
+
+	# p-values of one co-occurrence matrix, written to the scratch directory in blocks when working out of core
+	def p_values(self, cooc, word_occurrence, n_docs, name):
+		if self.memory_budget_mb is None or not cooc.nnz:
+			return significance.cooccurrence_p_values(cooc, word_occurrence, n_docs)
+		out = np.lib.format.open_memmap(os.path.join(self.scratch_path, name+".p_values.npy"), mode="w+", dtype=np.float64, shape=(cooc.nnz,))
+		return significance.cooccurrence_p_values(cooc, word_occurrence, n_docs, chunk_pairs=outofcore.pair_budget(self.memory_budget_mb), out=out)
 
 # ACMDL Document reader which is a subclass of the Document reader
 class ACMDL_DocReader(DocReader):
@@ -251,8 +324,8 @@ class ACMDL_DocReader(DocReader):
 		self.id_column = id_column
 		DocReader.__init__(self,path,famcat_path, run_name=run_name, use_sglove=use_sglove)
 
-	# The iterator of the ACMDL Document reader
-	def __iter__(self):
+	# The document texts of the ACMDL Document reader
+	def texts(self, skip=0):
 		if self.first_pass and self.famcat_filepath is not None:
 			with io.open(self.famcat_filepath+".csv",mode="r",encoding='ascii',errors="ignore") as famcat_file:
 				reader = csv.reader(famcat_file)
@@ -262,52 +335,64 @@ class ACMDL_DocReader(DocReader):
 				# famcats = {row[0]:([n[0] for n in row[1:] if len(n)] if len(row) > 1 else ["None"]) for row in reader}
 				# famcats = {row[0]:["1"] if random.random() > 0.5 else ["1","2"] for row in reader}
 		with io.open(self.filepath+".csv",mode="r",encoding='ascii',errors="ignore") as i_f:
-			for row in csv.DictReader(i_f):
-				docwords = [singularize(w) for w in self.tokeniser.tokenize((row[self.title_column]+" "+row[self.text_column]).lower()) if w not in self.stop]
-
+			for row in itertools.islice(csv.DictReader(i_f), skip, None):
 				#tag+lemmatize
 				#docwords = nltk.pos_tag(self.tokeniser.tokenize(row["Abstract"].lower()))
 				#docwords = [self.lem.lemmatize(w,pos=get_wordnet_pos(t)) for w,t in docwords if w not in self.stop]
 
 				if self.first_pass:
-					self.total_docs += 1.0
 					self.doc_ids.append(row[self.id_column])
 					self.doc_titles.append(row[self.title_column])
 					self.doc_raws.append(row[self.text_column])
 					if self.famcat_filepath is not None:
 						self.doc_famcats.append(famcats[row[self.id_column]])
-				yield docwords
+				yield row[self.title_column]+" "+row[self.text_column]
 		self.first_pass = False
 
 # WikiPlot Document reader class
 class WikiPlot_DocReader(DocReader):
 	def __init__(self,path):
-		DocReader.__init__(self,path)
+		DocReader.__init__(self,path,None)
+		self.lowercase = False
 
-	# Iterator of the WikiPlot Document reader
-	def __iter__(self):
-		with io.open(self.filepath,mode="r",encoding='ascii',errors="ignore") as i_f:
-			if self.first_pass:
-				doc_raw = ""
-				t_f = io.open(self.filepath+"_titles",mode="r",encoding='ascii',errors="ignore")
-			docwords = []
-			for line in i_f.readlines():
+	# The document texts of the WikiPlot Document reader.  The plots file is streamed line by line; on the first pass
+	# only the byte ranges of each plot and title are recorded, and doc_raws/doc_titles read them back from the
+	# source files on access.
+	def texts(self, skip=0):
+		if self.first_pass:
+			raw_starts, raw_ends = array.array("l"), array.array("l")
+			title_starts, title_ends = array.array("l"), array.array("l")
+			t_f = open(self.filepath+"_titles","rb")
+			title_offset = 0
+		with open(self.filepath,"rb") as i_f:
+			doc_lines = []
+			doc_start = offset = 0
+			doc_index = 0
+			for line in i_f:
 				if line[:5] == "<EOS>":
 					if self.first_pass:
-						self.total_words += len(docwords)
-						self.doc_ids.append(self.total_docs)
-						self.total_docs += 1
-						self.doc_titles.append(t_f.readline())
-						self.doc_raws.append(doc_raw)
-						doc_raw = ""
-					yield docwords
-					docwords = []
-				else:
-					docwords += [singularize(w) for w in self.tokeniser.tokenize(line) if w not in self.stop]
+						title = t_f.readline()
+					if doc_index >= skip:
+						if self.first_pass:
+							self.doc_ids.append(doc_index)
+							raw_starts.append(doc_start)
+							raw_ends.append(offset)
+							title_starts.append(title_offset)
+							title_ends.append(title_offset + len(title))
+						yield "".join(doc_lines).decode("ascii", "ignore")
 					if self.first_pass:
-						doc_raw += line
+						title_offset += len(title)
+					doc_lines = []
+					doc_start = offset + len(line)
+					doc_index += 1
+				else:
+					doc_lines.append(line)
+				offset += len(line)
 		if self.first_pass:
 			t_f.close()
+			as_array = lambda offsets: np.frombuffer(offsets, dtype="i%d" % offsets.itemsize).astype(np.int64)
+			self.doc_raws = artifact.StringColumn(self.filepath, as_array(raw_starts), as_array(raw_ends), encoding="ascii")
+			self.doc_titles = artifact.StringColumn(self.filepath+"_titles", as_array(title_starts), as_array(title_ends), encoding="ascii")
 		self.first_pass = False
 
 # Recipe Document reader
@@ -315,47 +400,61 @@ class Recipe_Reader(DocReader):
 	def __init__(self,path, text_column, id_column, famcat_path=None):
 		self.text_column = text_column
 		self.id_column = id_column
-    self.fam_cat_column = 'cuisine'
+		self.fam_cat_column = 'cuisine'
 		DocReader.__init__(self,path,famcat_path)
 
-	# The iterator of the Recipe Document reader
-	def __iter__(self):
+	# The document texts of the Recipe Document reader
+	def texts(self, skip=0):
 		with io.open(self.filepath + ".csv", mode="r", encoding='ascii', errors="ignore") as i_f:
-			for row in csv.DictReader(i_f):
-				docwords = [singularize(w) for w in self.tokeniser.tokenize((row[self.text_column]).lower()) if
-							w not in self.stop]
+			for row in itertools.islice(csv.DictReader(i_f), skip, None):
 				# If not first pass, get the document IDs, text_column and famcats (if the famcat_filepath is not None)
 				if self.first_pass:
 					self.doc_ids.append(row[self.id_column])
 					self.doc_raws.append(row[self.text_column])
 					if self.famcat_filepath is not None:
 						self.doc_famcats.append(row[self.fam_cat_column])
-				yield docwords
+				yield row[self.text_column]
 		self.first_pass = False
 
 # Glovex model builder
-def glovex_model(filepath, argstring, cooccurrence, dims=100, alpha=0.75, x_max=100, force_overwrite = False, suffix = ".glovex", use_sglove=False, p_values=None):
-	# Get all file names with .glovex extension in the model's path
-  model_path = filepath+argstring
-	model_files = glob.glob(model_path+"_epochs*"+suffix)
+def glovex_model(filepath, argstring, cooccurrence, dims=100, alpha=0.75, x_max=100, force_overwrite = False, suffix = ".glovex", use_sglove=False, p_values=None, training_set_path=None, dtype=np.float64, min_weight=0.0):
+	# Get all checkpoints with .glovex extension in the model's path
+	model_path = filepath+argstring
+	model_files = checkpoint.checkpoints(model_path, suffix)
 	if not len(model_files) or force_overwrite:
-    # If no model exists or it is forced to overwrite the old model, create a new model
+		# If no model exists or it is forced to overwrite the old model, create a new model
 		if use_sglove:
-			model = s_glove.Glove(cooccurrence, p_values, d=dims, alpha=alpha)
+			model = s_glove.Glove(cooccurrence, p_values, d=dims, alpha=alpha, training_set_path=training_set_path, dtype=dtype,
+								  min_weight=min_weight)
 		else:
 			model = glove.Glove(cooccurrence, d=dims, alpha=alpha, x_max=x_max)
 	else:
-  	# If a model exists and no overwrite is forced, use the existing model at its last trained epoch	
-    highest_epochs = max([int(f.split("epochs")[1].split(".")[0]) for f in model_files])
+	# If a model exists and no overwrite is forced, use the existing model at its last trained epoch
 		logger.info(" ** Existing model file found.  Re-run with --overwrite_model if you did not intend to reuse it.")
-		with open(model_path+"_epochs"+str(highest_epochs)+suffix,"rb") as pro_f:
-			model = pickle.load(pro_f)
+		model = checkpoint.load(model_files[-1][1], cooccurrence, p_values, training_set_path)
 	return model
 
-# Save the Glovex model function (with a .glovex extension)
-def save_model(model,path,args,suffix=".glovex"):
-	with open(path+args+suffix,"wb") as f:
-		pickle.dump(model,f)
+# Epoch to resume training of the model at filepath+argstring from: the one after its last checkpoint
+def resume_epoch(filepath, argstring, suffix=".glovex"):
+	model_files = checkpoint.checkpoints(filepath+argstring, suffix)
+	return model_files[-1][0] + 1 if model_files else 0
+
+# The checkpoint a new model of the run at filepath+argstring should warm-start from, if any: its latest checkpoint
+# if that was trained on a different vocabulary than tokens
+def stale_checkpoint(filepath, argstring, tokens, suffix=".glovex"):
+	model_files = checkpoint.checkpoints(filepath+argstring, suffix)
+	if model_files and not checkpoint.matches(model_files[-1][1], tokens):
+		return model_files[-1][1]
+	return None
+
+# Save the Glovex model function (a checkpoint directory with a .glovex extension), keeping only the newest keep
+# checkpoints of the run if keep is given.  vocabulary is the (tokens, counts) of the model's rows.
+def save_model(model, path, args, epoch, suffix=".glovex", keep=None, vocabulary=None):
+	model_path = path+args+"_epochs"+str(epoch)+suffix
+	checkpoint.save(model, model_path, epoch, *(vocabulary or ()))
+	if keep:
+		checkpoint.prune(path+args, keep, suffix)
+	return model_path
 
 # Load the personalised model function
 def load_personalised_models(filepath, docreader):
@@ -365,15 +464,34 @@ def load_personalised_models(filepath, docreader):
 	return models
 
 # Print top n surprise scores function
-def print_top_n_surps(model, acm, top_n):
+# With a surprise_index.SurpriseIndex of the model, the pairs are read from it rather than estimated document by document;
+# tokens are the words of its rows (default: the dictionary, or the famcat's words).  With fc, model is the famcat's
+# model: its rows are the famcat's local word ids and only the famcat's documents and counts are used.
+def print_top_n_surps(model, acm, top_n, index=None, tokens=None, fc=None):
+	if fc is None:
+		cooccurrence, word_occurrence, n_docs = acm.cooccurrence, acm.word_occurrence, len(acm.documents)
+		tokens = tokens or acm.dictionary
+		documents = acm.documents
+	else:
+		cooccurrence, word_occurrence, n_docs = acm.cooccurrence[fc], acm.word_occurrence[fc], acm.docs_per_fc[fc]
+		tokens = tokens or list(word_occurrence)
+		to_local = acm.all_keys_to_per_fc_keys[fc].array
+		documents = ([(int(to_local[wk]), wc) for wk,wc in doc] for doc,fcs in zip(acm.documents, acm.doc_famcats) if fc in fcs)
 
 	top_surps = []
-	for doc in acm.documents:
-		if len(doc):
-			top_surps += evaluate.estimate_document_surprise_pairs(doc, model, acm)[:10]
-			top_surps = list(set(top_surps))
-			top_surps.sort(key = lambda x: x[2], reverse=False)
-			top_surps = top_surps[:top_n]
+	if index is not None:
+		top_surps = zip(*[a.tolist() for a in index.top_pairs(top_n)])
+	else:
+		top = evaluate.TopN(top_n)
+		for doc in documents:
+			if len(doc):
+				w1s, w2s, surps = evaluate.estimate_document_pair_surprises(doc, model, cooccurrence, word_occurrence, tokens,
+																			n_docs, use_sglove=acm.use_sglove, top_n=10)
+				for w1,w2,s in zip(w1s.tolist(), w2s.tolist(), surps.tolist()):
+					if not top.accepts(s):
+						break
+					top.add((w1, w2), s, (w1, w2, s))
+		top_surps = top.items()
 
 	print "top_n surprising combos"
 	w1s = []
@@ -384,20 +502,18 @@ def print_top_n_surps(model, acm, top_n):
 	est_coocs = []
 	obs_coocs = []
 	obs_surps = []
-	for surp in top_surps:
-		w1s.append(surp[0])
-		w2s.append(surp[1])
-		w1_occ = acm.word_occurrence[surp[0]]
-		w2_occ = acm.word_occurrence[surp[1]]
+	for wk1,wk2,s in top_surps:
+		w1s.append(tokens[wk1])
+		w2s.append(tokens[wk2])
+		w1_occ = word_occurrence[tokens[wk1]]
+		w2_occ = word_occurrence[tokens[wk2]]
 		w1_occs.append(w1_occ)
 		w2_occs.append(w2_occ)
-		est_surps.append(surp[2])
-		wk1 = acm.dictionary.token2id[surp[0]]
-		wk2 = acm.dictionary.token2id[surp[1]]
-		est_coocs.append(evaluate.estimate_word_pair_cooccurrence(wk1, wk2, model, acm.cooccurrence))
-		w1_w2_cooccurrence = acm.cooccurrence[wk1][wk2]
+		est_surps.append(s)
+		est_coocs.append(evaluate.estimate_word_pair_cooccurrence(wk1, wk2, model, cooccurrence))
+		w1_w2_cooccurrence = cooccurrence[wk1][wk2]
 		obs_coocs.append(w1_w2_cooccurrence)
-		obs_surp = evaluate.word_pair_surprise(w1_w2_cooccurrence, w1_occ, w2_occ, len(acm.documents))
+		obs_surp = evaluate.word_pair_surprise(w1_w2_cooccurrence, w1_occ, w2_occ, n_docs)
 		obs_surps.append(obs_surp)
 
 	tab = PrettyTable()
@@ -412,6 +528,76 @@ def print_top_n_surps(model, acm, top_n):
 	tab.float_format = ".4"
 	print tab
 
+# Train for up to n_epochs epochs starting at first_epoch, logging each epoch's error.  s_glove models run the epochs
+# in one native call; others are trained an epoch at a time.  Returns the errors of the epochs run.
+# With a stats_path, each s_glove epoch's statistics are logged and appended to that JSON-lines file.
+def train_epochs(model, first_epoch, n_epochs, init_step_size, step_size_decay, cores, label="", tolerance=None, patience=3, sample_below=None,
+				 blocks=None, stats_path=None, focus=None):
+	if hasattr(model, "train_epochs"):
+		start = time.time()
+		def log_stats(stats):
+			logger.info("   **** Training GloVe%s: epoch %d, %.0f pairs/sec, gradient norm %.5f, thread utilisation %s" % (label, stats.epoch,
+						stats.pairs_per_second, stats.gradient_norm, " ".join("%.0f%%" % (100*u) for u in stats.utilisation)))
+		errors = model.train_epochs(n_epochs, init_step_size, step_size_decay, first_epoch=first_epoch, workers=cores,
+									tolerance=tolerance, patience=patience, sample_below=sample_below, blocks=blocks,
+									callback=log_stats if stats_path else None, stats_path=stats_path, focus=focus)
+		elapsed = max(time.time() - start, 1e-9)
+		training_set = model.get_training_set()
+		pairs = len(training_set) if focus is None else np.count_nonzero(focus[training_set.keys] | focus[training_set.subkeys])
+		logger.info("   **** Trained %d epochs on %d threads: %.0f pairs/sec" % (len(errors), cores, len(errors)*pairs/elapsed))
+	else:
+		errors = [model.train(workers=cores, batch_size=100, step_size=init_step_size/(1.0+epoch/step_size_decay))
+				  for epoch in range(first_epoch, first_epoch+n_epochs)]
+	for epoch,err in enumerate(errors, first_epoch):
+		logger.info("   **** Training GloVe%s: epoch %d, error %.5f" % (label, epoch, err))
+	return errors
+
+# Training loop: epochs run in chunks up to each epoch where the most surprising combinations are printed and the model saved.
+# Training resumes at first_epoch; keep is the number of checkpoints to keep (all if None).  progress, if given, is called
+# with the number of epochs done and their errors after each chunk.  With stats, training statistics are written to
+# the model's .training_stats.jsonl file.  vocabulary (see DocReader.model_vocabulary) is saved with the checkpoints.
+# With focus (a boolean mask over the vocabulary), the first focus_epochs epochs of s_glove models only train the
+# pairs of those words.  With index_k, every saved checkpoint gets a surprise_index of the index_k most surprising partners
+# of each word (built in about index_memory_mb), which the surprise reports are read from; n_docs is the number of
+# documents the model's word counts are out of (default: all of the reader's).  fc is the famcat a per-famcat model is
+# trained for.
+def train_glovex(model, reader, argstring, epochs, init_step_size, step_size_decay, cores, print_surprise_every, label="", tolerance=None, patience=3,
+				 sample_below=None, first_epoch=0, keep=None, progress=None, blocks=None, stats=False, vocabulary=None, focus=None,
+				 focus_epochs=0, index_k=0, index_memory_mb=256, n_docs=None, fc=None):
+	def save_and_index(epoch):
+		model_path = save_model(model, reader.filepath, argstring, epoch, keep=keep, vocabulary=vocabulary)
+		if index_k and os.path.isdir(model_path):
+			return surprise_index.build(model, (vocabulary or reader.model_vocabulary(fc))[1],
+										n_docs or (len(reader.documents) if fc is None else reader.docs_per_fc[fc]), os.path.join(model_path, "surprise_index"),
+										k=index_k, cooccurrence=model.cooccurence, use_sglove=reader.use_sglove,
+										memory_mb=index_memory_mb, workers=cores)
+
+	stats_path = reader.filepath+argstring+".training_stats.jsonl" if stats else None
+	epoch = first_epoch
+	saved = None
+	if first_epoch:
+		logger.info("   **** Training GloVe%s: resuming at epoch %d" % (label, first_epoch))
+	while epoch < epochs:
+		last = min(max(-(-epoch // print_surprise_every), 1) * print_surprise_every, epochs - 1)
+		focused = focus is not None and epoch < focus_epochs
+		if focused:
+			last = min(last, focus_epochs - 1)
+		errors = train_epochs(model, epoch, last - epoch + 1, init_step_size, step_size_decay, cores, label, tolerance, patience, sample_below, blocks,
+							  stats_path, focus if focused else None)
+		epoch += len(errors)
+		if progress is not None:
+			progress(epoch, errors)
+		if epoch <= last:
+			logger.info("   **** Training GloVe%s: error stopped improving, stopping early." % label)
+			break
+		if last and last % print_surprise_every == 0:
+			top_n = 50
+			index = save_and_index(last)
+			saved = last
+			print_top_n_surps(model, reader, top_n, index, vocabulary[0] if vocabulary else None, fc)
+	if epoch > first_epoch and saved != epoch - 1:
+		save_and_index(epoch - 1)
+
 # Main function
 if __name__ == "__main__":
 	# Parse arguments from the command
@@ -423,6 +609,23 @@ if __name__ == "__main__":
 	parser.add_argument("--epochs", default = 26, type=int, help="The number of epochs to train GloVe for.")
 	parser.add_argument("--learning_rate", default=0.1, type=float, help="Learning rate for SGD.")
 	parser.add_argument("--learning_rate_decay", default=25.0, type=float, help="LR is halved after this many epochs, divided by three after twice this, by four after three times this, etc.")
+	parser.add_argument("--precision", default="float64", choices=["float64", "float32"],
+						help="Floating point precision of s_glove models (float32 halves their memory).")
+	parser.add_argument("--training_threads", default=None, type=int, help="Number of threads used to train (default: all cores).")
+	parser.add_argument("--early_stopping_tolerance", default=None, type=float,
+						help="Stop training once the error has not improved by this fraction for --early_stopping_patience epochs (s_glove only).")
+	parser.add_argument("--early_stopping_patience", default=3, type=int, help="See --early_stopping_tolerance.")
+	parser.add_argument("--training_blocks", default=None, type=int,
+						help="Train s_glove in rounds of this many blocks a side that share no words, instead of Hogwild-style (e.g. the number of threads).")
+	parser.add_argument("--training_stats", action="store_true",
+						help="Log s_glove throughput, thread utilisation and gradient norms per epoch and save them (with error histograms) to a .training_stats.jsonl file.")
+	parser.add_argument("--min_pair_weight", default=0.0, type=float,
+						help="Leave pairs whose weight (1 - p-value) is below this out of s_glove training.")
+	parser.add_argument("--importance_sample_below", default=None, type=float,
+						help="Each epoch, train an s_glove pair weighted w below this with probability w/this, upweighted to this.")
+	parser.add_argument("--surprise_index", default=0, type=int,
+						help="Index this many most surprising partners of every word with each saved model, and report surprises from it.")
+	parser.add_argument("--surprise_index_memory_mb", default=256, type=float, help="Memory budget for building the surprise index.")
 	parser.add_argument("--print_surprise_every", default=25, type=int, help="Evaluate the whole dataset and print the most surprising every this number of epochs (time consuming).")
 	parser.add_argument("--glove_x_max", default = 100.0, type=float, help="x_max parameter in GloVe.")
 	parser.add_argument("--glove_alpha", default = 0.75, type=float, help="alpha parameter in GloVe.")
@@ -432,8 +635,22 @@ if __name__ == "__main__":
 						help="Max fraction of documents a word can appear in to be included.")
 	parser.add_argument("--overwrite_model", action="store_true",
 						help="Ignore (and overwrite) existing .glovex file.")
+	parser.add_argument("--keep_checkpoints", default=None, type=int,
+						help="Number of the newest .glovex checkpoints of each model to keep (default: all).")
+	parser.add_argument("--warm_start", default=None, type=str,
+						help="Initialise the model from the latest checkpoint of this earlier run (input file plus its argstring) instead of at random.")
+	parser.add_argument("--warm_start_focus_epochs", default=0, type=int,
+						help="After a warm start, train only the pairs of new or changed words for this many epochs first.")
 	parser.add_argument("--overwrite_preprocessing", action="store_true",
 						help="Ignore (and overwrite) existing .preprocessed file.")
+	parser.add_argument("--append_preprocessing", action="store_true",
+						help="Add documents appended to the input since the existing .preprocessed file was written to it.")
+	parser.add_argument("--preprocessing_memory_mb", default=None, type=float,
+						help="Pre-process out of core, keeping memory use to about this many MB (default: in memory).")
+	parser.add_argument("--preprocessing_workers", default=None, type=int,
+						help="Number of processes used to tokenise the corpus (default: all cores).")
+	parser.add_argument("--normalisation_cache", default=os.path.expanduser("~/.glovex/normalisation"), type=str,
+						help="On-disk store of singularised word forms shared between runs and datasets (empty string to disable).")
 	parser.add_argument("--use_sglove", action="store_true",
 						help="Use the modified version of the GloVe algorithm that favours surprise rather than co-occurrence.")
 	parser.add_argument("--familiarity_categories", default=None, type=str,
@@ -452,40 +669,57 @@ if __name__ == "__main__":
 		sys.exit()
 
 	# Preprocess the data
-	reader.preprocess(no_below=args.no_below, no_above=args.no_above, force_overwrite=args.overwrite_preprocessing)
+	reader.preprocess(no_below=args.no_below, no_above=args.no_above, force_overwrite=args.overwrite_preprocessing,
+					 workers=args.preprocessing_workers, normalisation_cache=args.normalisation_cache or None,
+					 append=args.append_preprocessing, memory_budget_mb=args.preprocessing_memory_mb)
 	
 	init_step_size = args.learning_rate
-	step_size_decay = 25.0
-	cores = multiprocessing.cpu_count() / 2
-
-  # If the familiarity categories (fam_cat) are unknown
+	step_size_decay = args.learning_rate_decay
+	cores = args.training_threads or multiprocessing.cpu_count()
+
+	# Create or load the model of a run, warm-starting it from an earlier model when asked to, or when the run's own
+	# checkpoints were trained on a different vocabulary.  Returns the model, the epoch to train it from, its
+	# vocabulary and the mask of words to focus the first epochs on.
+	def prepare_model(argstring, cooccurrence, p_values, fc=None):
+		vocabulary = reader.model_vocabulary(fc)
+		if args.warm_start:
+			model_files = checkpoint.checkpoints(args.warm_start+("_fc"+fc if fc is not None else ""))
+			source = model_files[-1][1] if model_files else None
+		else:
+			source = None if args.overwrite_model else stale_checkpoint(args.inputfile, argstring, vocabulary[0])
+		model = glovex_model(args.inputfile, argstring, cooccurrence, args.dims, args.glove_alpha, args.glove_x_max,
+							 args.overwrite_model or source is not None, use_sglove=args.use_sglove, p_values=p_values,
+							 training_set_path=reader.training_set_path(fc), dtype=args.precision, min_weight=args.min_pair_weight)
+		if source is None:
+			return model, 0 if args.overwrite_model else resume_epoch(args.inputfile, argstring), vocabulary, None
+		focus = checkpoint.warm_start(model, source, *vocabulary)
+		checkpoint.retire(args.inputfile+argstring)
+		return model, 0, vocabulary, focus
+
+	# If the familiarity categories (fam_cat) are unknown
 	if args.familiarity_categories is None:
-		model = glovex_model(args.inputfile, reader.argstring, reader.cooccurrence, args.dims, args.glove_alpha, args.glove_x_max,
-							 args.overwrite_model, use_sglove=args.use_sglove, p_values=reader.cooccurrence_p_values)
+		model, first_epoch, vocabulary, focus = prepare_model(reader.argstring, reader.cooccurrence, reader.cooccurrence_p_values)
 		logger.info(" ** Training GloVe")
-		for epoch in range(args.epochs):
-			err = model.train(workers=cores, batch_size=100, step_size=init_step_size/(1.0+epoch/step_size_decay))
-			logger.info("   **** Training GloVe: epoch %d, error %.5f" % (epoch, err))
-      
-			if epoch and epoch % args.print_surprise_every == 0:
-				top_n = 50
-				print_top_n_surps(model, reader, top_n)
-				save_model(model, args.inputfile, reader.argstring+"_epochs"+str(epoch))
-		save_model(model, args.inputfile, reader.argstring+"_epochs"+str(epoch))
-
-  # If the familiarity categories (fam_cat) are known
+		train_glovex(model, reader, reader.argstring, args.epochs, init_step_size, step_size_decay, cores, args.print_surprise_every,
+					 tolerance=args.early_stopping_tolerance, patience=args.early_stopping_patience, sample_below=args.importance_sample_below,
+					 first_epoch=first_epoch, keep=args.keep_checkpoints, blocks=args.training_blocks, stats=args.training_stats,
+					 vocabulary=vocabulary, focus=focus, focus_epochs=args.warm_start_focus_epochs, index_k=args.surprise_index,
+					 index_memory_mb=args.surprise_index_memory_mb)
+
+	# If the familiarity categories (fam_cat) are known
 	else:
-		for fc,fc_cooccurrence in reader.cooccurrence.iteritems():
+		# Train the per-famcat models concurrently, each on its share of the cores
+		def train_fc(fc, threads, progress):
 			# Pass the familiarity category (fam_cat) file to the glovex_model function
-      model = glovex_model(args.inputfile, reader.argstring+"_fc"+fc, fc_cooccurrence, args.dims, args.glove_alpha, args.glove_x_max,
-								 args.overwrite_model, use_sglove=args.use_sglove, p_values=reader.cooccurrence_p_values[fc])
+			model, first_epoch, vocabulary, focus = prepare_model(reader.argstring+"_fc"+fc, reader.cooccurrence[fc],
+																  reader.cooccurrence_p_values[fc], fc)
 
 			logger.info(" ** Training GloVe for "+fc)
-			for epoch in range(args.epochs):
-				err = model.train(workers=cores, batch_size=100, step_size=init_step_size/(1.0+epoch/step_size_decay))
-				logger.info("   **** Training GloVe for "+fc+": epoch %d, error %.5f" % (epoch, err))
-				if epoch and epoch % args.print_surprise_every == 0:
-          top_n = 50
-					print_top_n_surps(model, reader, top_n)
-					save_model(model, args.inputfile, reader.argstring+"_epochs"+str(epoch))
-			save_model(model, args.inputfile, reader.argstring+"_epochs"+str(epoch))
+			train_glovex(model, reader, reader.argstring+"_fc"+fc, args.epochs, init_step_size, step_size_decay, threads, args.print_surprise_every,
+						 label=" for "+fc, tolerance=args.early_stopping_tolerance, patience=args.early_stopping_patience,
+						 sample_below=args.importance_sample_below, first_epoch=first_epoch, keep=args.keep_checkpoints,
+						 progress=progress, blocks=args.training_blocks, stats=args.training_stats, vocabulary=vocabulary, focus=focus,
+						 focus_epochs=args.warm_start_focus_epochs, index_k=args.surprise_index, index_memory_mb=args.surprise_index_memory_mb,
+						 n_docs=reader.docs_per_fc[fc], fc=fc)
+		sizes = dict((fc, scheduler.pair_count(fc_cooccurrence)) for fc,fc_cooccurrence in reader.cooccurrence.iteritems())
+		scheduler.train_concurrently(sizes, args.epochs, cores, train_fc)
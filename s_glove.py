@@ -1,18 +1,194 @@
-import re, gzip, pickle, time
-from multiprocessing import Queue, Lock
-import threading
+import os, re, gzip, json, logging, pickle, shutil, time
+import multiprocessing
 import numpy as np
 from scipy import stats
 import pyximport
 pyximport.install(setup_args={"include_dirs": np.get_include()})
 
-from s_glove_inner import train_glove
+from s_glove_inner import train_glove, train_glove_epochs, STATS_FIELDS, STATS_WIDTH, HISTOGRAM_OFFSET, HISTOGRAM_BINS
+
+logger = logging.getLogger("glovex")
+
+class TrainingSet(object):
+    FIELDS = (("keys", np.int32), ("subkeys", np.int32), ("targets", np.float64), ("p_values", np.float64))
+
+    def __init__(self, keys, subkeys, targets, p_values, n_cooccurring=None, min_weight=0.0):
+        """
+        Every co-occurring (key, subkey) pair with its co-occurrence (target)
+        and p-value, packed into contiguous arrays in row-major order. Built
+        once and sliced into batches without copying on every epoch.
+        Pairs whose weight (1 - p-value) is below min_weight were left out;
+        n_cooccurring counts all pairs, including those.
+        """
+        self.keys     = keys
+        self.subkeys  = subkeys
+        self.targets  = targets
+        self.p_values = p_values
+        self.n_cooccurring = len(keys) if n_cooccurring is None else n_cooccurring
+        self.min_weight = min_weight
+        self._blocked = {}
+
+    @classmethod
+    def from_cooccurrence(cls, cooccurence, p_values, min_weight=0.0):
+        """
+        Pack a co-occurrence matrix and its p-values, dropping pairs whose
+        weight (1 - p-value) is below min_weight. Sparse views (with
+        .matrix) are packed directly, p-values being aligned with the
+        co-occurrence entries; dict-of-dicts are walked pair by pair.
+        """
+        if hasattr(cooccurence, "matrix") and hasattr(p_values, "matrix"):
+            keys, subkeys, targets = cooccurence.pairs()
+            pvals = p_values.matrix.data
+        else:
+            pairs = [(key, subkey) for key in cooccurence for subkey in cooccurence[key]]
+            keys = np.array([k for k,s in pairs], dtype=np.int32)
+            subkeys = np.array([s for k,s in pairs], dtype=np.int32)
+            targets = np.array([cooccurence[k][s] for k,s in pairs], dtype=np.float64)
+            pvals = np.array([p_values[k][s] for k,s in pairs], dtype=np.float64)
+        n_cooccurring = len(keys)
+        if min_weight > 0:
+            keep = np.flatnonzero(1 - np.asarray(pvals) >= min_weight)
+            keys, subkeys, targets, pvals = keys[keep], subkeys[keep], targets[keep], pvals[keep]
+            logger.info("   **** Skipping %d of %d pairs (%.1f%%) weighted below %g" % (n_cooccurring - len(keep), n_cooccurring,
+                        100.0 * (n_cooccurring - len(keep)) / max(n_cooccurring, 1), min_weight))
+        return cls(np.ascontiguousarray(keys, dtype=np.int32), np.ascontiguousarray(subkeys, dtype=np.int32),
+                   np.ascontiguousarray(targets, dtype=np.float64), np.ascontiguousarray(pvals, dtype=np.float64),
+                   n_cooccurring, min_weight)
+
+    @classmethod
+    def cached(cls, path, cooccurence, p_values, min_weight=0.0):
+        """
+        The training set stored in directory path (memory-mapped), packing
+        and storing it there first if it does not exist yet, no longer
+        matches the number of co-occurring pairs or was built with another
+        min_weight.
+        """
+        if os.path.isdir(path):
+            training_set = cls.load(path)
+            if ((not hasattr(cooccurence, "nnz") or training_set.n_cooccurring == cooccurence.nnz)
+                    and training_set.min_weight == min_weight):
+                return training_set
+        training_set = cls.from_cooccurrence(cooccurence, p_values, min_weight)
+        training_set.save(path)
+        return cls.load(path)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        for p in (tmp_path, path):
+            if os.path.isdir(p):
+                shutil.rmtree(p)
+        os.makedirs(tmp_path)
+        for name, dtype in self.FIELDS:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"n_cooccurring": self.n_cooccurring, "min_weight": self.min_weight}, f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        meta = {}
+        if os.path.exists(os.path.join(path, "meta.json")):
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        return cls(*[np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name, dtype in cls.FIELDS], **meta)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def blocked(self, n_blocks):
+        """
+        The pairs regrouped into n_blocks x n_blocks blocks, with the block
+        offsets (row block i, column block j spanning pairs
+        offsets[i*n_blocks+j] to offsets[i*n_blocks+j+1]). Keys and subkeys
+        are split into contiguous ranges holding about as many pairs each.
+        Computed once per n_blocks.
+        """
+        if n_blocks not in self._blocked:
+            keys, subkeys = np.asarray(self.keys), np.asarray(self.subkeys)
+            n_words = int(max(keys.max(), subkeys.max())) + 1 if len(keys) else 0
+            row_blocks = _balanced_ranges(np.bincount(keys, minlength=n_words), n_blocks)
+            col_blocks = _balanced_ranges(np.bincount(subkeys, minlength=n_words), n_blocks)
+            block = row_blocks[keys].astype(np.int64) * n_blocks + col_blocks[subkeys]
+            order = np.argsort(block, kind="mergesort")
+            offsets = np.zeros(n_blocks * n_blocks + 1, dtype=np.intp)
+            offsets[1:] = np.cumsum(np.bincount(block, minlength=n_blocks * n_blocks))
+            blocked = TrainingSet(keys[order], subkeys[order], np.asarray(self.targets)[order], np.asarray(self.p_values)[order],
+                                  self.n_cooccurring, self.min_weight)
+            self._blocked[n_blocks] = (blocked, offsets)
+        return self._blocked[n_blocks]
+
+    def restricted(self, rows):
+        """
+        The pairs whose key or subkey is one of the rows (a boolean mask
+        over the vocabulary).
+        """
+        keep = np.flatnonzero(rows[np.asarray(self.keys)] | rows[np.asarray(self.subkeys)])
+        return TrainingSet(np.asarray(self.keys)[keep], np.asarray(self.subkeys)[keep], np.asarray(self.targets)[keep],
+                           np.asarray(self.p_values)[keep], self.n_cooccurring, self.min_weight)
+
+    def sampled_fraction(self, sample_below=0.0):
+        """
+        Expected fraction of all co-occurring pairs trained on per epoch
+        when pairs weighted below sample_below are importance-sampled.
+        """
+        if not self.n_cooccurring:
+            return 0.0
+        if sample_below <= 0:
+            return float(len(self)) / self.n_cooccurring
+        weights = 1 - np.asarray(self.p_values)
+        return float(np.minimum(weights / sample_below, 1.0).sum()) / self.n_cooccurring
+
+    def batch(self, start, end):
+        return (self.keys[start:end], self.subkeys[start:end], self.targets[start:end], self.p_values[start:end])
+
+def _balanced_ranges(counts, n_ranges):
+    """
+    Range (0 to n_ranges-1) of each item when items are split into
+    consecutive ranges holding about the same total count.
+    """
+    starts = np.cumsum(counts) - counts
+    return np.minimum(starts * n_ranges // max(counts.sum(), 1), n_ranges - 1).astype(np.intp)
+
+class TrainingStats(object):
+    def __init__(self, epoch, error, seconds, thread_stats, prepare_seconds=0.0):
+        """
+        Statistics of one training epoch: its error, wall-clock seconds,
+        the seconds spent loading or building the training set before it,
+        and per OpenMP thread (rows of thread_stats, laid out as in
+        s_glove_inner) the pairs trained, the seconds spent training them,
+        their summed error and squared gradient norm and a histogram of
+        pair errors, bin k counting errors in [2**(k-31), 2**(k-30)).
+        """
+        fields = dict(zip(STATS_FIELDS, thread_stats[:, :len(STATS_FIELDS)].T))
+        self.epoch           = epoch
+        self.error           = error
+        self.seconds         = seconds
+        self.prepare_seconds = prepare_seconds
+        self.thread_pairs    = fields["pairs"].astype(np.int64)
+        self.thread_seconds  = fields["seconds"]
+        self.pairs           = int(self.thread_pairs.sum())
+        self.pairs_per_second = self.pairs / max(seconds, 1e-9)
+        self.utilisation     = self.thread_seconds / max(seconds, 1e-9)
+        self.gradient_norm   = float(np.sqrt(fields["gradient"].sum() / max(self.pairs, 1)))
+        self.error_histogram = thread_stats[:, HISTOGRAM_OFFSET:HISTOGRAM_OFFSET+HISTOGRAM_BINS].sum(axis=0).astype(np.int64)
+
+    def as_dict(self):
+        """
+        The statistics as plain (JSON-serialisable) values.
+        """
+        return {"epoch": self.epoch, "error": self.error, "seconds": self.seconds, "prepare_seconds": self.prepare_seconds,
+                "pairs": self.pairs, "pairs_per_second": self.pairs_per_second, "gradient_norm": self.gradient_norm,
+                "thread_pairs": self.thread_pairs.tolist(), "thread_seconds": self.thread_seconds.tolist(),
+                "utilisation": self.utilisation.tolist(), "error_histogram": self.error_histogram.tolist()}
 
 class Glove(object):
-    def __init__(self, cooccurence, p_values, alpha=0.75, x_max=100.0, d=50, seed=1234):
+    def __init__(self, cooccurence, p_values, alpha=0.75, x_max=100.0, d=50, seed=1234, training_set_path=None, dtype=np.float64,
+                 min_weight=0.0):
         """
         Glove model for obtaining dense embeddings from a
-        co-occurence (sparse) matrix.
+        co-occurence (sparse) matrix. dtype (float64 or float32) is the
+        precision of the vectors, biases and AdaGrad accumulators. Pairs
+        weighted (1 - p-value) below min_weight are left out of training.
         """
         self.alpha           = alpha
         self.x_max           = x_max
@@ -20,86 +196,130 @@ class Glove(object):
         self.cooccurence     = cooccurence
         self.p_values      = p_values
         self.seed            = seed
+        self.training_set_path = training_set_path
+        self.training_set    = None
+        self.errors          = []
+        self.min_weight      = min_weight
+        self.dtype           = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError("Unsupported precision %s: use float32 or float64" % self.dtype)
         np.random.seed(seed)
-        self.W               = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), d)).astype(np.float64)
-        self.ContextW        = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), d)).astype(np.float64)
-        self.b               = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), 1)).astype(np.float64)
-        self.ContextB        = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), 1)).astype(np.float64)
-        self.gradsqW         = np.ones_like(self.W, dtype=np.float64)
-        self.gradsqContextW  = np.ones_like(self.ContextW, dtype=np.float64)
-        self.gradsqb         = np.ones_like(self.b, dtype=np.float64)
-        self.gradsqContextB  = np.ones_like(self.ContextB, dtype=np.float64)
+        self.W               = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), d)).astype(self.dtype)
+        self.ContextW        = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), d)).astype(self.dtype)
+        self.b               = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), 1)).astype(self.dtype)
+        self.ContextB        = np.random.uniform(-0.5/d, 0.5/d, (len(cooccurence), 1)).astype(self.dtype)
+        self.gradsqW         = np.ones_like(self.W, dtype=self.dtype)
+        self.gradsqContextW  = np.ones_like(self.ContextW, dtype=self.dtype)
+        self.gradsqb         = np.ones_like(self.b, dtype=self.dtype)
+        self.gradsqContextB  = np.ones_like(self.ContextB, dtype=self.dtype)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["training_set"] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("training_set_path", None)
+        state.setdefault("training_set", None)
+        state.setdefault("errors", [])
+        state.setdefault("min_weight", 0.0)
+        state.setdefault("dtype", np.dtype(np.float64))
+        self.__dict__.update(state)
+
+    def get_training_set(self):
+        """
+        The packed training set, built (or loaded from training_set_path)
+        on first use.
+        """
+        if self.training_set is None:
+            if self.training_set_path is not None:
+                self.training_set = TrainingSet.cached(self.training_set_path, self.cooccurence, self.p_values, self.min_weight)
+            else:
+                self.training_set = TrainingSet.from_cooccurrence(self.cooccurence, self.p_values, self.min_weight)
+        return self.training_set
+
+    def early_stopping_state(self, tolerance):
+        """
+        The best error in self.errors and the number of epochs since it
+        last improved by more than a tolerance fraction.
+        """
+        best, stalls = float("inf"), 0
+        if tolerance is not None:
+            for err in self.errors:
+                if err < best * (1.0 - tolerance):
+                    best, stalls = err, 0
+                else:
+                    stalls += 1
+        return best, stalls
+
+    def train_epochs(self, n_epochs, init_step_size=0.05, step_size_decay=25.0, first_epoch=0, workers=None,
+                     tolerance=None, patience=3, sample_below=None, blocks=None, callback=None, stats_path=None, focus=None):
+        """
+        Train for up to n_epochs epochs in a single native call on workers
+        OpenMP threads (default: all cores), with step size
+        init_step_size/(1+epoch/step_size_decay). With a tolerance, stops
+        early once the error has not improved by that fraction for patience
+        epochs, counting the epochs recorded in self.errors. With
+        sample_below, each epoch trains a pair weighted w < sample_below
+        with probability w/sample_below, at weight sample_below. With
+        blocks, pairs are trained in rounds of blocks x blocks row/column
+        blocks that share no rows (see TrainingSet.blocked) rather than
+        Hogwild-style. With a callback or stats_path, epochs run one native
+        call at a time and each epoch's TrainingStats is passed to
+        callback and appended to the JSON-lines file stats_path as soon as
+        it is done. With focus (a boolean mask over the vocabulary), only
+        pairs involving those words are trained, without early stopping,
+        and the errors are not recorded in self.errors. Returns the errors
+        of the epochs run.
+        """
+        if not n_epochs:
+            return []
+        start = time.time()
+        training_set = self.get_training_set()
+        if focus is not None:
+            training_set, tolerance = training_set.restricted(focus), None
+            logger.info("   **** Training on the %d pairs involving %d new or changed words" % (len(training_set), focus.sum()))
+        sample_below = sample_below or 0.0
+        offsets = None
+        if blocks:
+            training_set, offsets = training_set.blocked(blocks)
+        prepare_seconds = time.time() - start
+        threads = workers or multiprocessing.cpu_count()
+        detailed = callback is not None or stats_path is not None
+        errors = []
+        while len(errors) < n_epochs:
+            n = 1 if detailed else n_epochs - len(errors)
+            best, stalls = self.early_stopping_state(tolerance)
+            if tolerance is not None and stalls >= patience:
+                break
+            chunk_errors = np.zeros(n, dtype=np.float64)
+            stats = np.zeros((n, threads, STATS_WIDTH), dtype=np.float64)
+            chunk_start = time.time()
+            done, stopped = train_glove_epochs(self, training_set, first_epoch + len(errors), n, init_step_size, step_size_decay,
+                                               threads, -1.0 if tolerance is None else tolerance, patience, best, stalls,
+                                               sample_below, self.seed, chunk_errors, stats, detailed, blocks or 0, offsets)
+            seconds = time.time() - chunk_start
+            if focus is None:
+                self.errors += chunk_errors[:done].tolist()
+            if detailed:
+                for i in range(done):
+                    epoch_stats = TrainingStats(first_epoch + len(errors) + i, chunk_errors[i], seconds / done, stats[i],
+                                                prepare_seconds if not errors and not i else 0.0)
+                    if stats_path is not None:
+                        with open(stats_path, "a") as f:
+                            f.write(json.dumps(epoch_stats.as_dict()) + "\n")
+                    if callback is not None:
+                        callback(epoch_stats)
+            errors += chunk_errors[:done].tolist()
+            if stopped:
+                break
+        if training_set.min_weight > 0 or sample_below > 0:
+            logger.info("   **** %.2fs per epoch, training on %.1f%% of the %d co-occurring pairs" % ((time.time() - start - prepare_seconds) / max(len(errors), 1),
+                        100.0 * training_set.sampled_fraction(sample_below), training_set.n_cooccurring))
+        return errors
 
     def train(self, step_size=0.05, workers = 9, batch_size=50, verbose=False):
-        jobs = Queue(maxsize=2 * workers)
-        lock = threading.Lock()  # for shared state (=number of words trained so far, log reports...)
-        total_error = [0.0]
-        total_done  = [0]
-
-        total_els = 0
-        for key in self.cooccurence:
-            for subkey in self.cooccurence[key]:
-                total_els += 1
-
-        # Worker function:\
-        def worker_train():
-            error = np.zeros(1, dtype = np.float64)
-            while True:
-                job = jobs.get()
-                if job is None:  # data finished, exit
-                    break
-                train_glove(self, job, step_size, error)
-                with lock:
-                    total_error[0] += error[0]
-                    total_done[0] += len(job[0])
-                    if verbose:
-                        if total_done[0] % 1000 == 0:
-                            print("Completed %.3f%%\r" % (100.0 * total_done[0] / total_els))
-                error[0] = 0.0
-
-        # Create workers
-        workers_threads = [threading.Thread(target=worker_train) for _ in range(workers)]
-        for thread in workers_threads:
-            thread.daemon = True  # make interrupting the process with ctrl+c easier
-            thread.start()
-
-        # Batch co-occurence pieces
-        batch_length = 0
-        batch = []
-        num_examples = 0
-        for key in self.cooccurence:
-            for subkey in self.cooccurence[key]:
-                batch.append((key, subkey, self.cooccurence[key][subkey], self.p_values[key][subkey]))
-                batch_length += 1
-                if batch_length >= batch_size:
-                    jobs.put(
-                        (
-                            np.array([k for k,s,c,p in batch], dtype=np.int32),
-                            np.array([s for k,s,c,p in batch], dtype=np.int32),
-                            np.array([c for k,s,c,p in batch], dtype=np.float64),
-                            np.array([p for k,s,c,p in batch], dtype=np.float64)
-                        )
-                    )
-                    num_examples += len(batch)
-                    batch = []
-                    batch_length = 0
-        if len(batch) > 0:
-            jobs.put(
-                (
-                    np.array([k for k,s,c,p in batch], dtype=np.int32),
-                    np.array([s for k,s,c,p in batch], dtype=np.int32),
-                    np.array([c for k,s,c,p in batch], dtype=np.float64),
-                    np.array([p for k,s,c,p in batch], dtype=np.float64)
-                )
-            )
-            num_examples += len(batch)
-            batch = []
-            batch_length = 0
-
-        for _ in range(workers):
-            jobs.put(None)  # give the workers heads up that they can finish -- no more work!
-
-        for thread in workers_threads:
-            thread.join()
-
-        return total_error[0] / num_examples
+        """
+        One epoch at a fixed step size (batch_size is no longer used).
+        """
+        return self.train_epochs(1, step_size, float("inf"), workers=workers)[0]
@@ -8,68 +8,163 @@ import cython
 import numpy as np
 cimport numpy as np
 
-from libc.math cimport exp, log, pow, sqrt
+from libc.math cimport exp, log, pow, sqrt, frexp
+from cython.parallel import prange, parallel, threadid
+cimport openmp
+
+cdef extern from "math.h" nogil:
+    float sqrtf(float x)
 
 ctypedef np.float64_t REAL_t
 ctypedef np.uint32_t  INT_t
 
+# Precision of the model parameters: training sets (targets, p-values) are float64 in both cases
+ctypedef fused PARAM_t:
+    float
+    double
+
+# Layout of the per-thread training statistics of an epoch: one row of STATS_WIDTH doubles per thread (padded to
+# whole cache lines) holding the pairs trained, seconds spent training them, their summed error, their summed squared
+# gradient norm and (optionally) a histogram of their errors, bin k counting errors in [2**(k-31), 2**(k-30))
+DEF STAT_PAIRS     = 0
+DEF STAT_SECONDS   = 1
+DEF STAT_ERROR     = 2
+DEF STAT_GRADIENT  = 3
+DEF STAT_HISTOGRAM = 4
+DEF N_BINS         = 32
+DEF WIDTH          = 40
+STATS_FIELDS = ("pairs", "seconds", "error", "gradient")
+STATS_WIDTH = WIDTH
+HISTOGRAM_OFFSET = STAT_HISTOGRAM
+HISTOGRAM_BINS = N_BINS
+
+# Model arrays passed to the kernels, in argument order
+PARAMS = ("W", "ContextW", "gradsqW", "gradsqContextW", "b", "ContextB", "gradsqb", "gradsqContextB")
+
+cdef inline PARAM_t param_sqrt(PARAM_t x) nogil:
+    if PARAM_t is float:
+        return sqrtf(x)
+    else:
+        return sqrt(x)
+
+# Uniform [0, 1) number for pair i in the given epoch: splitmix64 of the three, so that any thread can draw it
+cdef inline double pair_uniform(unsigned long long seed, unsigned long long epoch, unsigned long long i) nogil:
+    cdef unsigned long long z = seed * 0x9E3779B97F4A7C15ULL + epoch * 0xBF58476D1CE4E5B9ULL + i
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+    z = z ^ (z >> 31)
+    return (z >> 11) * (1.0 / 9007199254740992.0)
+
+# One AdaGrad step on a single (key, subkey) pair; returns its weighted squared error and adds the squared norm of
+# its gradient to gradient[0]
+cdef inline REAL_t train_glove_pair(
+        PARAM_t * W,       PARAM_t * ContextW,
+        PARAM_t * gradsqW, PARAM_t * gradsqContextW,
+        PARAM_t * bias,       PARAM_t * ContextB,
+        PARAM_t * gradsqb, PARAM_t * gradsqContextB,
+        INT_t key, INT_t subkey, REAL_t target, REAL_t weight,
+        int vector_size, PARAM_t step_size, REAL_t * gradient) nogil:
+
+    cdef long long b, l1, l2
+    cdef PARAM_t temp1, temp2, diff, fdiff, norm = 0
+    cdef REAL_t error
+
+    # Calculate cost, save diff for gradients
+    l1 = key    * vector_size # cr word indices start at 1
+    l2 = subkey * vector_size
+
+    diff = 0.0;
+    for b in range(vector_size):
+        diff += W[b + l1] * ContextW[b + l2] # dot product of word and context word vector
+    diff += bias[key] + ContextB[subkey] - <PARAM_t>log(target) # add separate bias for each word
+    #fdiff = diff if (target > x_max) else pow(target / x_max, alpha) * diff # multiply weighting function (f) with diff
+    fdiff = diff * <PARAM_t>weight # multiply weighting function (f = 1 - p-value) with diff
+    error = 0.5 * fdiff * diff # weighted squared error
+
+    # # Adaptive gradient updates
+    fdiff *= step_size # for ease in calculating gradient
+    for b in range(vector_size):
+        # learning rate times gradient for word vectors
+        temp1 = fdiff * ContextW[b + l2]
+        temp2 = fdiff * W[b + l1]
+        # adaptive updates
+        W[b + l1]              -= (temp1 / param_sqrt(gradsqW[b + l1]))
+        ContextW[b + l2]       -= (temp2 / param_sqrt(gradsqContextW[b + l2]))
+        gradsqW[b + l1]        += temp1 * temp1
+        gradsqContextW[b + l2] += temp2 * temp2
+        norm += temp1 * temp1 + temp2 * temp2
+    # updates for bias terms
+    bias[key]        -= fdiff / param_sqrt(gradsqb[key]);
+    ContextB[subkey] -= fdiff / param_sqrt(gradsqContextB[subkey]);
+
+    fdiff *= fdiff;
+    gradsqb[key]           += fdiff
+    gradsqContextB[subkey] += fdiff
+    if step_size > 0:
+        gradient[0] += (norm + 2 * fdiff) / (step_size * step_size)
+    return error
+
+# Weight a pair with p-value pval trains with in the given epoch (its index i seeding the draw): 1 - pval, or for
+# pairs weighted below sample_below, sample_below with probability weight/sample_below (unbiased) and 0 otherwise
+cdef inline REAL_t pair_weight(REAL_t pval, double sample_below, unsigned long long seed, int epoch, Py_ssize_t i) nogil:
+    cdef REAL_t weight = 1 - pval
+    if weight < sample_below:
+        weight = sample_below if pair_uniform(seed, epoch, i) * sample_below < weight else 0
+    return weight
+
+# Train on pairs [start, end) of a training set in order, adding to a thread's row of statistics (see STAT_*),
+# with a histogram of the pair errors if histogram is set
+cdef void train_glove_range(
+        PARAM_t * W,       PARAM_t * ContextW,
+        PARAM_t * gradsqW, PARAM_t * gradsqContextW,
+        PARAM_t * bias,       PARAM_t * ContextB,
+        PARAM_t * gradsqb, PARAM_t * gradsqContextB,
+        INT_t * keys, INT_t * subkeys, REAL_t * targets, REAL_t * pvals, Py_ssize_t start, Py_ssize_t end,
+        int vector_size, PARAM_t step_size, double sample_below, unsigned long long seed, int epoch,
+        REAL_t * stats, bint histogram) nogil:
+
+    cdef Py_ssize_t i
+    cdef int exponent
+    cdef REAL_t weight, pair_error, error = 0.0, gradient = 0.0, pairs = 0.0
+    cdef double started = openmp.omp_get_wtime()
+    for i in range(start, end):
+        weight = pair_weight(pvals[i], sample_below, seed, epoch, i)
+        # a zero weight leaves the parameters unchanged, so skip the pair's dot product and updates
+        if weight > 0:
+            pair_error = train_glove_pair(W, ContextW, gradsqW, gradsqContextW, bias, ContextB, gradsqb, gradsqContextB,
+                                          keys[i], subkeys[i], targets[i], weight, vector_size, step_size, &gradient)
+            error += pair_error
+            pairs += 1
+            if histogram:
+                if pair_error > 0:
+                    frexp(pair_error, &exponent)
+                    stats[STAT_HISTOGRAM + min(max(exponent + N_BINS - 2, 0), N_BINS - 1)] += 1
+                else:
+                    stats[STAT_HISTOGRAM] += 1
+    stats[STAT_PAIRS] += pairs
+    stats[STAT_ERROR] += error
+    stats[STAT_GRADIENT] += gradient
+    stats[STAT_SECONDS] += openmp.omp_get_wtime() - started
+
 cdef void train_glove_thread(
-        REAL_t * W,       REAL_t * ContextW,
-        REAL_t * gradsqW, REAL_t * gradsqContextW,
-        REAL_t * bias,       REAL_t * ContextB,
-        REAL_t * gradsqb, REAL_t * gradsqContextB,
+        PARAM_t * W,       PARAM_t * ContextW,
+        PARAM_t * gradsqW, PARAM_t * gradsqContextW,
+        PARAM_t * bias,       PARAM_t * ContextB,
+        PARAM_t * gradsqb, PARAM_t * gradsqContextB,
         REAL_t * error,
         INT_t * job_key, INT_t * job_subkey, REAL_t * job_target,
-		REAL_t * job_pvals,
-        int vector_size, int batch_size, REAL_t x_max, REAL_t alpha, REAL_t step_size) nogil:
+        REAL_t * job_pvals,
+        int vector_size, int batch_size, REAL_t x_max, REAL_t alpha, PARAM_t step_size) nogil:
 
-    cdef long long a, b, l1, l2
     cdef int example_idx = 0
-    cdef REAL_t temp1, temp2, diff, fdiff
+    cdef REAL_t gradient = 0.0
 
     for example_idx in range(batch_size):
-        # Calculate cost, save diff for gradients
-        l1 = job_key[example_idx]    * vector_size # cr word indices start at 1
-        l2 = job_subkey[example_idx] * vector_size
-
-        diff = 0.0;
-        for b in range(vector_size):
-            diff += W[b + l1] * ContextW[b + l2] # dot product of word and context word vector
-        diff += bias[job_key[example_idx]] + ContextB[job_subkey[example_idx]] - log(job_target[example_idx]) # add separate bias for each word
-        #fdiff = diff if (job_target[example_idx] > x_max) else pow(job_target[example_idx] / x_max, alpha) * diff # multiply weighting function (f) with diff
-        fdiff = diff * (1-job_pvals[example_idx]) # multiply weighting function (f) with diff
-        error[0] += 0.5 * fdiff * diff # weighted squared error
-
-        # # Adaptive gradient updates
-        fdiff *= step_size # for ease in calculating gradient
-        for b in range(vector_size):
-            # learning rate times gradient for word vectors
-            temp1 = fdiff * ContextW[b + l2]
-            temp2 = fdiff * W[b + l1]
-            # adaptive updates
-            W[b + l1]              -= (temp1 / sqrt(gradsqW[b + l1]))
-            ContextW[b + l2]       -= (temp2 / sqrt(gradsqContextW[b + l2]))
-            gradsqW[b + l1]        += temp1 * temp1
-            gradsqContextW[b + l2] += temp2 * temp2
-        # updates for bias terms
-        bias[job_key[example_idx]]        -= fdiff / sqrt(gradsqb[job_key[example_idx]]);
-        ContextB[job_subkey[example_idx]] -= fdiff / sqrt(gradsqContextB[job_subkey[example_idx]]);
-
-        fdiff *= fdiff;
-        gradsqb[job_key[example_idx]]           += fdiff
-        gradsqContextB[job_subkey[example_idx]] += fdiff
+        error[0] += train_glove_pair(W, ContextW, gradsqW, gradsqContextW, bias, ContextB, gradsqb, gradsqContextB,
+                                     job_key[example_idx], job_subkey[example_idx], job_target[example_idx], 1 - job_pvals[example_idx],
+                                     vector_size, step_size, &gradient)
 
 def train_glove(model, jobs, float _step_size, _error):
-    cdef REAL_t *W              = <REAL_t *>(np.PyArray_DATA(model.W))
-    cdef REAL_t *ContextW       = <REAL_t *>(np.PyArray_DATA(model.ContextW))
-    cdef REAL_t *gradsqW        = <REAL_t *>(np.PyArray_DATA(model.gradsqW))
-    cdef REAL_t *gradsqContextW = <REAL_t *>(np.PyArray_DATA(model.gradsqContextW))
-
-    cdef REAL_t *b              = <REAL_t *>(np.PyArray_DATA(model.b))
-    cdef REAL_t *ContextB       = <REAL_t *>(np.PyArray_DATA(model.ContextB))
-    cdef REAL_t *gradsqb        = <REAL_t *>(np.PyArray_DATA(model.gradsqb))
-    cdef REAL_t *gradsqContextB = <REAL_t *>(np.PyArray_DATA(model.gradsqContextB))
-
     cdef REAL_t *error          = <REAL_t *>(np.PyArray_DATA(_error))
 
     cdef INT_t  *job_key        = <INT_t  *>(np.PyArray_DATA(jobs[0]))
@@ -78,31 +173,133 @@ def train_glove(model, jobs, float _step_size, _error):
     cdef REAL_t *job_pvals     = <REAL_t *>(np.PyArray_DATA(jobs[3]))
 
     # configuration and parameters
-    cdef REAL_t step_size = _step_size
     cdef int vector_size = model.d
     cdef int batch_size = len(jobs[0])
     cdef REAL_t x_max   = model.x_max
     cdef REAL_t alpha   = model.alpha
 
+    cdef float  *f[8]
+    cdef double *d[8]
+    cdef int i
+    cdef bint single = model.W.dtype == np.float32
+    for i, name in enumerate(PARAMS):
+        if single:
+            f[i] = <float *>(np.PyArray_DATA(getattr(model, name)))
+        else:
+            d[i] = <double *>(np.PyArray_DATA(getattr(model, name)))
+
     # release GIL & train on the sentence
     with nogil:
-        train_glove_thread(
-            W,\
-            ContextW,\
-            gradsqW,\
-            gradsqContextW,\
-            b,\
-            ContextB,\
-            gradsqb,\
-            gradsqContextB,\
-            error,\
-            job_key,\
-            job_subkey,\
-            job_target, \
-			job_pvals, \
-            vector_size,\
-            batch_size, \
-            x_max, \
-            alpha, \
-            step_size
-        )
+        if single:
+            train_glove_thread(f[0], f[1], f[2], f[3], f[4], f[5], f[6], f[7], error, job_key, job_subkey, job_target, job_pvals,
+                               vector_size, batch_size, x_max, alpha, <float>_step_size)
+        else:
+            train_glove_thread(d[0], d[1], d[2], d[3], d[4], d[5], d[6], d[7], error, job_key, job_subkey, job_target, job_pvals,
+                               vector_size, batch_size, x_max, alpha, <double>_step_size)
+
+cdef int train_epochs(
+        PARAM_t * W,       PARAM_t * ContextW,
+        PARAM_t * gradsqW, PARAM_t * gradsqContextW,
+        PARAM_t * bias,       PARAM_t * ContextB,
+        PARAM_t * gradsqb, PARAM_t * gradsqContextB,
+        INT_t * keys, INT_t * subkeys, REAL_t * targets, REAL_t * pvals, Py_ssize_t n_pairs,
+        int vector_size, int first_epoch, int n_epochs, double init_step_size, double step_size_decay,
+        int n_threads, double tolerance, int patience, double best, int stalls, double sample_below,
+        unsigned long long seed, int n_blocks, Py_ssize_t * offsets, REAL_t * errors, REAL_t * stats, bint histogram,
+        bint * stopped) nogil:
+
+    cdef Py_ssize_t b
+    cdef int epoch, r, t, n, done = 0
+    cdef REAL_t error
+    cdef REAL_t * epoch_stats
+    cdef PARAM_t step_size
+
+    for epoch in range(n_epochs):
+        step_size = <PARAM_t>(init_step_size / (1.0 + (first_epoch + epoch) / step_size_decay))
+        epoch_stats = stats + epoch * n_threads * WIDTH
+        if not n_blocks:
+            # one contiguous range of pairs per thread
+            with parallel(num_threads=n_threads):
+                t = threadid()
+                n = openmp.omp_get_num_threads()
+                train_glove_range(W, ContextW, gradsqW, gradsqContextW, bias, ContextB, gradsqb, gradsqContextB,
+                                  keys, subkeys, targets, pvals, n_pairs * t / n, n_pairs * (t + 1) / n,
+                                  vector_size, step_size, sample_below, seed, first_epoch + epoch,
+                                  epoch_stats + t * WIDTH, histogram)
+        else:
+            # round r trains blocks (t, t+r): no two of them share a row of W or of ContextW
+            for r in range(n_blocks):
+                for b in prange(n_blocks, num_threads=n_threads, schedule="dynamic"):
+                    t = threadid()
+                    train_glove_range(W, ContextW, gradsqW, gradsqContextW, bias, ContextB, gradsqb, gradsqContextB,
+                                      keys, subkeys, targets, pvals,
+                                      offsets[b * n_blocks + (b + r) % n_blocks], offsets[b * n_blocks + (b + r) % n_blocks + 1],
+                                      vector_size, step_size, sample_below, seed, first_epoch + epoch,
+                                      epoch_stats + t * WIDTH, histogram)
+        error = 0.0
+        for t in range(n_threads):
+            error += epoch_stats[t * WIDTH + STAT_ERROR]
+        errors[epoch] = error / n_pairs if n_pairs else 0.0
+        done = epoch + 1
+        if tolerance >= 0:
+            if errors[epoch] < best * (1.0 - tolerance):
+                best = errors[epoch]
+                stalls = 0
+            else:
+                stalls = stalls + 1
+                if stalls >= patience:
+                    stopped[0] = True
+                    break
+    return done
+
+# Train for up to n_epochs epochs over a packed training set (see s_glove.TrainingSet) without returning to
+# Python.  Each epoch splits the pairs into one contiguous range per OpenMP thread (Hogwild-style updates, as
+# the threaded trainer did) and sums the error per thread.  The step size of epoch e (counted from first_epoch)
+# is init_step_size/(1+e/step_size_decay).  Each epoch's mean error goes to errors[epoch]; if tolerance >= 0,
+# training stops once the error has not improved on best by more than a tolerance fraction for patience epochs
+# in a row (stalls counts such epochs already seen).  Pairs whose weight (1 - p-value) is below sample_below are
+# importance-sampled: each epoch keeps one with probability weight/sample_below (drawn from seed, the epoch and
+# the pair's index) and trains it with weight sample_below.  The model's parameters may be float32 or float64.
+# Given n_blocks and block_offsets (see s_glove.TrainingSet.blocked), each epoch instead runs n_blocks rounds of
+# n_blocks blocks that share no rows, so the threads never update the same parameters at the same time.
+# Each thread's statistics go to stats[epoch, thread] (see STAT_*), an array of n_epochs x n_threads x STATS_WIDTH
+# zeros; the error histogram is only counted if histogram is set.  Returns the number of epochs run and whether
+# training stopped early (which it may do on the last of the n_epochs).
+def train_glove_epochs(model, training_set, int first_epoch, int n_epochs, double init_step_size, double step_size_decay,
+                       int n_threads, double tolerance, int patience, double best, int stalls, double sample_below,
+                       unsigned long long seed, double[:] errors, double[:, :, ::1] stats, bint histogram=False,
+                       int n_blocks=0, block_offsets=None):
+    cdef INT_t  *keys           = <INT_t  *>(np.PyArray_DATA(training_set.keys))
+    cdef INT_t  *subkeys        = <INT_t  *>(np.PyArray_DATA(training_set.subkeys))
+    cdef REAL_t *targets        = <REAL_t *>(np.PyArray_DATA(training_set.targets))
+    cdef REAL_t *pvals          = <REAL_t *>(np.PyArray_DATA(training_set.p_values))
+
+    cdef int vector_size = model.d
+    cdef Py_ssize_t n_pairs = len(training_set)
+    cdef int done
+    cdef bint stopped = False
+    cdef Py_ssize_t *offsets = NULL
+    if n_blocks:
+        offsets = <Py_ssize_t *>(np.PyArray_DATA(block_offsets))
+    cdef float  *f[8]
+    cdef double *d[8]
+    cdef int i
+    cdef bint single = model.W.dtype == np.float32
+    for i, name in enumerate(PARAMS):
+        if single:
+            f[i] = <float *>(np.PyArray_DATA(getattr(model, name)))
+        else:
+            d[i] = <double *>(np.PyArray_DATA(getattr(model, name)))
+
+    with nogil:
+        if single:
+            done = train_epochs(f[0], f[1], f[2], f[3], f[4], f[5], f[6], f[7], keys, subkeys, targets, pvals, n_pairs,
+                                vector_size, first_epoch, n_epochs, init_step_size, step_size_decay, n_threads,
+                                tolerance, patience, best, stalls, sample_below, seed, n_blocks, offsets, &errors[0], &stats[0, 0, 0], histogram,
+                                &stopped)
+        else:
+            done = train_epochs(d[0], d[1], d[2], d[3], d[4], d[5], d[6], d[7], keys, subkeys, targets, pvals, n_pairs,
+                                vector_size, first_epoch, n_epochs, init_step_size, step_size_decay, n_threads,
+                                tolerance, patience, best, stalls, sample_below, seed, n_blocks, offsets, &errors[0], &stats[0, 0, 0], histogram,
+                                &stopped)
+    return done, stopped
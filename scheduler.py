@@ -0,0 +1,89 @@
+import logging, multiprocessing, Queue, time, traceback
+
+logger = logging.getLogger("glovex")
+
+# Number of co-occurring pairs a model trains on: the nnz of a sparse co-occurrence, or the entries of a dict-of-dicts
+def pair_count(cooccurrence):
+	if hasattr(cooccurrence, "nnz"):
+		return cooccurrence.nnz
+	return sum(len(row) for row in cooccurrence.itervalues())
+
+# Lay jobs (name -> number of pairs) out over processes that share cores threads.  Jobs of at least one thread's
+# share of the pairs get a process of their own; smaller ones are packed together into processes of about that
+# share.  If that makes more processes than cores, the jobs are instead spread over cores processes by longest
+# processing time first.  Threads are then handed out one at a time to the process with the most pairs per thread.
+# Returns [(threads, [names])], biggest first.
+def plan(sizes, cores):
+	cores = max(cores, 1)
+	per_thread = float(sum(sizes.values())) / cores
+	order = sorted(sizes, key=lambda name: (-sizes[name], name))
+	bins = []
+	for name in order:
+		small = [b for b in bins if b[0] < per_thread and b[0] + sizes[name] <= per_thread]
+		if sizes[name] < per_thread and small:
+			b = min(small, key=lambda b: b[0])
+		else:
+			b = [0, []]
+			bins.append(b)
+		b[0] += sizes[name]
+		b[1].append(name)
+	if len(bins) > cores:
+		bins = [[0, []] for _ in range(cores)]
+		for name in order:
+			b = min(bins, key=lambda b: b[0])
+			b[0] += sizes[name]
+			b[1].append(name)
+	bins = sorted([b for b in bins if b[1]], key=lambda b: -b[0])
+	threads = [1] * len(bins)
+	for _ in range(cores - len(bins) if bins else 0):
+		i = max(range(len(bins)), key=lambda i: bins[i][0] / float(threads[i]))
+		threads[i] += 1
+	return [(t, names) for t,(load, names) in zip(threads, bins)]
+
+def _run(jobs, threads, train, progress_queue):
+	for name in jobs:
+		try:
+			train(name, threads, lambda epoch, errors: progress_queue.put(("epochs", name, epoch, errors)))
+			progress_queue.put(("done", name, None, None))
+		except Exception:
+			progress_queue.put(("failed", name, None, traceback.format_exc()))
+			return
+
+# Run train(name, threads, progress) for every job concurrently on forked processes, laid out by plan(sizes, cores).
+# train calls progress(epoch, errors) after each chunk of epochs; per-job and overall progress (in pair-epochs out of
+# sizes[name]*epochs) are logged as the reports come in.  Raises RuntimeError if a job fails.
+def train_concurrently(sizes, epochs, cores, train):
+	start = time.time()
+	layout = plan(sizes, cores)
+	for threads, names in layout:
+		logger.info("   **** Process with %d threads: %s (%d pairs)" % (threads, ", ".join(names), sum(sizes[n] for n in names)))
+	progress_queue = multiprocessing.Queue()
+	processes = [multiprocessing.Process(target=_run, args=(names, threads, train, progress_queue)) for threads, names in layout]
+	for process in processes:
+		process.start()
+	total = float(sum(sizes.values()) * epochs) or 1.0
+	done_pairs = dict((name, 0) for name in sizes)
+	pending = set(sizes)
+	failures = []
+	while pending:
+		try:
+			kind, name, epoch, detail = progress_queue.get(timeout=1)
+		except Queue.Empty:
+			if not any(process.is_alive() for process in processes):
+				break
+			continue
+		if kind == "epochs":
+			done_pairs[name] = sizes[name] * epoch
+			logger.info("   **** %s: epoch %d/%d, error %.5f; overall %.1f%% after %.0fs" % (name, epoch, epochs, detail[-1],
+						100.0 * sum(done_pairs.values()) / total, time.time() - start))
+		else:
+			pending.discard(name)
+			if kind == "failed":
+				failures.append(name)
+				logger.error("   **** %s failed:\n%s" % (name, detail))
+	for process in processes:
+		process.join()
+	if failures or pending:
+		raise RuntimeError("Training failed for: %s" % ", ".join(sorted(failures + list(pending))))
+	elapsed = max(time.time() - start, 1e-9)
+	logger.info("   **** Trained %d models in %.2fs: %.0f pairs/sec overall" % (len(sizes), elapsed, sum(done_pairs.values()) / elapsed))
@@ -0,0 +1,244 @@
+import argparse, BaseHTTPServer, collections, json, logging, os, Queue, SocketServer, threading, time
+import numpy as np
+
+import checkpoint
+import evaluate
+import preprocessor
+import tokeniser
+
+logger = logging.getLogger("glovex")
+
+# A long-lived scoring service: the dictionary, word occurrences and model are loaded once (the arrays memory-mapped),
+# and new documents posted to it are tokenised as ACMDL_DocReader tokenises the corpus and scored against the model.
+#
+#   POST /score    {"title": ..., "abstract": ..., "id": ...} or {"documents": [...], "top_n": 25}
+#   GET  /metrics  request and batch counts, QPS and p50/p99 latency over the recent requests
+#   GET  /health
+
+# Scores new documents with a model of the corpus read by acm: a document's surprise and its top_n most surprising pairs
+class Scorer(object):
+	def __init__(self, model, acm):
+		self.model = model
+		self.acm = acm
+		self.n_docs = len(acm.documents)
+
+	# A document's words as the (id, count) pairs of the corpus' documents (words outside the dictionary are dropped)
+	def bow(self, title, text):
+		return self.acm.dictionary.doc2bow(tokeniser.normalise_text(title+" "+text, self.acm.lowercase))
+
+	# Records of a batch of (id, bow) documents, scored together.  top_n is the number of pairs (0 for all) each record
+	# keeps, for every document or as a list of one per document; a document's surprise is taken over the pairs it
+	# keeps, as evaluate.document_record takes it.
+	def score(self, docs, top_n=25):
+		top_ns = top_n if isinstance(top_n, list) else [top_n] * len(docs)
+		pairs = evaluate.batch_pair_surprises([bow for _,bow in docs], self.model, self.acm.cooccurrence, self.acm.word_occurrence,
+											  self.acm.dictionary, self.n_docs, use_sglove=self.acm.use_sglove)
+		records = []
+		for (id,bow),(w1s,w2s,surps),n in zip(docs, pairs, top_ns):
+			w1s, w2s, surps = evaluate.most_surprising(w1s, w2s, surps, n)
+			surprise = evaluate.document_surprise(surps)
+			records.append({"id": id, "words": len(bow), "surprise": None if surprise == float("inf") else surprise,
+							"surprises": evaluate.surprise_tuples(w1s, w2s, surps, dictionary=self.acm.dictionary)})
+		return records
+
+# Counts and latencies of the requests served, for /metrics.  Percentiles are over the last window requests and QPS over
+# the last qps_seconds.
+class Metrics(object):
+	def __init__(self, window=10000, qps_seconds=60):
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.qps_seconds = qps_seconds
+		self.latencies = collections.deque(maxlen=window)
+		self.finished = collections.deque(maxlen=window)
+		self.requests = 0
+		self.errors = 0
+		self.documents = 0
+		self.batches = 0
+
+	def request(self, latency, error=False):
+		with self.lock:
+			self.requests += 1
+			self.errors += error
+			self.latencies.append(latency)
+			self.finished.append(time.time())
+
+	def batch(self, n_documents):
+		with self.lock:
+			self.batches += 1
+			self.documents += n_documents
+
+	def snapshot(self):
+		with self.lock:
+			now = time.time()
+			latencies = np.array(self.latencies) * 1000
+			recent = sum(1 for t in self.finished if t > now - self.qps_seconds)
+			span = min(self.qps_seconds, now - self.started)
+			return {"uptime_s": now - self.started, "requests": self.requests, "errors": self.errors, "documents": self.documents,
+					"batches": self.batches, "mean_batch_documents": float(self.documents) / self.batches if self.batches else None,
+					"qps": recent / span if span > 0 else 0.0,
+					"p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+					"p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None}
+
+# A request waiting for the batcher: its (id, title, text) documents and top_n, and then its records (or error)
+class Pending(object):
+	def __init__(self, documents, top_n):
+		self.documents = documents
+		self.top_n = top_n
+		self.records = None
+		self.error = None
+		self.done = threading.Event()
+
+	def wait(self):
+		self.done.wait()
+		if self.error is not None:
+			raise self.error
+		return self.records
+
+# Groups the documents of concurrent requests into micro-batches of up to max_batch documents, waiting at most max_wait
+# seconds after the first for others to join, and scores each batch with one call on a single thread.  Tokenising is done
+# here too, so the normalisation cache is only ever used from one thread.
+class MicroBatcher(threading.Thread):
+	def __init__(self, scorer, metrics, max_batch=32, max_wait=0.0):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.scorer = scorer
+		self.metrics = metrics
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.queue = Queue.Queue()
+
+	def submit(self, documents, top_n):
+		pending = Pending(documents, top_n)
+		self.queue.put(pending)
+		return pending
+
+	def run(self):
+		while True:
+			batch = [self.queue.get()]
+			size = len(batch[0].documents)
+			deadline = time.time() + self.max_wait
+			while size < self.max_batch:
+				try:
+					# Requests that arrived while the last batch was being scored join without waiting
+					remaining = deadline - time.time()
+					batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+				except Queue.Empty:
+					break
+				size += len(batch[-1].documents)
+			self.score(batch)
+
+	def score(self, batch):
+		try:
+			docs = [[(id, self.scorer.bow(title, text)) for id,title,text in pending.documents] for pending in batch]
+			# The forms normalised for new documents stay in the in-memory memo only; they are not written to the store
+			tokeniser.CACHE.take_new_entries()
+			records = self.scorer.score([doc for pending_docs in docs for doc in pending_docs],
+										[pending.top_n for pending,pending_docs in zip(batch, docs) for _ in pending_docs])
+			self.metrics.batch(len(records))
+			for pending,pending_docs in zip(batch, docs):
+				pending.records = records[:len(pending_docs)]
+				records = records[len(pending_docs):]
+		except Exception as e:
+			logger.exception(" ** Scoring a batch failed")
+			for pending in batch:
+				pending.error = e
+		for pending in batch:
+			pending.done.set()
+
+# Request with a missing or malformed field
+class BadRequest(Exception):
+	pass
+
+class ScoringHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path == "/metrics":
+			self.respond(200, self.server.metrics.snapshot())
+		elif self.path == "/health":
+			self.respond(200, {"status": "ok", "words": len(self.server.scorer.acm.dictionary), "documents": self.server.scorer.n_docs})
+		else:
+			self.respond(404, {"error": "unknown path " + self.path})
+
+	def do_POST(self):
+		start = time.time()
+		if self.path != "/score":
+			self.respond(404, {"error": "unknown path " + self.path})
+			return
+		try:
+			documents, top_n = self.documents(json.loads(self.rfile.read(int(self.headers.getheader("content-length", 0))) or "null"))
+		except (ValueError, BadRequest) as e:
+			status, response = 400, {"error": str(e)}
+		else:
+			try:
+				status, response = 200, {"documents": self.server.batcher.submit(documents, top_n).wait()}
+			except Exception as e:
+				status, response = 500, {"error": str(e)}
+		self.respond(status, response)
+		self.server.metrics.request(time.time() - start, error=status != 200)
+
+	# The (id, title, text) documents and top_n of a /score request
+	def documents(self, body):
+		if not isinstance(body, dict):
+			raise BadRequest("expected a JSON object")
+		documents = body.get("documents", [body])
+		if not isinstance(documents, list) or not all(isinstance(doc, dict) and "abstract" in doc for doc in documents):
+			raise BadRequest("every document needs an abstract")
+		top_n = body.get("top_n", self.server.top_n)
+		if not isinstance(top_n, (int, long)) or top_n < 0:
+			raise BadRequest("top_n must be a non-negative integer (0 for every pair)")
+		return [(doc.get("id", str(i)), unicode(doc.get("title", "")), unicode(doc["abstract"])) for i,doc in enumerate(documents)], top_n
+
+	def respond(self, status, response):
+		body = json.dumps(response)
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		logger.debug(" ** " + format % args)
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, scorer, max_batch=32, max_wait=0.0, top_n=25, metrics_window=10000):
+		BaseHTTPServer.HTTPServer.__init__(self, address, ScoringHandler)
+		self.scorer = scorer
+		self.top_n = top_n
+		self.metrics = Metrics(metrics_window)
+		self.batcher = MicroBatcher(scorer, self.metrics, max_batch, max_wait)
+		self.batcher.start()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serve surprise scores of new documents from a trained GloVex model.")
+	parser.add_argument("inputfile", help='The input file path the model was trained on (omit the args and suffix)')
+	parser.add_argument("--no_below", default = 0.001, type=float,
+						help="Min fraction of documents a word must appear in to be included.")
+	parser.add_argument("--no_above", default = 0.75, type=float,
+						help="Max fraction of documents a word can appear in to be included.")
+	parser.add_argument("--host", default="127.0.0.1", type=str, help="Address to listen on.")
+	parser.add_argument("--port", default=8642, type=int, help="Port to listen on.")
+	parser.add_argument("--max_batch", default=32, type=int, help="Most documents scored together in one micro-batch.")
+	parser.add_argument("--max_wait_ms", default=0.0, type=float,
+						help="How long a micro-batch waits after its first request for others to join it (default: only requests already queued join).")
+	parser.add_argument("--top_n", default=25, type=int, help="Surprising pairs returned per document unless a request asks otherwise.")
+	parser.add_argument("--metrics_window", default=10000, type=int, help="Number of recent requests latency percentiles are taken over.")
+	parser.add_argument("--normalisation_cache", default=os.path.expanduser("~/.glovex/normalisation"), type=str,
+						help="On-disk store of normalised word forms to read (not written by the server).")
+	args = parser.parse_args()
+	acm = preprocessor.ACMDL_DocReader(args.inputfile, "title", "abstract", "ID")
+	preprocessed_path = acm.filepath+"_below"+str(args.no_below)+"_above"+str(args.no_above)+".preprocessed"
+	if not os.path.exists(preprocessed_path):
+		parser.error("no preprocessed corpus at " + preprocessed_path)
+	acm.preprocess(no_below=args.no_below, no_above=args.no_above)
+	model_files = checkpoint.checkpoints(args.inputfile+acm.argstring)
+	if not model_files:
+		parser.error("no trained model for " + args.inputfile+acm.argstring)
+	model = checkpoint.load(model_files[-1][1], acm.cooccurrence, mmap_mode="r")
+	tokeniser.configure_cache(args.normalisation_cache)
+	server = ScoringServer((args.host, args.port), Scorer(model, acm), args.max_batch, args.max_wait_ms / 1000.0, args.top_n, args.metrics_window)
+	logger.info(" ** Serving %d-word model of %d documents on http://%s:%d" % (len(acm.dictionary), server.scorer.n_docs, args.host, args.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		server.server_close()
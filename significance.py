@@ -0,0 +1,102 @@
+import logging, time
+import numpy as np
+from scipy import sparse
+from scipy.special import gammaln
+
+import cooccurrence
+import outofcore
+
+logger = logging.getLogger("glovex")
+
+# Upper bound on the number of hypergeometric terms expanded at once
+MAX_TERMS = 1 << 22
+
+def _log_choose(n, k):
+	return gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+# Sum of hypergeometric probabilities P(X=k) for k in [start, start+length) for each table,
+# where X counts successes in draws from a population of n_docs containing w_occ successes.
+def _hypergeom_range_sums(start, length, w_occ, draws, n_docs):
+	sums = np.zeros(len(start))
+	if not len(start):
+		return sums
+	ends = np.cumsum(length)
+	chunk_start = 0
+	while chunk_start < len(start):
+		chunk_end = np.searchsorted(ends, (ends[chunk_start-1] if chunk_start else 0) + MAX_TERMS, side="right")
+		chunk_end = max(chunk_end, chunk_start+1)
+		chunk = slice(chunk_start, chunk_end)
+		lengths = length[chunk]
+		offsets = np.zeros(len(lengths), dtype=np.int64)
+		np.cumsum(lengths[:-1], out=offsets[1:])
+		table = np.repeat(np.arange(len(lengths)), lengths)
+		k = np.repeat(start[chunk], lengths) + np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+		K = w_occ[chunk][table]
+		n = draws[chunk][table]
+		N = n_docs[chunk][table]
+		log_pmf = _log_choose(K, k) + _log_choose(N - K, n - k) - _log_choose(N, n)
+		nonempty = lengths > 0
+		sums[chunk][nonempty] = np.add.reduceat(np.exp(log_pmf), offsets[nonempty])
+		chunk_start = chunk_end
+	return sums
+
+# Left tail P(X <= cooccurrences) of Fisher's exact test on the table
+# [[cooccurrences, w2_occurrence-cooccurrences], [w1_occurrence-cooccurrences, n_docs-w1_occurrence-w2_occurrence+cooccurrences]],
+# matching fisher.pvalue(...).left_tail in significance_on_tuple. Whichever tail lies away from the mean is summed.
+def left_tail(cooccurrences, w1_occurrence, w2_occurrence, n_docs):
+	a, K, n, N = [np.atleast_1d(np.asarray(x, dtype=np.int64)) for x in np.broadcast_arrays(cooccurrences, w1_occurrence, w2_occurrence, n_docs)]
+	lo = np.maximum(0, n + K - N)
+	hi = np.minimum(K, n)
+	below_mean = a * N < K * n
+	p = np.ones(len(a))
+	left = below_mean & (a >= lo)
+	p[left] = _hypergeom_range_sums(lo[left], a[left] - lo[left] + 1, K[left], n[left], N[left])
+	right = ~below_mean & (a < hi)
+	p[right] = 1.0 - _hypergeom_range_sums(a[right] + 1, hi[right] - a[right], K[right], n[right], N[right])
+	p[a < lo] = 0.0
+	return np.clip(p, 0.0, 1.0)
+
+# Left-tail p-value for word pairs that never co-occur (only their occurrences matter), used for lookups
+# outside the stored co-occurrence entries
+class ZeroCooccurrencePValue(object):
+	def __init__(self, word_occurrence, n_docs):
+		self.word_occurrence = word_occurrence
+		self.n_docs = n_docs
+
+	def __call__(self, wk, wk2):
+		if wk == wk2:
+			raise KeyError(wk2)
+		return float(left_tail(0, self.word_occurrence[wk], self.word_occurrence[wk2], self.n_docs)[0])
+
+# Left-tail p-values of the tables (a, o1, o2, n) with o1 <= o2, evaluating each distinct table once.
+# Returns the p-values and the number of distinct tables.
+def _table_p_values(a, o1, o2, n):
+	if float(n + 1) ** 3 < 2 ** 62:
+		keys = (a * (n + 1) + o1) * (n + 1) + o2
+		_, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+	else:
+		_, first, inverse = np.unique(np.column_stack((a, o1, o2)), axis=0, return_index=True, return_inverse=True)
+	return left_tail(a[first], o1[first], o2[first], n)[inverse], len(first)
+
+# Left-tail Fisher p-values for every stored entry of a co-occurrence matrix, aligned with its data array.
+# Pairs are grouped by their contingency table (symmetric in the two occurrences) and each distinct table is
+# evaluated once. Returns a dict-of-dicts view whose absent entries fall back to the zero-co-occurrence table.
+# With chunk_pairs, rows are processed in blocks of about that many pairs (tables are then shared within a block
+# only) and the p-values are written to out, e.g. a memory-mapped array, to bound memory use.
+def cooccurrence_p_values(cooc, word_occurrence, n_docs, chunk_pairs=None, out=None):
+	start = time.time()
+	occ = np.rint(word_occurrence).astype(np.int64)
+	n = int(round(n_docs))
+	p_values = np.empty(cooc.nnz) if out is None else out
+	blocks = [(0, cooc.shape[0])] if chunk_pairs is None else outofcore.batches(np.diff(cooc.indptr), chunk_pairs)
+	n_tables = 0
+	for row_start, row_end in blocks:
+		lo, hi = cooc.indptr[row_start], cooc.indptr[row_end]
+		rows = np.repeat(np.arange(row_start, row_end), np.diff(cooc.indptr[row_start:row_end+1]))
+		cols = cooc.indices[lo:hi]
+		a = np.rint(cooc.data[lo:hi]).astype(np.int64)
+		p_values[lo:hi], block_tables = _table_p_values(a, np.minimum(occ[rows], occ[cols]), np.maximum(occ[rows], occ[cols]), n)
+		n_tables += block_tables
+	logger.info("   **** Significance: %d pairs, %d distinct tables, %.2fs" % (cooc.nnz, n_tables, time.time()-start))
+	matrix = sparse.csr_matrix((p_values, cooc.indices, cooc.indptr), shape=cooc.shape)
+	return cooccurrence.SparseCooccurrence(matrix, missing=ZeroCooccurrencePValue(occ, n))
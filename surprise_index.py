@@ -0,0 +1,169 @@
+import json, logging, math, multiprocessing, os, shutil, time
+import numpy as np
+
+import evaluate
+
+logger = logging.getLogger("glovex")
+
+FORMAT_VERSION = 1
+
+# Rough bytes of memory needed per cell of a block of the estimated co-occurrence matrix while it is turned into
+# surprises (the product, its exponential, the observed counts, the surprises and argpartition's workspace)
+BYTES_PER_CELL = 64
+
+# The most surprising partners of every word of a model, as estimated by it, read through mmap.  Row w of partners holds
+# the K words whose pair with w is most surprising, most surprising first, and surprises the matching surprise; rows
+# with fewer than K partners are padded with -1 and inf.  Pairs are scored as evaluate scores documents: the word with
+# the lower id is w1.
+class SurpriseIndex(object):
+	def __init__(self, path):
+		with open(os.path.join(path, "meta.json")) as f:
+			self.meta = json.load(f)
+		self.path = path
+		self.k = self.meta["k"]
+		self.partners = np.load(os.path.join(path, "partners.npy"), mmap_mode="r")
+		self.surprises = np.load(os.path.join(path, "surprises.npy"), mmap_mode="r")
+
+	def __len__(self):
+		return len(self.partners)
+
+	# The indexed pairs between the words ids of a document as parallel (w1 ids, w2 ids, surprises) arrays, most
+	# surprising first: every pair among the K most surprising of either of its words, gathered instead of estimated
+	def document_pairs(self, ids):
+		ids = np.unique(np.asarray(ids, dtype=np.int64))
+		partners = np.asarray(self.partners[ids])
+		found = np.isin(partners, ids)
+		words = np.repeat(ids, self.k).reshape(partners.shape)[found]
+		return self._pairs(words, partners[found], np.asarray(self.surprises[ids])[found])
+
+	# The n most surprising pairs of the whole index as parallel (w1 ids, w2 ids, surprises) arrays; exact for n <= K
+	def top_pairs(self, n):
+		surprises = np.asarray(self.surprises).ravel()
+		n_candidates = min(2 * n, len(surprises))
+		chosen = np.argpartition(surprises, n_candidates - 1)[:n_candidates] if n_candidates < len(surprises) else np.arange(len(surprises))
+		chosen = chosen[np.isfinite(surprises[chosen])]
+		w1s, w2s, surps = self._pairs(chosen // self.k, np.asarray(self.partners).ravel()[chosen], surprises[chosen])
+		return w1s[:n], w2s[:n], surps[:n]
+
+	# Deduplicate pairs found from either of their words, ordered from most to least surprising
+	def _pairs(self, words, partners, surprises):
+		w1s, w2s = np.minimum(words, partners), np.maximum(words, partners)
+		_, first = np.unique(w1s * len(self) + w2s, return_index=True)
+		order = first[np.argsort(surprises[first], kind="mergesort")]
+		return w1s[order], w2s[order], surprises[order]
+
+# Model and data the worker processes of build() score blocks from; set before the pool forks so they inherit it
+_job = None
+
+# Surprises of the pairs between rows [r0, r1) and columns [c0, c1) as w1s and w2s respectively, inf outside mask
+def _block_surprises(w1_vectors, w1_biases, w1s, w2_vectors, w2_biases, w2s, mask):
+	model, occurrence, n_docs, cooccurrence, use_sglove, observed_only = _job
+	est = w1_vectors.dot(w2_vectors.T) + w1_biases + w2_biases.T
+	observed = None
+	if cooccurrence is not None and (observed_only or not use_sglove):
+		observed = cooccurrence.matrix[w1s[0]:w1s[-1]+1][:, w2s[0]:w2s[-1]+1].toarray()
+	if not use_sglove:
+		evaluate.correct_rare_pairs(est, observed, model)
+	# an estimate that overflows is capped by the occurrences in pair_surprises like any other large one
+	with np.errstate(over="ignore"):
+		surprises = evaluate.pair_surprises(np.exp(est).astype(np.float64), occurrence[w1s][:, None], occurrence[w2s][None, :], n_docs)
+	surprises[~mask] = np.inf
+	if observed_only and observed is not None:
+		surprises[observed <= 0] = np.inf
+	return surprises
+
+# Keep the k lowest of the current (surprises, partners) and a block's candidates, row by row
+def _merge(best, best_partners, surprises, partners, k):
+	candidates = np.concatenate([best, surprises], axis=1)
+	candidate_partners = np.concatenate([best_partners, np.broadcast_to(partners, surprises.shape)], axis=1)
+	chosen = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+	return np.take_along_axis(candidates, chosen, 1), np.take_along_axis(candidate_partners, chosen, 1)
+
+# Top-k partners of rows [r0, r1), sweeping the columns in blocks of block_columns.  Pairs (r, c) with c > r are
+# estimated as W[r].ContextW[c], those with c < r as W[c].ContextW[r], so each block is one matrix product.
+def _rows(args):
+	r0, r1, k, block_columns = args
+	model = _job[0]
+	n_words = len(model.W)
+	rows = np.arange(r0, r1)
+	best = np.full((r1 - r0, k), np.inf)
+	best_partners = np.full((r1 - r0, k), -1, dtype=np.int64)
+	for c0 in range(0, n_words, block_columns):
+		c1 = min(c0 + block_columns, n_words)
+		columns = np.arange(c0, c1)
+		if c1 - 1 > r0:
+			surprises = _block_surprises(model.W[r0:r1], model.b[r0:r1], rows, model.ContextW[c0:c1], model.ContextB[c0:c1], columns,
+										 columns[None, :] > rows[:, None])
+			best, best_partners = _merge(best, best_partners, surprises, columns, k)
+		if c0 < r1 - 1:
+			surprises = _block_surprises(model.W[c0:c1], model.b[c0:c1], columns, model.ContextW[r0:r1], model.ContextB[r0:r1], rows,
+										 columns[:, None] < rows[None, :]).T
+			best, best_partners = _merge(best, best_partners, surprises, columns, k)
+	order = np.argsort(best, axis=1, kind="mergesort")
+	best, best_partners = np.take_along_axis(best, order, 1), np.take_along_axis(best_partners, order, 1)
+	best_partners[~np.isfinite(best)] = -1
+	return r0, r1, best, best_partners
+
+# Sweep the whole estimated co-occurrence matrix of model in blocks and keep the k most surprising partners of every
+# word in an index at path, alongside the model.  occurrence holds the document count of each of the model's words, out
+# of n_docs.  cooccurrence (a cooccurrence.SparseCooccurrence) supplies the observed counts plain GloVe models are
+# corrected by; with observed_only, only pairs that co-occur in some document are indexed.  Blocks of rows are scored on
+# workers processes (default: all cores), each block sized so that all of them together fit in about memory_mb.
+def build(model, occurrence, n_docs, path, k=50, cooccurrence=None, use_sglove=True, observed_only=True, memory_mb=256, workers=None):
+	global _job
+	start = time.time()
+	workers = workers or multiprocessing.cpu_count()
+	n_words = len(model.W)
+	k = max(min(k, n_words - 1), 1)
+	cells = max(int(memory_mb * 2**20 / (BYTES_PER_CELL * workers)), 1)
+	block_rows = min(n_words, max(int(math.sqrt(cells)), 1))
+	block_columns = min(n_words, max(cells // block_rows, k))
+	tmp_path = path + ".tmp"
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+	partners = np.lib.format.open_memmap(os.path.join(tmp_path, "partners.npy"), mode="w+", dtype=np.int32, shape=(n_words, k))
+	surprises = np.lib.format.open_memmap(os.path.join(tmp_path, "surprises.npy"), mode="w+", dtype=np.float64, shape=(n_words, k))
+	_job = (model, np.asarray(occurrence, dtype=np.float64), n_docs, cooccurrence if observed_only or not use_sglove else None,
+			use_sglove, observed_only)
+	blocks = [(r0, min(r0 + block_rows, n_words), k, block_columns) for r0 in range(0, n_words, block_rows)]
+	pool = None
+	try:
+		if workers > 1 and len(blocks) > 1:
+			pool = multiprocessing.Pool(min(workers, len(blocks)))
+			results = pool.imap_unordered(_rows, blocks)
+		else:
+			results = (_rows(block) for block in blocks)
+		for r0, r1, best, best_partners in results:
+			surprises[r0:r1] = best
+			partners[r0:r1] = best_partners
+		if pool is not None:
+			pool.close()
+			pool.join()
+	except:
+		# Stop the workers still scoring and leave no partial index behind
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		del partners, surprises
+		shutil.rmtree(tmp_path)
+		raise
+	finally:
+		_job = None
+	partners.flush()
+	surprises.flush()
+	del partners, surprises
+	with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+		json.dump({"version": FORMAT_VERSION, "k": k, "n_docs": n_docs, "use_sglove": use_sglove, "observed_only": observed_only}, f)
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	os.rename(tmp_path, path)
+	logger.info("   **** Indexed the %d most surprising partners of %d words in %.2fs (%d x %d blocks on %d workers)" % (k, n_words,
+				time.time()-start, block_rows, block_columns, workers))
+	return SurpriseIndex(path)
+
+# Load the index at path, or None if there is none
+def load(path):
+	if not os.path.exists(os.path.join(path, "meta.json")):
+		return None
+	return SurpriseIndex(path)
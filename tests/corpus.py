@@ -0,0 +1,68 @@
+# Small synthetic corpora for the tests, written to temporary directories
+import csv, logging, os, random, shutil, tempfile
+
+for name in ("glovex", "gensim"):
+	logging.getLogger(name).setLevel(logging.WARNING)
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "ha", "je", "ki", "lo", "mu", "na", "pe", "ri", "so", "tu", "va", "we", "zi"]
+ENDINGS = ["x", "ux", "ox", "ix"]
+
+# n distinct made-up words that the tokeniser leaves as they are (no stopwords, nothing to singularise)
+def vocabulary(n, seed=1234):
+	rng = random.Random(seed)
+	words = set()
+	while len(words) < n:
+		words.add("".join(rng.choice(SYLLABLES) for _ in range(3)) + rng.choice(ENDINGS))
+	return sorted(words)
+
+# Texts of n_docs documents of doc_words words each, drawn with Zipf-like frequencies from n_words words
+def texts(n_docs=60, n_words=40, doc_words=12, seed=1234):
+	rng = random.Random(seed)
+	words = vocabulary(n_words, seed)
+	weights = [1.0 / (rank + 1) for rank in range(n_words)]
+	return [(" ".join(weighted_sample(rng, words, weights, 3)), " ".join(weighted_sample(rng, words, weights, doc_words)))
+			for _ in range(n_docs)]
+
+def weighted_sample(rng, words, weights, n):
+	total = sum(weights)
+	chosen = []
+	for _ in range(n):
+		r = rng.random() * total
+		for word,weight in zip(words, weights):
+			r -= weight
+			if r <= 0:
+				break
+		chosen.append(word)
+	return chosen
+
+# Write an ACM-style corpus (ID, title, abstract) to directory/name.csv, with a famcat file directory/name_fc.csv that
+# puts the documents into famcats round robin if famcats are given.  Returns the paths without ".csv".
+def write(directory, name="corpus", famcats=None, **kwargs):
+	path = os.path.join(directory, name)
+	with open(path + ".csv", "wb") as f:
+		writer = csv.writer(f)
+		writer.writerow(["ID", "title", "abstract"])
+		for i,(title, abstract) in enumerate(texts(**kwargs)):
+			writer.writerow(["id%d" % i, title, abstract])
+	if not famcats:
+		return path, None
+	with open(path + "_fc.csv", "wb") as f:
+		writer = csv.writer(f)
+		for i in range(kwargs.get("n_docs", 60)):
+			writer.writerow(["id%d" % i, famcats[i % len(famcats)]])
+	return path, path + "_fc"
+
+# A preprocessed ACMDL_DocReader of a corpus written by write()
+def reader(path, famcat_path=None, use_sglove=False, no_above=0.9, **kwargs):
+	import preprocessor
+	acm = preprocessor.ACMDL_DocReader(path, "title", "abstract", "ID", famcat_path=famcat_path, use_sglove=use_sglove)
+	acm.preprocess(no_below=0.001, no_above=no_above, workers=kwargs.pop("workers", 1), **kwargs)
+	return acm
+
+class TemporaryDirectory(object):
+	def __enter__(self):
+		self.path = tempfile.mkdtemp(prefix="glovex_test")
+		return self.path
+
+	def __exit__(self, *exc):
+		shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,49 @@
+import os, unittest
+
+import artifact
+import corpus
+import test_artifact
+
+class AppendTest(unittest.TestCase):
+	def test_append_matches_rebuild(self):
+		for famcats in (None, ["A", "B", "C"]):
+			with corpus.TemporaryDirectory() as directory:
+				os.makedirs(os.path.join(directory, "appended"))
+				os.makedirs(os.path.join(directory, "rebuilt"))
+				path, famcat_path = corpus.write(os.path.join(directory, "appended"), famcats=famcats, n_docs=40, n_words=15)
+				corpus.reader(path, famcat_path, use_sglove=True)
+				corpus.write(os.path.join(directory, "appended"), famcats=famcats, n_docs=60, n_words=15)
+				appended = corpus.reader(path, famcat_path, use_sglove=True, append=True)
+				rebuilt = corpus.reader(*corpus.write(os.path.join(directory, "rebuilt"), famcats=famcats, n_docs=60, n_words=15), use_sglove=True)
+				# Appending keeps the dictionary; the corpus is chosen so that a rebuild keeps the same one
+				self.assertEqual(appended.dictionary.token2id, rebuilt.dictionary.token2id)
+				test_artifact.assert_same_reader(self, appended, rebuilt)
+				reloaded = corpus.reader(path, famcat_path)
+				test_artifact.assert_same_reader(self, reloaded, rebuilt)
+	def test_failed_append_keeps_the_artifact(self):
+		for famcats in (None, ["A", "B", "C"]):
+			with corpus.TemporaryDirectory() as directory:
+				os.makedirs(os.path.join(directory, "appended"))
+				os.makedirs(os.path.join(directory, "original"))
+				path, famcat_path = corpus.write(os.path.join(directory, "appended"), famcats=famcats, n_docs=40, n_words=15)
+				corpus.reader(path, famcat_path, use_sglove=True)
+				corpus.write(os.path.join(directory, "appended"), famcats=famcats, n_docs=60, n_words=15)
+				save_meta = artifact._save_meta
+				def failing_save_meta(reader, directory):
+					raise IOError("disk full")
+				artifact._save_meta = failing_save_meta
+				try:
+					with self.assertRaises(IOError):
+						corpus.reader(path, famcat_path, use_sglove=True, append=True)
+				finally:
+					artifact._save_meta = save_meta
+				original = corpus.reader(*corpus.write(os.path.join(directory, "original"), famcats=famcats, n_docs=40, n_words=15), use_sglove=True)
+				test_artifact.assert_same_reader(self, corpus.reader(path, famcat_path), original)
+				# The next append starts over from the intact artifact
+				appended = corpus.reader(path, famcat_path, use_sglove=True, append=True)
+				self.assertEqual(len(appended.doc_raws), 60)
+				self.assertFalse(os.path.exists(appended.preprocessed_path + ".tmp"))
+				self.assertFalse(os.path.exists(appended.preprocessed_path + ".old"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+import corpus
+
+def assert_same_counts(test, cooc, expected_cooc):
+	test.assertEqual((cooc.matrix != expected_cooc.matrix).nnz, 0)
+	np.testing.assert_array_equal(cooc.matrix.indptr, expected_cooc.matrix.indptr)
+
+# Every component of two preprocessed readers of the same corpus is the same
+def assert_same_reader(test, reader, expected):
+	test.assertEqual(reader.dictionary.token2id, expected.dictionary.token2id)
+	test.assertEqual(list(reader.documents), list(expected.documents))
+	test.assertEqual(list(reader.doc_ids), list(expected.doc_ids))
+	test.assertEqual(list(reader.doc_titles), list(expected.doc_titles))
+	test.assertEqual(list(reader.doc_raws), list(expected.doc_raws))
+	test.assertEqual(reader.total_docs, expected.total_docs)
+	test.assertEqual(sorted(reader.famcats), sorted(expected.famcats))
+	if reader.famcats:
+		test.assertEqual(list(reader.doc_famcats), list(expected.doc_famcats))
+		test.assertEqual(reader.docs_per_fc, expected.docs_per_fc)
+		for fc in reader.famcats:
+			np.testing.assert_array_equal(reader.per_fc_keys_to_all_keys[fc].array, expected.per_fc_keys_to_all_keys[fc].array)
+			np.testing.assert_array_equal(reader.word_occurrence[fc].counts, expected.word_occurrence[fc].counts)
+			assert_same_counts(test, reader.cooccurrence[fc], expected.cooccurrence[fc])
+			if expected.cooccurrence_p_values:
+				np.testing.assert_allclose(reader.cooccurrence_p_values[fc].matrix.data, expected.cooccurrence_p_values[fc].matrix.data, rtol=1e-12)
+	else:
+		np.testing.assert_array_equal(reader.word_occurrence.counts, expected.word_occurrence.counts)
+		assert_same_counts(test, reader.cooccurrence, expected.cooccurrence)
+		if expected.cooccurrence_p_values:
+			np.testing.assert_allclose(reader.cooccurrence_p_values.matrix.data, expected.cooccurrence_p_values.matrix.data, rtol=1e-12)
+
+class ArtifactTest(unittest.TestCase):
+	def test_round_trip(self):
+		for famcats in (None, ["A", "B"]):
+			with corpus.TemporaryDirectory() as directory:
+				path, famcat_path = corpus.write(directory, famcats=famcats)
+				built = corpus.reader(path, famcat_path, use_sglove=True)
+				loaded = corpus.reader(path, famcat_path)
+				self.assertIn("_artifact", vars(loaded))
+				self.assertTrue(loaded.use_sglove)
+				assert_same_reader(self, loaded, built)
+
+if __name__ == "__main__":
+	unittest.main()
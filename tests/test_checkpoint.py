@@ -0,0 +1,80 @@
+import os, pickle, unittest
+
+import numpy as np
+
+import checkpoint
+import corpus
+import s_glove
+
+class CheckpointTest(unittest.TestCase):
+	def assert_same_model(self, model, expected):
+		for name in checkpoint.PARAMS:
+			np.testing.assert_array_equal(getattr(model, name), getattr(expected, name), err_msg=name)
+		for name in ("alpha", "x_max", "d", "seed", "errors", "min_weight", "dtype"):
+			self.assertEqual(getattr(model, name), getattr(expected, name), msg=name)
+
+	def test_resumed_training_matches_uninterrupted(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, _ = corpus.write(directory, n_docs=60, n_words=25)
+			reader = corpus.reader(path, use_sglove=True)
+			cooc, p_values = reader.cooccurrence, reader.cooccurrence_p_values
+			for dtype in (np.float64, np.float32):
+				model = s_glove.Glove(cooc, p_values, d=8, dtype=dtype, min_weight=0.1)
+				model.train_epochs(2, 0.05, 25.0, workers=1)
+				checkpoint_path = os.path.join(directory, "model_epochs2.glovex")
+				checkpoint.save(model, checkpoint_path, 2, tokens=list(reader.dictionary.values()), counts=reader.word_occurrence.counts)
+				self.assertFalse(os.path.exists(checkpoint_path + ".tmp"))
+				self.assertFalse(os.path.exists(os.path.join(checkpoint_path, "cooccurence.npy")))
+				loaded = checkpoint.load(checkpoint_path, cooc, p_values)
+				self.assert_same_model(loaded, model)
+				self.assertIs(loaded.cooccurence, cooc)
+				self.assertIs(loaded.p_values, p_values)
+				self.assertEqual(checkpoint.vocabulary(checkpoint_path)[0], list(reader.dictionary.values()))
+				self.assertTrue(checkpoint.matches(checkpoint_path, list(reader.dictionary.values())))
+				model.train_epochs(2, 0.05, 25.0, first_epoch=2, workers=1)
+				loaded.train_epochs(2, 0.05, 25.0, first_epoch=2, workers=1)
+				self.assert_same_model(loaded, model)
+				mapped = checkpoint.load(checkpoint_path, cooc, p_values, mmap_mode="r")
+				self.assertIsInstance(mapped.W, np.memmap)
+
+	def test_loads_pickled_models(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, _ = corpus.write(directory, n_docs=40, n_words=20)
+			reader = corpus.reader(path, use_sglove=True)
+			model = s_glove.Glove(reader.cooccurrence, reader.cooccurrence_p_values, d=8)
+			model.train_epochs(1, 0.05, 25.0, workers=1)
+			pickle_path = os.path.join(directory, "model_epochs1.glovex")
+			with open(pickle_path, "wb") as f:
+				pickle.dump(model, f)
+			self.assertEqual(checkpoint.checkpoints(os.path.join(directory, "model")), [(1, pickle_path)])
+			self.assert_same_model(checkpoint.load(pickle_path, reader.cooccurrence, reader.cooccurrence_p_values), model)
+
+	def test_warm_start_copies_shared_words(self):
+		with corpus.TemporaryDirectory() as directory:
+			old_path, _ = corpus.write(directory, name="old", n_docs=30, n_words=40)
+			new_path, _ = corpus.write(directory, name="new", n_docs=60, n_words=40)
+			old_reader, new_reader = corpus.reader(old_path, use_sglove=True), corpus.reader(new_path, use_sglove=True)
+			old_tokens, old_counts = old_reader.model_vocabulary()
+			tokens, counts = new_reader.model_vocabulary()
+			self.assertNotEqual(old_tokens, tokens)
+			old = s_glove.Glove(old_reader.cooccurrence, old_reader.cooccurrence_p_values, d=8)
+			old.train_epochs(2, 0.05, 25.0, workers=1)
+			checkpoint_path = os.path.join(directory, "old_epochs1.glovex")
+			checkpoint.save(old, checkpoint_path, 1, old_tokens, old_counts)
+			self.assertFalse(checkpoint.matches(checkpoint_path, tokens))
+			model = s_glove.Glove(new_reader.cooccurrence, new_reader.cooccurrence_p_values, d=8, seed=99)
+			fresh = s_glove.Glove(new_reader.cooccurrence, new_reader.cooccurrence_p_values, d=8, seed=99)
+			changed = checkpoint.warm_start(model, checkpoint_path, tokens, counts)
+			old_rows = dict((w, i) for i,w in enumerate(old_tokens))
+			for i,w in enumerate(tokens):
+				source = old if w in old_rows else fresh
+				row = old_rows[w] if w in old_rows else i
+				for name in checkpoint.PARAMS:
+					np.testing.assert_array_equal(getattr(model, name)[i], getattr(source, name)[row], err_msg=name)
+				self.assertEqual(changed[i], w not in old_rows or counts[i] != old_counts[old_rows[w]])
+			self.assertTrue(set(tokens) & set(old_tokens))
+			new_words = checkpoint.warm_start(fresh, checkpoint_path, tokens)
+			self.assertEqual(new_words.tolist(), [w not in old_rows for w in tokens])
+
+if __name__ == "__main__":
+	unittest.main()
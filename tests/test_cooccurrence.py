@@ -0,0 +1,85 @@
+import unittest
+
+import gensim
+import numpy as np
+
+import corpus
+import cooccurrence
+
+class CooccurrenceTest(unittest.TestCase):
+	def setUp(self):
+		docs = [text.split() for _,text in corpus.texts(n_docs=80, n_words=30)]
+		self.dictionary = gensim.corpora.Dictionary(docs)
+		self.documents = [self.dictionary.doc2bow(doc) for doc in docs]
+
+	def test_sparse_matches_dict(self):
+		expected_cooc, expected_occ = cooccurrence.dict_cooccurrence(self.documents, self.dictionary)
+		cooc, occ = cooccurrence.sparse_cooccurrence(cooccurrence.bow_matrix(self.documents, len(self.dictionary)))
+		sparse_cooc = cooccurrence.SparseCooccurrence(cooc)
+		word_occurrence = cooccurrence.WordOccurrence(occ, self.dictionary)
+		self.assertEqual(sorted(sparse_cooc.keys()), sorted(expected_cooc.keys()))
+		for wk,row in expected_cooc.iteritems():
+			self.assertEqual(dict(sparse_cooc[wk].iteritems()), row)
+		self.assertEqual(dict(word_occurrence.iteritems()), expected_occ)
+
+	def test_word_occurrence_ids_out_of_range(self):
+		_, occ = cooccurrence.sparse_cooccurrence(cooccurrence.bow_matrix(self.documents, len(self.dictionary)))
+		word_occurrence = cooccurrence.WordOccurrence(occ, self.dictionary)
+		for k in (-1, len(occ)):
+			self.assertNotIn(k, word_occurrence)
+			self.assertRaises(KeyError, lambda: word_occurrence[k])
+			self.assertIsNone(word_occurrence.get(k))
+		self.assertIn(0, word_occurrence)
+		self.assertEqual(word_occurrence[0], occ[0])
+
+	def test_lookup(self):
+		cooc, _ = cooccurrence.sparse_cooccurrence(cooccurrence.bow_matrix(self.documents, len(self.dictionary)))
+		rng = np.random.RandomState(0)
+		wks, wk2s = rng.randint(0, cooc.shape[0], 500), rng.randint(0, cooc.shape[0], 500)
+		expected = np.asarray(cooc[wks, wk2s]).ravel()
+		np.testing.assert_array_equal(cooccurrence.SparseCooccurrence(cooc).lookup(wks, wk2s), expected)
+
+# The per-famcat dict builder of calc_cooccurrence before famcat_cooccurrence replaced it (without its docs_per_fc,
+# which counted words rather than documents)
+def dict_famcat_cooccurrence(documents, doc_famcats, dictionary):
+	cooc, word_occurrence, per_fc_keys_to_all_keys, all_keys_to_per_fc_keys = {}, {}, {}, {}
+	for doc,doc_fcs in zip(documents, doc_famcats):
+		for wk,wc in doc:
+			for fc in doc_fcs:
+				if fc not in cooc:
+					cooc[fc], word_occurrence[fc], per_fc_keys_to_all_keys[fc], all_keys_to_per_fc_keys[fc] = {}, {}, {}, {}
+				word_occurrence[fc][dictionary[wk]] = word_occurrence[fc].get(dictionary[wk], 0.0) + 1.0
+				if wk not in all_keys_to_per_fc_keys[fc]:
+					new_id = len(all_keys_to_per_fc_keys[fc])
+					per_fc_keys_to_all_keys[fc][new_id] = wk
+					all_keys_to_per_fc_keys[fc][wk] = new_id
+				row = cooc[fc].setdefault(all_keys_to_per_fc_keys[fc][wk], {})
+				for wk2,wc2 in doc:
+					if wk != wk2:
+						if wk2 not in all_keys_to_per_fc_keys[fc]:
+							new_id = len(all_keys_to_per_fc_keys[fc])
+							all_keys_to_per_fc_keys[fc][wk2] = new_id
+							per_fc_keys_to_all_keys[fc][new_id] = wk2
+						wk2_local = all_keys_to_per_fc_keys[fc][wk2]
+						row[wk2_local] = row.get(wk2_local, 0.0) + 1.0
+	return cooc, word_occurrence, per_fc_keys_to_all_keys
+
+class FamcatCooccurrenceTest(unittest.TestCase):
+	def test_sparse_matches_dict(self):
+		docs = [text.split() for _,text in corpus.texts(n_docs=90, n_words=30)]
+		dictionary = gensim.corpora.Dictionary(docs)
+		documents = [dictionary.doc2bow(doc) for doc in docs]
+		doc_famcats = [["A", "B", "C"][:1 + i % 3] if i % 4 else ["C"] for i in range(len(documents))]
+		expected_cooc, expected_occ, expected_keys = dict_famcat_cooccurrence(documents, doc_famcats, dictionary)
+		results = cooccurrence.famcat_cooccurrence(cooccurrence.bow_matrix(documents, len(dictionary)), doc_famcats)
+		self.assertEqual(sorted(results), sorted(expected_cooc))
+		for fc,(cooc, occ, local_to_global, n_docs) in results.iteritems():
+			self.assertEqual(dict(cooccurrence.IdMap(local_to_global).iteritems()), expected_keys[fc])
+			self.assertEqual(dict(cooccurrence.WordOccurrence(occ, dictionary, local_to_global).iteritems()), expected_occ[fc])
+			sparse_cooc = cooccurrence.SparseCooccurrence(cooc)
+			for wk,row in expected_cooc[fc].iteritems():
+				self.assertEqual(dict(sparse_cooc[wk].iteritems()), row)
+			self.assertEqual(n_docs, sum(1 for fcs in doc_famcats if fc in fcs))
+
+if __name__ == "__main__":
+	unittest.main()
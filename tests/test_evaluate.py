@@ -0,0 +1,133 @@
+import json, multiprocessing, os, unittest
+
+import numpy as np
+
+import corpus
+import evaluate
+import s_glove
+
+# The records eval_dataset_surprise built pair by pair before documents were scored with array operations: every
+# pair's surprise from the estimated co-occurrence matrix, cut to the top_n_per_doc most surprising, whose 5th
+# percentile is the document's surprise
+def reference_records(model, acm, top_n_per_doc = 0):
+	records = []
+	for id,title,doc,raw_doc in zip(acm.doc_ids, acm.doc_titles, acm.documents, acm.doc_raws):
+		if len(doc):
+			est_cooc_mat = evaluate.estimate_document_cooccurrence_matrix(doc, model, acm.cooccurrence, use_sglove=acm.use_sglove)
+			surps = evaluate.document_cooccurrence_to_surprise(doc, est_cooc_mat, acm.word_occurrence, acm.dictionary, len(acm.documents))
+			surps.sort(key = lambda x: x[2])
+			if top_n_per_doc and len(surps) > top_n_per_doc:
+				surps = surps[:top_n_per_doc]
+			records.append({"id": id,"title":title,"raw":raw_doc, "surprises":surps, "surprise": np.percentile([x[2] for x in surps], 5)})
+		else:
+			records.append({"id": id,"title":title,"raw":raw_doc, "surprises":[], "surprise": float("inf")})
+	return records
+
+# A small corpus (with a document without any dictionary words) and an s_glove model trained on it
+def trained_reader(directory):
+	path, _ = corpus.write(directory, n_docs=50, n_words=30, doc_words=10)
+	reader = corpus.reader(path, use_sglove=True)
+	reader.documents = list(reader.documents) + [[]]
+	reader.doc_ids, reader.doc_titles, reader.doc_raws = [list(column) + [value] for column,value in
+														  zip((reader.doc_ids, reader.doc_titles, reader.doc_raws), ("empty", "", ""))]
+	model = s_glove.Glove(reader.cooccurrence, reader.cooccurrence_p_values, d=10, x_max=3.0)
+	model.train_epochs(5, 0.05, 25.0, workers=1)
+	return reader, model
+
+# Check records against the reference records, surprises to within rounding
+def assert_same_records(test, records, expected):
+	test.assertEqual(len(records), len(expected))
+	for record,reference in zip(records, expected):
+		test.assertEqual([record[k] for k in ("id", "title", "raw")], [reference[k] for k in ("id", "title", "raw")])
+		test.assertEqual([(w1, w2) for w1,w2,_ in record["surprises"]], [(w1, w2) for w1,w2,_ in reference["surprises"]])
+		np.testing.assert_allclose([s for _,_,s in record["surprises"]], [s for _,_,s in reference["surprises"]], rtol=1e-10)
+		np.testing.assert_allclose(record["surprise"], reference["surprise"], rtol=1e-10)
+
+class RecordsTest(unittest.TestCase):
+	def test_records_match_the_pair_by_pair_records(self):
+		with corpus.TemporaryDirectory() as directory:
+			reader, model = trained_reader(directory)
+			for use_sglove in (True, False):
+				reader.use_sglove = use_sglove
+				for top_n_per_doc in (0, 1, 5, 1000):
+					assert_same_records(self, evaluate.eval_dataset_surprise(model, reader, top_n_per_doc), reference_records(model, reader, top_n_per_doc))
+
+	def test_pairs_never_observed_together_are_not_corrected(self):
+		with corpus.TemporaryDirectory() as directory:
+			reader, model = trained_reader(directory)
+			matrix = reader.cooccurrence.matrix.toarray()
+			w1, w2 = [int(wk) for wk in np.argwhere(matrix + np.eye(len(matrix)) == 0)[0]]
+			doc = [(min(w1, w2), 1), (max(w1, w2), 1)]
+			with np.errstate(all="raise"):
+				_, _, plain = evaluate.document_pair_surprises(doc, model, reader.cooccurrence, reader.word_occurrence, reader.dictionary,
+															   len(reader.documents), use_sglove=True)
+				_, _, corrected = evaluate.document_pair_surprises(doc, model, reader.cooccurrence, reader.word_occurrence, reader.dictionary,
+																   len(reader.documents), use_sglove=False)
+			self.assertTrue(np.isfinite(corrected).all())
+			np.testing.assert_array_equal(corrected, plain)
+
+class TopNTest(unittest.TestCase):
+	def test_document_surprise_matches_percentile(self):
+		rng = np.random.RandomState(0)
+		for n in range(1, 120):
+			values = rng.lognormal(size=n)
+			if n % 3 == 0:
+				values = np.round(values, 1)
+			self.assertEqual(evaluate.document_surprise(values), np.percentile(values, 5))
+			self.assertEqual(evaluate.document_surprise([("a", "b", v) for v in values]), np.percentile(values, 5))
+			for percentile in (50, 80):
+				self.assertAlmostEqual(evaluate.document_surprise(values, percentile), np.percentile(values, 100 - percentile), places=12)
+		rows = rng.lognormal(size=(6, 40))
+		np.testing.assert_array_equal(evaluate.document_surprise(rows), np.percentile(rows, 5, axis=1))
+		self.assertEqual(evaluate.document_surprise([]), float("inf"))
+
+	def test_top_n_matches_sorting(self):
+		# As for the pairs of print_top_n_surps, an item's key decides its score and items repeat across documents
+		rng = np.random.RandomState(1)
+		scores = np.round(rng.uniform(size=40), 2)
+		for n in (0, 1, 5, 50):
+			keys = rng.randint(0, 40, 200)
+			items = [(int(key), float(scores[key])) for key in keys]
+			top = evaluate.TopN(n)
+			for key,score in items:
+				top.add(key, score, (key, score))
+			expected = sorted(set(items), key=lambda item: item[1])[:n]
+			self.assertEqual([score for _,score in top.items()], [score for _,score in expected])
+			self.assertEqual(len(set(key for key,_ in top.items())), len(top))
+			w1s, w2s, surps = np.arange(200), np.arange(200), np.array([score for _,score in items])
+			order = np.argsort(surps, kind="mergesort")[:n or None]
+			for chosen,reference in zip(evaluate.most_surprising(w1s, w2s, surps, n), (w1s[order], w2s[order], surps[order])):
+				np.testing.assert_array_equal(chosen, reference)
+
+class EvaluateToFileTest(unittest.TestCase):
+	def test_streamed_records_match_the_records(self):
+		with corpus.TemporaryDirectory() as directory:
+			reader, model = trained_reader(directory)
+			expected = evaluate.eval_dataset_surprise(model, reader, 5)
+			for workers, chunk_size in ((1, 500), (2, 7)):
+				path = os.path.join(directory, "records.jsonl")
+				top = evaluate.eval_dataset_surprise_to_file(model, reader, path, 5, workers=workers, chunk_size=chunk_size, top_docs=4)
+				with open(path) as f:
+					records = [json.loads(line) for line in f]
+				for record,reference in zip(records, expected):
+					self.assertEqual(record["surprise"], None if reference["surprise"] == float("inf") else reference["surprise"])
+					record["surprise"] = reference["surprise"]
+				assert_same_records(self, records, expected)
+				ranked = sorted([record for record in expected if record["surprise"] != float("inf")], key=lambda record: record["surprise"])
+				self.assertEqual([record["id"] for record in top], [record["id"] for record in ranked[:4]])
+				self.assertFalse(os.path.exists(path + ".tmp"))
+
+	def test_failed_evaluation_leaves_no_file(self):
+		with corpus.TemporaryDirectory() as directory:
+			reader, model = trained_reader(directory)
+			model.W = model.W[:1]
+			for workers in (1, 2):
+				path = os.path.join(directory, "records.jsonl")
+				with self.assertRaises(IndexError):
+					evaluate.eval_dataset_surprise_to_file(model, reader, path, 5, workers=workers, chunk_size=5)
+				self.assertFalse(os.path.exists(path))
+				self.assertFalse(os.path.exists(path + ".tmp"))
+				self.assertEqual(multiprocessing.active_children(), [])
+
+if __name__ == "__main__":
+	unittest.main()
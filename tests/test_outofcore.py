@@ -0,0 +1,20 @@
+import os, unittest
+
+import corpus
+import test_artifact
+
+class OutOfCoreTest(unittest.TestCase):
+	def test_matches_in_memory(self):
+		for famcats in (None, ["A", "B"]):
+			with corpus.TemporaryDirectory() as directory:
+				os.makedirs(os.path.join(directory, "in_memory"))
+				os.makedirs(os.path.join(directory, "out_of_core"))
+				in_memory = corpus.reader(*corpus.write(os.path.join(directory, "in_memory"), famcats=famcats), use_sglove=True)
+				# A budget of a few dozen pairs, so that everything is counted, merged and tested in many small pieces
+				out_of_core = corpus.reader(*corpus.write(os.path.join(directory, "out_of_core"), famcats=famcats), use_sglove=True,
+											memory_budget_mb=0.002)
+				self.assertFalse(any(name.endswith(".scratch") for name in os.listdir(os.path.join(directory, "out_of_core"))))
+				test_artifact.assert_same_reader(self, out_of_core, in_memory)
+
+if __name__ == "__main__":
+	unittest.main()
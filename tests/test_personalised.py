@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+import corpus
+import evaluate_personalised
+import s_glove
+
+# Combined surprise of each pair of doc (w1 id, w2 id) for user, estimated famcat by famcat and pair by pair by
+# estimate_personalised_document_surprise_pairs as before the famcat models were stacked
+def reference_combined(doc, models, acm, user):
+	surps = evaluate_personalised.estimate_personalised_document_surprise_pairs(doc, models, acm, user)
+	return dict(((w1, w2), dict(pair_surps)["combined"]) for w1,w2_surps in surps.iteritems() for w2,pair_surps in w2_surps.iteritems())
+
+class PersonalisedTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = corpus.TemporaryDirectory()
+		path, famcat_path = corpus.write(cls.directory.__enter__(), famcats=["a", "b", "c"], n_docs=60, n_words=40)
+		cls.reader = corpus.reader(path, famcat_path, use_sglove=True)
+		cls.models = []
+		for fc in cls.reader.famcats:
+			model = s_glove.Glove(cls.reader.cooccurrence[fc], cls.reader.cooccurrence_p_values[fc], d=8, x_max=3.0)
+			model.train_epochs(3, 0.05, 25.0, workers=1)
+			cls.models.append(model)
+		cls.users = np.random.RandomState(0).uniform(size=(4, len(cls.reader.famcats)))
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.directory.__exit__()
+
+	def test_combined_surprises_match_pair_by_pair(self):
+		scorer = evaluate_personalised.PersonalisedScorer(self.models, self.reader)
+		for i in range(20):
+			doc = self.reader.documents[i]
+			w1s, w2s, combined = scorer.combined_surprises(doc, self.users)
+			for u,user in enumerate(self.users):
+				expected = reference_combined(doc, self.models, self.reader, user)
+				self.assertEqual(sorted(zip(w1s.tolist(), w2s.tolist())), sorted(expected))
+				for w1,w2,s in zip(w1s.tolist(), w2s.tolist(), combined[u].tolist()):
+					self.assertAlmostEqual(s, expected[(w1, w2)], places=9)
+
+	def test_top_documents_match_every_document_scored(self):
+		results = evaluate_personalised.eval_personalised_dataset_surprise(self.models, self.reader, self.users, top_n_per_doc=5, top_docs=4)
+		for user,records in zip(self.users, results):
+			surprises = []
+			for i,doc in enumerate(self.reader.documents):
+				expected = reference_combined(doc, self.models, self.reader, user)
+				if expected:
+					surprises.append((np.percentile(expected.values(), 5), i, expected))
+			surprises.sort(key = lambda x: x[0])
+			self.assertEqual([record["id"] for record in records], [self.reader.doc_ids[i] for _,i,_ in surprises[:4]])
+			for record,(surprise,i,expected) in zip(records, surprises):
+				self.assertAlmostEqual(record["surprise"], surprise, places=9)
+				top = sorted(expected.values())[:5]
+				np.testing.assert_allclose([s for _,_,s in record["surprises"]], top, rtol=1e-9)
+				for w1,w2,s in record["surprises"]:
+					self.assertAlmostEqual(expected[(self.reader.dictionary.token2id[w1], self.reader.dictionary.token2id[w2])], s, places=9)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,200 @@
+import json, os, unittest
+
+import numpy as np
+
+import corpus
+import evaluate
+import s_glove
+
+# The (key, subkey, co-occurrence, p-value) batches Glove.train built pair by pair on every epoch before the pairs were packed
+def reference_batches(cooccurence, p_values, batch_size=50):
+	pairs = [(key, subkey, cooccurence[key][subkey], p_values[key][subkey]) for key in cooccurence for subkey in cooccurence[key]]
+	return [(np.array([k for k,s,c,p in batch], dtype=np.int32), np.array([s for k,s,c,p in batch], dtype=np.int32),
+			 np.array([c for k,s,c,p in batch], dtype=np.float64), np.array([p for k,s,c,p in batch], dtype=np.float64))
+			for batch in [pairs[i:i+batch_size] for i in range(0, len(pairs), batch_size)]]
+
+# One epoch as the threaded Glove.train ran it on a single worker: the batches trained one after another at step_size.
+# With min_weight, only the pairs weighted (1 - p-value) at least min_weight are trained on.
+def reference_epoch(model, step_size, min_weight=0.0):
+	error = np.zeros(1, dtype=np.float64)
+	batches = [[column[1 - batch[3] >= min_weight] for column in batch] for batch in reference_batches(model.cooccurence, model.p_values)]
+	batches = [batch for batch in batches if len(batch[0])]
+	for batch in batches:
+		s_glove.train_glove(model, batch, step_size, error)
+	return error[0] / sum(len(batch[0]) for batch in batches)
+
+def packed(batches):
+	return [np.concatenate([batch[i] for batch in batches]) for i in range(4)]
+
+class GloveTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = corpus.TemporaryDirectory()
+		path, _ = corpus.write(cls.directory.__enter__(), n_docs=80, n_words=30)
+		cls.reader = corpus.reader(path, use_sglove=True)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.directory.__exit__()
+
+	def model(self, **kwargs):
+		return s_glove.Glove(self.reader.cooccurrence, self.reader.cooccurrence_p_values, d=10, **kwargs)
+
+	def assert_same_params(self, model, expected, **kwargs):
+		for name in ("W", "ContextW", "b", "ContextB", "gradsqW", "gradsqContextW", "gradsqb", "gradsqContextB"):
+			np.testing.assert_allclose(getattr(model, name), getattr(expected, name), err_msg=name, **kwargs)
+
+	def assert_same_pairs(self, training_set, expected):
+		for name,values in zip(("keys", "subkeys", "targets", "p_values"), expected):
+			np.testing.assert_array_equal(np.asarray(getattr(training_set, name)), values, err_msg=name)
+
+	def test_training_set_matches_old_batches(self):
+		cooc, p_values = self.reader.cooccurrence, self.reader.cooccurrence_p_values
+		expected = packed(reference_batches(cooc, p_values))
+		training_set = s_glove.TrainingSet.from_cooccurrence(cooc, p_values)
+		self.assertEqual(len(training_set), cooc.nnz)
+		self.assert_same_pairs(training_set, expected)
+		as_dicts = lambda rows: dict((key, dict(rows[key].iteritems())) for key in rows)
+		self.assert_same_pairs(s_glove.TrainingSet.from_cooccurrence(as_dicts(cooc), as_dicts(p_values)), expected)
+		path = os.path.join(self.directory.path, "training_set")
+		self.assert_same_pairs(s_glove.TrainingSet.cached(path, cooc, p_values), expected)
+		self.assert_same_pairs(s_glove.TrainingSet.cached(path, cooc, p_values), expected)
+
+	def test_epoch_kernel_matches_old_trainer(self):
+		# The old kernel took its step size as a C float, so the step is one a float holds exactly
+		model, expected = self.model(), self.model()
+		expected_errors = [reference_epoch(expected, 0.0625) for epoch in range(3)]
+		errors = model.train_epochs(3, 0.0625, float("inf"), workers=1)
+		np.testing.assert_allclose(errors, expected_errors, rtol=1e-12)
+		self.assert_same_params(model, expected, rtol=1e-12)
+		self.assertEqual(model.errors, errors)
+
+	def test_epochs_resume_the_step_size_schedule(self):
+		model, expected = self.model(), self.model()
+		expected.train_epochs(4, 0.05, 2.0, workers=1)
+		for epoch in range(4):
+			model.train_epochs(1, 0.05, 2.0, first_epoch=epoch, workers=1)
+		self.assert_same_params(model, expected, rtol=1e-12)
+
+	def test_early_stopping(self):
+		model = self.model()
+		errors = model.train_epochs(50, 0.05, 25.0, workers=1, tolerance=0.5, patience=2)
+		self.assertLess(len(errors), 50)
+		best, stalls = model.early_stopping_state(0.5)
+		self.assertEqual(stalls, 2)
+		# Resuming a model that has already stopped improving runs no further epochs
+		params = model.W.copy()
+		self.assertEqual(model.train_epochs(50, 0.05, 25.0, first_epoch=len(errors), workers=1, tolerance=0.5, patience=2), [])
+		self.assertEqual(model.errors, errors)
+		np.testing.assert_array_equal(model.W, params)
+
+	def test_float32_tracks_float64(self):
+		model64, model32 = self.model(), self.model(dtype=np.float32)
+		self.assertEqual(model32.W.dtype, np.float32)
+		self.assert_same_params(model32, model64, rtol=1e-6)
+		errors64 = model64.train_epochs(5, 0.05, 25.0, workers=1)
+		errors32 = model32.train_epochs(5, 0.05, 25.0, workers=1)
+		np.testing.assert_allclose(errors32, errors64, rtol=1e-4)
+		self.assert_same_params(model32, model64, rtol=1e-3, atol=1e-5)
+		rows, cols, _ = self.reader.cooccurrence.pairs()
+		occurrence, n_docs = self.reader.word_occurrence.counts, len(self.reader.documents)
+		np.testing.assert_allclose(evaluate.estimate_pair_surprises(rows, cols, model32, occurrence, n_docs),
+								   evaluate.estimate_pair_surprises(rows, cols, model64, occurrence, n_docs), rtol=1e-4)
+		with self.assertRaises(ValueError):
+			self.model(dtype=np.float16)
+
+	def test_pair_surprises_match_pair_by_pair(self):
+		model = self.model()
+		model.train_epochs(3, 0.05, 25.0, workers=1)
+		rows, cols, _ = self.reader.cooccurrence.pairs()
+		occurrence, n_docs = self.reader.word_occurrence.counts, len(self.reader.documents)
+		expected = [evaluate.word_pair_surprise(np.exp(evaluate.estimate_word_pair_cooccurrence(w1, w2, model, self.reader.cooccurrence, use_sglove=True)),
+												float(occurrence[w1]), float(occurrence[w2]), n_docs) for w1,w2 in zip(rows, cols)]
+		np.testing.assert_allclose(evaluate.estimate_pair_surprises(rows, cols, model, occurrence, n_docs), expected, rtol=1e-12)
+
+	def test_min_weight_skips_only_low_weight_pairs(self):
+		cooc, p_values = self.reader.cooccurrence, self.reader.cooccurrence_p_values
+		weights = 1 - packed(reference_batches(cooc, p_values))[3]
+		min_weight = np.median(weights)
+		self.assertEqual(len(s_glove.TrainingSet.from_cooccurrence(cooc, p_values, min_weight=0.0)), cooc.nnz)
+		training_set = s_glove.TrainingSet.from_cooccurrence(cooc, p_values, min_weight=min_weight)
+		self.assertEqual(len(training_set), np.count_nonzero(weights >= min_weight))
+		self.assertEqual(training_set.n_cooccurring, cooc.nnz)
+		self.assertTrue(np.all(1 - np.asarray(training_set.p_values) >= min_weight))
+		model, expected = self.model(min_weight=min_weight), self.model()
+		expected_errors = [reference_epoch(expected, 0.0625, min_weight) for epoch in range(3)]
+		np.testing.assert_allclose(model.train_epochs(3, 0.0625, float("inf"), workers=1), expected_errors, rtol=1e-12)
+		self.assert_same_params(model, expected, rtol=1e-12)
+
+	def test_sampling_below_every_weight_changes_nothing(self):
+		model, expected = self.model(), self.model()
+		expected.train_epochs(3, 0.05, 25.0, workers=1)
+		model.train_epochs(3, 0.05, 25.0, workers=1, sample_below=1e-300)
+		self.assert_same_params(model, expected, rtol=1e-12)
+		sampled, again = self.model(), self.model()
+		sampled.train_epochs(3, 0.05, 25.0, workers=1, sample_below=0.9)
+		again.train_epochs(3, 0.05, 25.0, workers=1, sample_below=0.9)
+		self.assert_same_params(sampled, again, rtol=0)
+		self.assertLess(sampled.get_training_set().sampled_fraction(0.9), 1.0)
+
+	def test_statistics_leave_training_unchanged(self):
+		model, expected = self.model(), self.model()
+		expected_errors = expected.train_epochs(3, 0.05, 25.0, workers=1)
+		stats = []
+		stats_path = os.path.join(self.directory.path, "training_stats.jsonl")
+		errors = model.train_epochs(3, 0.05, 25.0, workers=1, callback=stats.append, stats_path=stats_path)
+		self.assertEqual(errors, expected_errors)
+		self.assert_same_params(model, expected, rtol=0)
+		self.assertEqual([epoch_stats.epoch for epoch_stats in stats], [0, 1, 2])
+		self.assertEqual([epoch_stats.error for epoch_stats in stats], errors)
+		for epoch_stats in stats:
+			self.assertEqual(epoch_stats.pairs, np.count_nonzero(np.asarray(model.get_training_set().p_values) < 1))
+			self.assertEqual(epoch_stats.error_histogram.sum(), epoch_stats.pairs)
+		with open(stats_path) as f:
+			self.assertEqual([json.loads(line) for line in f], [epoch_stats.as_dict() for epoch_stats in stats])
+
+	def test_statistics_keep_early_stopping(self):
+		model, expected = self.model(), self.model()
+		expected_errors = expected.train_epochs(50, 0.05, 25.0, workers=1, tolerance=0.5, patience=2)
+		self.assertLess(len(expected_errors), 50)
+		stats = []
+		errors = model.train_epochs(50, 0.05, 25.0, workers=1, tolerance=0.5, patience=2, callback=stats.append)
+		self.assertEqual(errors, expected_errors)
+		self.assertEqual(len(stats), len(expected_errors))
+
+	def test_block_rounds_share_no_rows(self):
+		training_set = s_glove.TrainingSet.from_cooccurrence(self.reader.cooccurrence, self.reader.cooccurrence_p_values)
+		pairs = lambda ts: sorted(zip(*[np.asarray(column).tolist() for column in ts.batch(0, len(ts))]))
+		for n_blocks in (1, 2, 3, 5):
+			blocked, offsets = training_set.blocked(n_blocks)
+			self.assertEqual(pairs(blocked), pairs(training_set))
+			self.assertEqual(offsets[-1], len(training_set))
+			for r in range(n_blocks):
+				keys, subkeys = set(), set()
+				for b in range(n_blocks):
+					block = b * n_blocks + (b + r) % n_blocks
+					block_keys, block_subkeys = [set(np.asarray(column).tolist()) for column in blocked.batch(offsets[block], offsets[block+1])[:2]]
+					self.assertFalse(block_keys & keys)
+					self.assertFalse(block_subkeys & subkeys)
+					keys |= block_keys
+					subkeys |= block_subkeys
+
+	def test_blocked_training_matches_training_the_rounds_in_order(self):
+		blocked, offsets = s_glove.TrainingSet.from_cooccurrence(self.reader.cooccurrence, self.reader.cooccurrence_p_values).blocked(3)
+		model, expected = self.model(), self.model()
+		error = np.zeros(1, dtype=np.float64)
+		for r in range(3):
+			for b in range(3):
+				block = b * 3 + (b + r) % 3
+				s_glove.train_glove(expected, [np.ascontiguousarray(column) for column in blocked.batch(offsets[block], offsets[block+1])], 0.0625, error)
+		errors = model.train_epochs(1, 0.0625, float("inf"), workers=1, blocks=3)
+		np.testing.assert_allclose(errors, [error[0] / len(blocked)], rtol=1e-12)
+		self.assert_same_params(model, expected, rtol=1e-12)
+		unblocked = self.model()
+		unblocked.train_epochs(1, 0.0625, float("inf"), workers=1)
+		single = self.model()
+		single.train_epochs(1, 0.0625, float("inf"), workers=1, blocks=1)
+		self.assert_same_params(single, unblocked, rtol=1e-12)
+
+if __name__ == "__main__":
+	unittest.main()
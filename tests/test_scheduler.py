@@ -0,0 +1,74 @@
+import itertools, os, StringIO, sys, unittest
+
+import numpy as np
+
+import checkpoint
+import corpus
+import evaluate
+import preprocessor
+import scheduler
+
+# Printed output of print_top_n_surps, as the rows of its table split into cells
+def printed_rows(*args, **kwargs):
+	stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+	try:
+		preprocessor.print_top_n_surps(*args, **kwargs)
+		output = sys.stdout.getvalue()
+	finally:
+		sys.stdout = stdout
+	return [[cell.strip() for cell in line.strip("|").split("|")] for line in output.splitlines() if line.startswith("|")][1:]
+
+# The most surprising pair of famcat fc's documents, estimated pair by pair over the famcat's own ids and counts
+def reference_top_pair(model, acm, fc):
+	occurrence, to_local, tokens = acm.word_occurrence[fc], acm.all_keys_to_per_fc_keys[fc], list(acm.word_occurrence[fc])
+	best = (float("inf"), None)
+	for doc,fcs in zip(acm.documents, acm.doc_famcats):
+		if fc in fcs:
+			for (wk1,_),(wk2,_) in itertools.combinations(sorted(doc), 2):
+				l1, l2 = to_local[wk1], to_local[wk2]
+				est = np.exp(evaluate.estimate_word_pair_cooccurrence(l1, l2, model, acm.cooccurrence[fc], use_sglove=True))
+				best = min(best, (evaluate.word_pair_surprise(est, occurrence[l1], occurrence[l2], acm.docs_per_fc[fc]), sorted([tokens[l1], tokens[l2]])))
+	return best[1]
+
+class FamcatTrainingTest(unittest.TestCase):
+	def test_train_famcats_concurrently_past_the_report(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, famcat_path = corpus.write(directory, famcats=["a", "b"], n_docs=60, n_words=40)
+			reader = corpus.reader(path, famcat_path, use_sglove=True)
+			def train_fc(fc, threads, progress):
+				argstring = reader.argstring+"_fc"+fc
+				model = preprocessor.glovex_model(path, argstring, reader.cooccurrence[fc], dims=8, use_sglove=True,
+												  p_values=reader.cooccurrence_p_values[fc])
+				stdout, sys.stdout = sys.stdout, open(os.path.join(directory, fc + ".out"), "w")
+				try:
+					preprocessor.train_glovex(model, reader, argstring, 4, 0.05, 25.0, threads, 2, label=" for "+fc, progress=progress,
+											  vocabulary=reader.model_vocabulary(fc), n_docs=reader.docs_per_fc[fc], fc=fc)
+				finally:
+					sys.stdout.close()
+					sys.stdout = stdout
+			sizes = dict((fc, scheduler.pair_count(fc_cooccurrence)) for fc,fc_cooccurrence in reader.cooccurrence.iteritems())
+			scheduler.train_concurrently(sizes, 4, 2, train_fc)
+			for fc in ("a", "b"):
+				with open(os.path.join(directory, fc + ".out")) as f:
+					self.assertIn("top_n surprising combos", f.read())
+				self.assertEqual([epoch for epoch,_ in checkpoint.checkpoints(path+reader.argstring+"_fc"+fc)], [2, 3])
+
+	def test_famcat_report_uses_the_famcat_counts(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, famcat_path = corpus.write(directory, famcats=["a", "b", "c"], n_docs=60, n_words=40)
+			reader = corpus.reader(path, famcat_path, use_sglove=True)
+			for fc in reader.famcats:
+				model = preprocessor.glovex_model(path, reader.argstring+"_fc"+fc, reader.cooccurrence[fc], dims=8, use_sglove=True,
+												  p_values=reader.cooccurrence_p_values[fc])
+				model.train_epochs(3, 0.05, 25.0, workers=1)
+				rows = printed_rows(model, reader, 5, fc=fc)
+				self.assertEqual(len(rows), 5)
+				self.assertEqual(sorted(rows[0][:2]), reference_top_pair(model, reader, fc))
+				for w1,w2,w1_occs,w2_occs,obs_cooc in [row[:5] for row in rows]:
+					self.assertEqual(float(w1_occs), reader.word_occurrence[fc][w1])
+					self.assertEqual(float(w2_occs), reader.word_occurrence[fc][w2])
+					wk1, wk2 = reader.all_keys_to_per_fc_keys[fc][reader.dictionary.token2id[w1]], reader.all_keys_to_per_fc_keys[fc][reader.dictionary.token2id[w2]]
+					self.assertEqual(float(obs_cooc), reader.cooccurrence[fc][wk1][wk2])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,94 @@
+import json, threading, unittest, urllib2
+
+import numpy as np
+
+import corpus
+import evaluate
+import server
+import test_evaluate
+
+class ServerTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = corpus.TemporaryDirectory()
+		cls.reader, cls.model = test_evaluate.trained_reader(cls.directory.__enter__())
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.reader.use_sglove = True
+		cls.directory.__exit__()
+
+	def test_batched_records_match_document_records(self):
+		scorer = server.Scorer(self.model, self.reader)
+		for use_sglove in (True, False):
+			self.reader.use_sglove = use_sglove
+			n_docs = len(self.reader.documents)
+			top_ns = [[0, 1, 3, 25, 1000][i % 5] for i in range(n_docs)]
+			records = scorer.score([(self.reader.doc_ids[i], self.reader.documents[i]) for i in range(n_docs)], top_ns)
+			for i,(record,top_n) in enumerate(zip(records, top_ns)):
+				expected = evaluate.document_record(self.reader.doc_ids[i], "", self.reader.documents[i], "", self.model, self.reader, top_n)
+				self.assertEqual(record["id"], expected["id"])
+				self.assertEqual(record["words"], len(self.reader.documents[i]))
+				self.assertEqual([(w1, w2) for w1,w2,_ in record["surprises"]], [(w1, w2) for w1,w2,_ in expected["surprises"]])
+				np.testing.assert_allclose([s for _,_,s in record["surprises"]], [s for _,_,s in expected["surprises"]], rtol=1e-10)
+				if expected["surprise"] == float("inf"):
+					self.assertIsNone(record["surprise"])
+				else:
+					self.assertAlmostEqual(record["surprise"], expected["surprise"], delta=1e-10 * expected["surprise"])
+			self.assertEqual(scorer.score([("x", self.reader.documents[0])], 3), scorer.score([("x", self.reader.documents[0])], [3]))
+		self.reader.use_sglove = True
+
+	def test_new_documents(self):
+		scorer = server.Scorer(self.model, self.reader)
+		for i in range(10):
+			self.assertEqual(scorer.bow(self.reader.doc_titles[i], self.reader.doc_raws[i]), list(self.reader.documents[i]))
+		matrix = self.reader.cooccurrence.matrix.toarray()
+		w1, w2 = [int(wk) for wk in np.argwhere(matrix + np.eye(len(matrix)) == 0)[0]]
+		bow = scorer.bow(self.reader.dictionary[w1], self.reader.dictionary[w2] + " unknownword")
+		self.reader.use_sglove = False
+		with np.errstate(all="raise"):
+			record, = scorer.score([("new", bow)], 0)
+		self.reader.use_sglove = True
+		# a pair never observed together is left as estimated rather than corrected
+		self.assertEqual(record["words"], 2)
+		self.assertTrue(np.isfinite(record["surprise"]))
+		self.assertEqual(record, scorer.score([("new", bow)], 0)[0])
+
+	def test_http_round_trip(self):
+		scorer = server.Scorer(self.model, self.reader)
+		scoring_server = server.ScoringServer(("127.0.0.1", 0), scorer, max_batch=8, max_wait=0.01, top_n=4)
+		thread = threading.Thread(target=scoring_server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		url = "http://127.0.0.1:%d" % scoring_server.server_address[1]
+		post = lambda body: json.loads(urllib2.urlopen(urllib2.Request(url + "/score", json.dumps(body), {"Content-Type": "application/json"})).read())
+		try:
+			documents = [{"id": self.reader.doc_ids[i], "title": self.reader.doc_titles[i], "abstract": self.reader.doc_raws[i]} for i in range(12)]
+			expected = lambda docs, top_n: json.loads(json.dumps(scorer.score([(doc["id"], scorer.bow(doc["title"], doc["abstract"])) for doc in docs], top_n)))
+			self.assertEqual(post(documents[0])["documents"], expected(documents[:1], 4))
+			results = {}
+			def request(i):
+				results[i] = post({"documents": documents[i:i+3], "top_n": i % 4})["documents"]
+			threads = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+			for i in range(8):
+				self.assertEqual(results[i], expected(documents[i:i+3], i % 4))
+			health = json.loads(urllib2.urlopen(url + "/health").read())
+			self.assertEqual(health, {"status": "ok", "words": len(self.reader.dictionary), "documents": len(self.reader.documents)})
+			for body in ({"title": "no abstract"}, {"abstract": "x", "top_n": -1}, []):
+				with self.assertRaises(urllib2.HTTPError) as raised:
+					post(body)
+				self.assertEqual(raised.exception.code, 400)
+			metrics = json.loads(urllib2.urlopen(url + "/metrics").read())
+			self.assertEqual(metrics["requests"], 12)
+			self.assertEqual(metrics["errors"], 3)
+			self.assertEqual(metrics["documents"], 25)
+		finally:
+			scoring_server.shutdown()
+			scoring_server.server_close()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import fisher
+import gensim
+import numpy as np
+
+import corpus
+import cooccurrence
+import significance
+
+# The p-value significance_on_tuple computed pair by pair before the tables were vectorised
+def reference_left_tail(cooccurrences, w1_occurrence, w2_occurrence, n_docs):
+	return fisher.pvalue(cooccurrences, w2_occurrence-cooccurrences, w1_occurrence-cooccurrences, n_docs-w1_occurrence-w2_occurrence+cooccurrences).left_tail
+
+class SignificanceTest(unittest.TestCase):
+	def test_left_tail_matches_fisher(self):
+		rng = np.random.RandomState(0)
+		for n_docs in (10, 200, 5000):
+			w1 = rng.randint(1, n_docs, 200)
+			w2 = rng.randint(1, n_docs, 200)
+			a = np.array([rng.randint(max(0, x + y - n_docs), min(x, y) + 1) for x,y in zip(w1, w2)])
+			expected = [reference_left_tail(*table) for table in zip(a, w1, w2, [n_docs] * len(a))]
+			np.testing.assert_allclose(significance.left_tail(a, w1, w2, n_docs), expected, rtol=1e-9, atol=1e-12)
+
+	def test_cooccurrence_p_values_match_fisher(self):
+		docs = [text.split() for _,text in corpus.texts(n_docs=80, n_words=30)]
+		dictionary = gensim.corpora.Dictionary(docs)
+		documents = [dictionary.doc2bow(doc) for doc in docs]
+		cooc, occ = cooccurrence.sparse_cooccurrence(cooccurrence.bow_matrix(documents, len(dictionary)))
+		for chunk_pairs in (None, 50):
+			p_values = significance.cooccurrence_p_values(cooc, occ, len(documents), chunk_pairs=chunk_pairs)
+			for wk in range(len(dictionary)):
+				for wk2 in range(len(dictionary)):
+					if wk != wk2:
+						expected = reference_left_tail(int(cooc[wk, wk2]), int(occ[wk]), int(occ[wk2]), len(documents))
+						self.assertAlmostEqual(p_values[wk][wk2], expected, places=10)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,84 @@
+import multiprocessing, os, unittest
+
+import numpy as np
+
+import corpus
+import evaluate
+import s_glove
+import surprise_index
+import test_scheduler
+
+# The surprises of every co-occurring pair (w1 < w2) of a model, estimated pair by pair as evaluate did for documents
+def reference_surprises(model, cooc, occurrence, n_docs, use_sglove):
+	surprises = np.full((len(occurrence), len(occurrence)), np.inf)
+	for w1,w2 in zip(*cooc.matrix.nonzero()):
+		if w1 < w2:
+			est = np.exp(evaluate.estimate_word_pair_cooccurrence(w1, w2, model, cooc, use_sglove=use_sglove))
+			surprises[w1,w2] = surprises[w2,w1] = evaluate.word_pair_surprise(est, occurrence[w1], occurrence[w2], n_docs)
+	return surprises
+
+class SurpriseIndexTest(unittest.TestCase):
+	def test_index_matches_brute_force(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, _ = corpus.write(directory, n_docs=60, n_words=40)
+			reader = corpus.reader(path, use_sglove=True)
+			model = s_glove.Glove(reader.cooccurrence, reader.cooccurrence_p_values, d=8, x_max=3.0)
+			model.train_epochs(3, 0.05, 25.0, workers=1)
+			occurrence, n_docs = np.asarray(reader.word_occurrence.counts, dtype=np.float64), len(reader.documents)
+			for use_sglove in (True, False):
+				expected = reference_surprises(model, reader.cooccurrence, occurrence, n_docs, use_sglove)
+				for memory_mb, workers in ((256, 1), (0.001, 2)):
+					index = surprise_index.build(model, occurrence, n_docs, os.path.join(directory, "index"), k=5, cooccurrence=reader.cooccurrence,
+												 use_sglove=use_sglove, memory_mb=memory_mb, workers=workers)
+					best = np.sort(expected, axis=1)[:, :5]
+					np.testing.assert_allclose(np.asarray(index.surprises), best, rtol=1e-10)
+					for w,(partners, surprises) in enumerate(zip(index.partners, index.surprises)):
+						for partner,surprise in zip(partners, surprises):
+							if np.isfinite(surprise):
+								self.assertAlmostEqual(expected[w, partner], surprise, places=10)
+							else:
+								self.assertEqual(partner, -1)
+					w1s, w2s, surps = index.top_pairs(5)
+					top = np.sort(expected[np.triu_indices(len(expected), k=1)])[:5]
+					np.testing.assert_allclose(surps, top, rtol=1e-10)
+					self.assertTrue(np.all(w1s < w2s))
+
+	def test_failed_build_keeps_the_index(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, _ = corpus.write(directory, n_docs=60, n_words=40)
+			reader = corpus.reader(path, use_sglove=True)
+			model = s_glove.Glove(reader.cooccurrence, reader.cooccurrence_p_values, d=8)
+			model.train_epochs(3, 0.05, 25.0, workers=1)
+			occurrence, n_docs = np.asarray(reader.word_occurrence.counts, dtype=np.float64), len(reader.documents)
+			index_path = os.path.join(directory, "index")
+			index = surprise_index.build(model, occurrence, n_docs, index_path, k=5, cooccurrence=reader.cooccurrence, workers=1)
+			expected = np.array(index.surprises)
+			for workers in (1, 2):
+				# Occurrence counts missing for the last words fail the blocks that reach them
+				with self.assertRaises(IndexError):
+					surprise_index.build(model, occurrence[:-5], n_docs, index_path, k=5, cooccurrence=reader.cooccurrence,
+										 memory_mb=0.001, workers=workers)
+				self.assertEqual(multiprocessing.active_children(), [])
+				self.assertFalse(os.path.exists(index_path + ".tmp"))
+				np.testing.assert_array_equal(np.asarray(surprise_index.load(index_path).surprises), expected)
+
+	def test_famcat_report_from_the_index(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, famcat_path = corpus.write(directory, famcats=["a", "b"], n_docs=60, n_words=40)
+			reader = corpus.reader(path, famcat_path, use_sglove=True)
+			for fc in reader.famcats:
+				model = s_glove.Glove(reader.cooccurrence[fc], reader.cooccurrence_p_values[fc], d=8)
+				model.train_epochs(3, 0.05, 25.0, workers=1)
+				tokens, counts = reader.model_vocabulary(fc)
+				index = surprise_index.build(model, counts, reader.docs_per_fc[fc], os.path.join(directory, "index_"+fc), k=5,
+											 cooccurrence=reader.cooccurrence[fc], workers=1)
+				w1s, w2s, surps = index.top_pairs(5)
+				rows = test_scheduler.printed_rows(model, reader, 5, index, fc=fc)
+				self.assertEqual([row[:2] for row in rows], [[tokens[w1], tokens[w2]] for w1,w2 in zip(w1s, w2s)])
+				for (w1,w2,w1_occs,w2_occs,obs_cooc),wk1,wk2 in zip([row[:5] for row in rows], w1s, w2s):
+					self.assertEqual(float(w1_occs), counts[wk1])
+					self.assertEqual(float(w2_occs), counts[wk2])
+					self.assertEqual(float(obs_cooc), reader.cooccurrence[fc][wk1][wk2])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,84 @@
+import multiprocessing, os, random, unittest
+
+import gensim
+from inflection import singularize
+from nltk.corpus import stopwords
+from nltk.tokenize import RegexpTokenizer
+
+import corpus
+import tokeniser
+
+WORDS = ["the", "of", "and", "Networks", "network", "graphs", "graph", "queries", "query", "analysis", "analyses", "indices",
+		 "matrix", "matrices", "Users", "user", "studies", "study", "mice", "data", "is", "learning", "Models", "model", "A"]
+
+def english_texts(n_docs=120, seed=1234):
+	rng = random.Random(seed)
+	return [u" ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 15))) + rng.choice([u"", u".", u", 2017"]) for _ in range(n_docs)]
+
+# How the readers tokenised and normalised a document before the tokeniser module
+def reference_tokens(text):
+	stop = set(stopwords.words("english"))
+	return [singularize(w) for w in RegexpTokenizer(r'\w+').tokenize(text.lower()) if w not in stop]
+
+class TokeniseTest(unittest.TestCase):
+	def test_matches_two_pass_gensim(self):
+		texts = english_texts()
+		documents = [reference_tokens(text) for text in texts]
+		expected_dictionary = gensim.corpora.Dictionary(documents)
+		for workers in (1, 2):
+			streams = tokeniser.tokenise(iter(texts), workers=workers, chunk_size=7)
+			dictionary = streams.dictionary()
+			self.assertEqual(dictionary.token2id, expected_dictionary.token2id)
+			self.assertEqual(dictionary.dfs, expected_dictionary.dfs)
+			self.assertEqual(dictionary.num_docs, expected_dictionary.num_docs)
+			dictionary.filter_extremes(no_below=2, no_above=0.5, keep_n=None)
+			expected_dictionary_filtered = gensim.corpora.Dictionary(documents)
+			expected_dictionary_filtered.filter_extremes(no_below=2, no_above=0.5, keep_n=None)
+			self.assertEqual(dictionary.token2id, expected_dictionary_filtered.token2id)
+			self.assertEqual(list(streams.bow_corpus(dictionary)), [expected_dictionary_filtered.doc2bow(doc) for doc in documents])
+
+	def test_failures_stop_the_pool(self):
+		def failing_texts():
+			for text in english_texts(40):
+				yield text
+			raise IOError("corpus unreadable")
+		with self.assertRaises(IOError):
+			tokeniser.tokenise(failing_texts(), workers=2, chunk_size=7)
+		self.assertEqual(multiprocessing.active_children(), [])
+		with self.assertRaises(AttributeError):
+			tokeniser.tokenise(iter(english_texts(40) + [None]), workers=2, chunk_size=7)
+		self.assertEqual(multiprocessing.active_children(), [])
+
+class NormalisationCacheTest(unittest.TestCase):
+	def test_forms_match_singularize(self):
+		words = [w.lower() for w in WORDS] * 3
+		for max_size in (200000, 3):
+			cache = tokeniser.NormalisationCache(max_size=max_size)
+			self.assertEqual([cache.normalise(w) for w in words], [singularize(w) for w in words])
+		self.assertGreater(cache.stats()["evictions"], 0)
+
+	def test_store_is_shared_between_runs(self):
+		words = [w.lower() for w in WORDS]
+		with corpus.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "normalisation")
+			first = tokeniser.NormalisationCache(path)
+			self.assertEqual([first.normalise(w) for w in words], [singularize(w) for w in words])
+			first.save(first.take_new_entries())
+			second = tokeniser.NormalisationCache(path)
+			self.assertEqual([second.normalise(w) for w in words], [singularize(w) for w in words])
+			self.assertEqual(second.stats()["misses"], 0)
+			self.assertEqual(second.stats()["store_hits"], len(set(words)))
+
+	def test_tokenise_with_store(self):
+		texts = english_texts()
+		with corpus.TemporaryDirectory() as directory:
+			try:
+				for _ in range(2):
+					tokeniser.configure_cache(os.path.join(directory, "normalisation"))
+					streams = tokeniser.tokenise(iter(texts), workers=2, chunk_size=7)
+					self.assertEqual(streams.dictionary().token2id, gensim.corpora.Dictionary(reference_tokens(text) for text in texts).token2id)
+			finally:
+				tokeniser.configure_cache()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+import scipy.spatial.distance
+
+import corpus
+import evaluate
+import s_glove
+import vector_index
+
+# most_similar_features, most_similar_contexts and most_similar_differences as they compared surp with every other
+# surprise of surp_list before the vector index: the vectors of surprises and their euclidean distance to surp's
+def reference_most_similar(surp, surp_list, model, dictionary, kind, n = 10):
+	token2id = dictionary.token2id
+	vector = lambda s: {"features": model.W[token2id[s[0]]], "contexts": model.W[token2id[s[1]]],
+						"differences": model.W[token2id[s[0]]] - model.W[token2id[s[1]]]}[kind]
+	results = [(surp2, scipy.spatial.distance.euclidean(vector(surp), vector(surp2))) for surp2 in surp_list if not surp[:2] == surp2[:2]]
+	results.sort(key = lambda x: x[1])
+	if n and n < len(results):
+		return results[:n]
+	return results
+
+class VectorIndexTest(unittest.TestCase):
+	def test_exact_search_matches_brute_force(self):
+		rng = np.random.RandomState(0)
+		vectors, queries = rng.normal(size=(500, 12)), rng.normal(size=(20, 12))
+		expected = np.sqrt(((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2))
+		for memory_mb in (256, 0.01):
+			index = vector_index.VectorIndex(vectors, memory_mb=memory_mb)
+			indices, distances = index.search(queries, 7, exclude=[[0, 1]] * len(queries))
+			for i,query_distances in enumerate(expected):
+				query_distances[[0, 1]] = np.inf
+				order = np.argsort(query_distances, kind="mergesort")[:7]
+				np.testing.assert_array_equal(indices[i], order)
+				np.testing.assert_allclose(distances[i], query_distances[order], rtol=1e-12)
+		probed = vector_index.VectorIndex(vectors, n_lists=8, n_probe=8)
+		np.testing.assert_array_equal(probed.search(queries, 7)[0], vector_index.VectorIndex(vectors).search(queries, 7)[0])
+		self.assertEqual(len(vector_index.VectorIndex(vectors).search(queries[:1], 600)[0][0]), 600)
+
+	def test_most_similar_matches_pairwise_distances(self):
+		with corpus.TemporaryDirectory() as directory:
+			path, _ = corpus.write(directory, n_docs=50, n_words=30)
+			reader = corpus.reader(path, use_sglove=True)
+			model = s_glove.Glove(reader.cooccurrence, reader.cooccurrence_p_values, d=8)
+			model.train_epochs(3, 0.05, 25.0, workers=1)
+			surp_list = evaluate.estimate_document_surprise_pairs(reader.documents[0], model, reader)
+			for doc in [reader.documents[i] for i in range(1, 10)]:
+				surp_list += evaluate.estimate_document_surprise_pairs(doc, model, reader, top_n_per_doc=5)
+			for kind,most_similar in (("features", evaluate.most_similar_features), ("contexts", evaluate.most_similar_contexts),
+									  ("differences", evaluate.most_similar_differences)):
+				for surp in surp_list[:10]:
+					for n in (0, 10):
+						results = most_similar(surp, surp_list, model, reader.dictionary, n)
+						expected = reference_most_similar(surp, surp_list, model, reader.dictionary, kind, n)
+						self.assertEqual(len(results), len(expected))
+						np.testing.assert_allclose([result[-1] for result in results], [distance for _,distance in expected], rtol=1e-9, atol=1e-12)
+						for result,(surp2,distance) in zip(results, expected):
+							self.assertEqual(result[0], surp)
+							if result[1] != surp2:
+								self.assertAlmostEqual(reference_most_similar(surp, [result[1]], model, reader.dictionary, kind)[0][1], distance, places=9)
+
+if __name__ == "__main__":
+	unittest.main()
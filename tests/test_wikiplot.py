@@ -0,0 +1,58 @@
+import io, os, random, unittest
+
+from inflection import singularize
+from nltk.corpus import stopwords
+from nltk.tokenize import RegexpTokenizer
+
+import corpus
+import preprocessor
+
+# What WikiPlot_DocReader yielded and recorded before it streamed the plots: (ids, titles, raws, documents)
+def reference_read(path):
+	stop = set(stopwords.words("english"))
+	tokeniser = RegexpTokenizer(r'\w+')
+	ids, titles, raws, documents = [], [], [], []
+	with io.open(path, mode="r", encoding="ascii", errors="ignore") as i_f:
+		t_f = io.open(path+"_titles", mode="r", encoding="ascii", errors="ignore")
+		doc_raw = ""
+		docwords = []
+		for line in i_f.readlines():
+			if line[:5] == "<EOS>":
+				ids.append(len(ids))
+				titles.append(t_f.readline())
+				raws.append(doc_raw)
+				documents.append(docwords)
+				doc_raw = ""
+				docwords = []
+			else:
+				docwords += [singularize(w) for w in tokeniser.tokenize(line) if w not in stop]
+				doc_raw += line
+		t_f.close()
+	return ids, titles, raws, documents
+
+class WikiPlotTest(unittest.TestCase):
+	def test_matches_old_reader(self):
+		rng = random.Random(1234)
+		words = corpus.vocabulary(30) + ["The", "plots", "cities", "of", "caf\xc3\xa9", "Heroes"]
+		with corpus.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "plots")
+			with open(path, "wb") as plots, open(path+"_titles", "wb") as titles:
+				for i in range(25):
+					for _ in range(rng.randint(0, 4)):
+						plots.write(" ".join(rng.choice(words) for _ in range(rng.randint(0, 10))) + "\n")
+					plots.write("<EOS>\n")
+					titles.write("Title %d %s\n" % (i, rng.choice(words)))
+			ids, titles, raws, documents = reference_read(path)
+			reader = preprocessor.WikiPlot_DocReader(path)
+			self.assertEqual(list(reader), documents)
+			self.assertEqual(list(reader.doc_ids), ids)
+			self.assertEqual(list(reader.doc_titles), titles)
+			self.assertEqual(list(reader.doc_raws), raws)
+			skipping = preprocessor.WikiPlot_DocReader(path)
+			self.assertEqual(len(list(skipping.texts(skip=10))), len(documents) - 10)
+			self.assertEqual(list(skipping.doc_ids), ids[10:])
+			self.assertEqual(list(skipping.doc_raws), raws[10:])
+			self.assertEqual(list(skipping.doc_titles), titles[10:])
+
+if __name__ == "__main__":
+	unittest.main()
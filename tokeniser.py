@@ -0,0 +1,288 @@
+import anydbm, collections, logging, multiprocessing, os, time
+import gensim
+import numpy as np
+from nltk.corpus import stopwords
+from nltk.tokenize import RegexpTokenizer
+from inflection import singularize
+
+import cooccurrence
+import outofcore
+
+logger = logging.getLogger("glovex")
+
+STOPWORDS = set(stopwords.words("english"))
+TOKENISER = RegexpTokenizer(r'\w+')
+
+# Memo of singularize() results: a bounded in-process LRU table in front of an optional on-disk
+# surface form -> normalised form store that is shared between runs and datasets.  Forms computed
+# during a run are collected in new_entries and written to the store by the parent process (save).
+class NormalisationCache(object):
+	def __init__(self, path=None, max_size=200000):
+		self.path = path
+		self.max_size = max_size
+		self.memo = collections.OrderedDict()
+		self.new_entries = {}
+		self.store = None
+		self.hits = 0
+		self.store_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		if path is not None:
+			try:
+				self.store = anydbm.open(path, "r")
+			except anydbm.error:
+				pass
+
+	def normalise(self, w):
+		try:
+			normalised = self.memo.pop(w)
+			self.hits += 1
+		except KeyError:
+			key = w.encode("utf-8")
+			if self.store is not None and key in self.store:
+				normalised = self.store[key].decode("utf-8")
+				self.store_hits += 1
+			else:
+				normalised = singularize(w)
+				self.new_entries[w] = normalised
+				self.misses += 1
+			if len(self.memo) >= self.max_size:
+				self.memo.popitem(last=False)
+				self.evictions += 1
+		self.memo[w] = normalised
+		return normalised
+
+	def stats(self):
+		return {"hits": self.hits, "store_hits": self.store_hits, "misses": self.misses, "evictions": self.evictions}
+
+	# Hand over (and forget) the forms computed since the last call
+	def take_new_entries(self):
+		entries, self.new_entries = self.new_entries, {}
+		return entries
+
+	# Add computed forms to the on-disk store
+	def save(self, entries):
+		if self.path is None or not entries:
+			return
+		if self.store is not None:
+			self.store.close()
+		if os.path.dirname(self.path) and not os.path.exists(os.path.dirname(self.path)):
+			os.makedirs(os.path.dirname(self.path))
+		store = anydbm.open(self.path, "c")
+		for w,normalised in entries.iteritems():
+			store[w.encode("utf-8")] = normalised.encode("utf-8")
+		store.close()
+		self.store = anydbm.open(self.path, "r")
+
+CACHE = NormalisationCache()
+
+# Use a normalisation cache backed by the store at path (None for an in-memory cache only).  Worker processes
+# forked afterwards inherit it.
+def configure_cache(path=None, max_size=200000):
+	global CACHE
+	CACHE = NormalisationCache(path, max_size)
+
+# Tokenise a document's text, drop stopwords and singularise what is left
+def normalise_text(text, lowercase=True):
+	if lowercase:
+		text = text.lower()
+	return [CACHE.normalise(w) for w in TOKENISER.tokenize(text) if w not in STOPWORDS]
+
+# Tokenise a chunk of texts into the compact form sent back from the worker processes: the chunk's vocabulary,
+# the concatenated token ids and each document's length, plus the normalisation cache's new forms and counters.
+# Ids are handed out like gensim's Dictionary does (new tokens of each document in sorted order), so merging
+# chunks in order reproduces gensim's token ids.
+def tokenise_chunk(texts, lowercase=True):
+	stats_before = CACHE.stats()
+	vocab = {}
+	ids = []
+	lengths = []
+	for text in texts:
+		words = normalise_text(text, lowercase)
+		for w in sorted(set(w for w in words if w not in vocab)):
+			vocab[w] = len(vocab)
+		ids.extend(vocab[w] for w in words)
+		lengths.append(len(words))
+	tokens = [None] * len(vocab)
+	for w,i in vocab.iteritems():
+		tokens[i] = w
+	stats = {k:v - stats_before[k] for k,v in CACHE.stats().iteritems()}
+	return tokens, np.array(ids, dtype=np.int32), np.array(lengths, dtype=np.int64), CACHE.take_new_entries(), stats
+
+def _chunks(iterable, chunk_size):
+	chunk = []
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk) >= chunk_size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+# Every document of a corpus as token ids into a shared surface vocabulary, concatenated with per-document offsets.
+# Building the dictionary and the BoW corpus from this never re-tokenises the text.  Given a directory, the token
+# ids and the BoW corpus are written there and memory-mapped instead of being held in memory, and chunk_tokens
+# bounds the number of token positions processed at once.
+class TokenStreams(object):
+	def __init__(self, directory=None, chunk_tokens=None):
+		self.directory = directory
+		self.chunk_tokens = chunk_tokens
+		self.vocabulary = []
+		self.token2id = {}
+		self._ids = []
+		self._lengths = []
+		self._writer = None
+		if directory is not None:
+			self._writer = outofcore.NpyWriter(os.path.join(directory, "token_ids.npy"), np.int32)
+		self.ids = np.zeros(0, dtype=np.int32)
+		self.offsets = np.zeros(1, dtype=np.int64)
+
+	# Merge one tokenised chunk (in corpus order) into the streams
+	def add_chunk(self, tokens, ids, lengths):
+		remap = np.empty(len(tokens), dtype=np.int32)
+		for i,w in enumerate(tokens):
+			if w not in self.token2id:
+				self.token2id[w] = len(self.vocabulary)
+				self.vocabulary.append(w)
+			remap[i] = self.token2id[w]
+		if self._writer is not None:
+			self._writer.write(remap[ids])
+		else:
+			self._ids.append(remap[ids])
+		self._lengths.append(lengths)
+
+	def finalise(self):
+		if self._writer is not None:
+			self.ids = self._writer.close()
+			self._writer = None
+		elif self._ids:
+			self.ids = np.concatenate([self.ids] + self._ids)
+			self._ids = []
+		if self._lengths:
+			lengths = np.concatenate(self._lengths)
+			self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+			self._lengths = []
+		return self
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		return [self.vocabulary[w] for w in self.ids[self.offsets[i]:self.offsets[i+1]]]
+
+	def __iter__(self):
+		return (self[i] for i in range(len(self)))
+
+	# Consecutive [start, end) document ranges holding about chunk_tokens token positions each
+	def _doc_chunks(self):
+		if self.chunk_tokens is None:
+			return [(0, len(self))]
+		return outofcore.batches(np.diff(self.offsets), self.chunk_tokens)
+
+	# Unique (document, token id) pairs of documents [start, end), sorted by document then id, with their counts.
+	# Documents are numbered from start; token ids are mapped through remap (dropping those mapped to -1) if given.
+	def _doc_token_counts(self, start, end, remap=None):
+		ids = self.ids[self.offsets[start]:self.offsets[end]]
+		docs = np.repeat(np.arange(end-start, dtype=np.int64), np.diff(self.offsets[start:end+1]))
+		if remap is not None and len(ids):
+			ids = remap[ids]
+			keep = ids >= 0
+			docs, ids = docs[keep], ids[keep]
+		n_ids = max(int(ids.max()) + 1 if len(ids) else 1, 1)
+		keys, counts = np.unique(docs * n_ids + ids, return_counts=True)
+		return keys // n_ids, keys % n_ids, counts
+
+	# Number of documents each surface token occurs in, and its total number of occurrences
+	def frequencies(self):
+		dfs = np.zeros(len(self.vocabulary), dtype=np.int64)
+		cfs = np.zeros(len(self.vocabulary), dtype=np.int64)
+		for start, end in self._doc_chunks():
+			_, ids, counts = self._doc_token_counts(start, end)
+			dfs += np.bincount(ids, minlength=len(self.vocabulary))
+			cfs += np.bincount(ids, weights=counts, minlength=len(self.vocabulary)).astype(np.int64)
+		return dfs, cfs
+
+	def document_frequencies(self):
+		return self.frequencies()[0]
+
+	# An (unfiltered) gensim Dictionary identical to gensim.corpora.Dictionary(documents)
+	def dictionary(self):
+		dfs, cfs = self.frequencies()
+		dictionary = gensim.corpora.Dictionary()
+		dictionary.token2id = dict(self.token2id)
+		dictionary.dfs = dict(enumerate(dfs.tolist()))
+		dictionary.cfs = dict(enumerate(cfs.tolist()))
+		dictionary.num_docs = len(self)
+		dictionary.num_pos = len(self.ids)
+		dictionary.num_nnz = int(dfs.sum())
+		return dictionary
+
+	# Add the documents to an existing (unfiltered) gensim Dictionary, as dictionary.add_documents(documents) would
+	def update_dictionary(self, dictionary):
+		dfs, cfs = self.frequencies()
+		for w,df,cf in zip(self.vocabulary, dfs.tolist(), cfs.tolist()):
+			wk = dictionary.token2id.setdefault(w, len(dictionary.token2id))
+			dictionary.dfs[wk] = dictionary.dfs.get(wk, 0) + df
+			dictionary.cfs[wk] = dictionary.cfs.get(wk, 0) + cf
+		dictionary.id2token = {}
+		dictionary.num_docs += len(self)
+		dictionary.num_pos += len(self.ids)
+		dictionary.num_nnz += int(dfs.sum())
+		return dictionary
+
+	# The documents as a BoW corpus over the (filtered) dictionary, equal to [dictionary.doc2bow(d) for d in documents]
+	def bow_corpus(self, dictionary):
+		remap = np.array([dictionary.token2id.get(w, -1) for w in self.vocabulary], dtype=np.int32)
+		indptr = np.zeros(len(self)+1, dtype=np.int64)
+		if self.directory is not None:
+			indices = outofcore.NpyWriter(os.path.join(self.directory, "documents.indices.npy"), np.int32)
+			counts = outofcore.NpyWriter(os.path.join(self.directory, "documents.data.npy"), np.int32)
+		else:
+			indices = outofcore.ArrayWriter(np.int32)
+			counts = outofcore.ArrayWriter(np.int32)
+		for start, end in self._doc_chunks():
+			docs, ids, chunk_counts = self._doc_token_counts(start, end, remap)
+			indices.write(ids)
+			counts.write(chunk_counts)
+			indptr[start+1:end+1] = indptr[start] + np.cumsum(np.bincount(docs, minlength=end-start))
+		return cooccurrence.BowCorpus(indices=indices.close(), counts=counts.close(), indptr=indptr, n_words=len(dictionary))
+
+# Tokenise texts across a process pool in order-preserving chunks, keeping at most a few chunks in flight.
+# directory and chunk_tokens are passed on to TokenStreams.
+def tokenise(texts, lowercase=True, workers=None, chunk_size=1000, directory=None, chunk_tokens=None):
+	workers = workers or multiprocessing.cpu_count()
+	start = time.time()
+	streams = TokenStreams(directory, chunk_tokens)
+	new_entries = {}
+	stats = collections.Counter()
+	def add_chunk(tokens, ids, lengths, chunk_entries, chunk_stats):
+		streams.add_chunk(tokens, ids, lengths)
+		new_entries.update(chunk_entries)
+		stats.update(chunk_stats)
+	if workers > 1:
+		pool = multiprocessing.Pool(workers)
+		try:
+			pending = collections.deque()
+			for chunk in _chunks(texts, chunk_size):
+				pending.append(pool.apply_async(tokenise_chunk, (chunk, lowercase)))
+				if len(pending) > 2 * workers:
+					add_chunk(*pending.popleft().get())
+			while pending:
+				add_chunk(*pending.popleft().get())
+		except:
+			# Stop the workers still tokenising rather than leaving them behind
+			pool.terminate()
+			pool.join()
+			raise
+		pool.close()
+		pool.join()
+	else:
+		for chunk in _chunks(texts, chunk_size):
+			add_chunk(*tokenise_chunk(chunk, lowercase))
+	streams.finalise()
+	elapsed = max(time.time() - start, 1e-9)
+	logger.info("   **** Tokenised %d documents (%d tokens) in %.2fs: %.0f docs/sec on %d workers" % (len(streams), len(streams.ids), elapsed, len(streams)/elapsed, workers))
+	lookups = max(sum(stats.values()) - stats["evictions"], 1)
+	logger.info("   **** Normalisation cache: %.1f%% memo hits, %.1f%% store hits, %d misses, %d evictions" % (100.0*stats["hits"]/lookups, 100.0*stats["store_hits"]/lookups, stats["misses"], stats["evictions"]))
+	CACHE.save(new_entries)
+	return streams
@@ -0,0 +1,115 @@
+import logging, time
+import numpy as np
+
+logger = logging.getLogger("glovex")
+
+# Extra candidates ranked by the expanded squared distance before the exact distances pick the final k, so that
+# rounding in ||x||^2 - 2x.q + ||q||^2 does not change which neighbours are returned
+RERANK_SLACK = 16
+
+# Rows the IVF centroids are trained on per list, by default
+SAMPLE_PER_LIST = 40
+
+# Exact or approximate k-nearest-neighbour search by euclidean distance over the rows of vectors.  Exact search scores
+# every row with matrix products over blocks of at most memory_mb.  With n_lists, the rows are clustered by k-means
+# into that many inverted lists (IVF) and a query only scores the rows of its n_probe nearest lists.  The k-means runs
+# for iterations on a sample of sample rows (default: SAMPLE_PER_LIST per list).
+class VectorIndex(object):
+	def __init__(self, vectors, n_lists=0, n_probe=8, sample=None, iterations=10, seed=1234, memory_mb=256):
+		start = time.time()
+		self.vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+		self.norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+		self.memory_mb = memory_mb
+		self.n_probe = n_probe
+		self.centroids = None
+		n_lists = min(n_lists, len(self.vectors))
+		if n_lists > 1:
+			self.centroids = _kmeans(self.vectors, n_lists, sample or SAMPLE_PER_LIST * n_lists, iterations, np.random.RandomState(seed), memory_mb)
+			lists, _ = _nearest(self.centroids, np.einsum("ij,ij->i", self.centroids, self.centroids), self.vectors, memory_mb)
+			self.order = np.argsort(lists, kind="mergesort")
+			self.offsets = np.searchsorted(lists[self.order], np.arange(n_lists + 1))
+			logger.info("   **** Indexed %d vectors in %d lists in %.2fs" % (len(self.vectors), n_lists, time.time()-start))
+
+	def __len__(self):
+		return len(self.vectors)
+
+	# Indices and distances of the k nearest rows to each of queries (an m x d array), nearest first.  Rows in
+	# exclude[i] are never returned for query i.
+	def search(self, queries, k, exclude=None):
+		queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+		indices = np.full((len(queries), k), -1, dtype=np.int64)
+		distances = np.full((len(queries), k), np.inf)
+		for i,query in enumerate(queries):
+			candidates = self._candidates(query)
+			if exclude is not None and len(exclude[i]):
+				candidates = np.arange(len(self.vectors)) if candidates is None else candidates
+				candidates = candidates[~np.isin(candidates, exclude[i])]
+			found, found_distances = self._rank(query, candidates, k)
+			indices[i,:len(found)] = found
+			distances[i,:len(found)] = found_distances
+		return indices, distances
+
+	# Rows a query is scored against: those of the n_probe lists with the nearest centroids, or None for all of them
+	def _candidates(self, query):
+		if self.centroids is None:
+			return None
+		centroid_distances = np.sum((self.centroids - query) ** 2, axis=1)
+		probed = np.argsort(centroid_distances, kind="mergesort")[:self.n_probe]
+		return np.concatenate([self.order[self.offsets[l]:self.offsets[l+1]] for l in probed])
+
+	# The k candidates (None for all rows) nearest to query: shortlisted by expanded squared distance a block of rows at
+	# a time, then ranked by exact distance
+	def _rank(self, query, candidates, k):
+		n_candidates = len(self.vectors) if candidates is None else len(candidates)
+		shortlist_size = min(k + RERANK_SLACK, n_candidates)
+		if shortlist_size < n_candidates:
+			block = max(int(self.memory_mb * 2**20 / (8 * (self.vectors.shape[1] + 4))), shortlist_size)
+			shortlist = np.zeros(0, dtype=np.int64)
+			shortlist_distances = np.zeros(0)
+			for start in range(0, n_candidates, block):
+				if candidates is None:
+					rows = np.arange(start, min(start + block, n_candidates))
+					squared = self.norms[start:start+block] - 2 * self.vectors[start:start+block].dot(query)
+				else:
+					rows = candidates[start:start+block]
+					squared = self.norms[rows] - 2 * self.vectors[rows].dot(query)
+				rows = np.concatenate([shortlist, rows])
+				squared = np.concatenate([shortlist_distances, squared])
+				chosen = np.argpartition(squared, shortlist_size - 1)[:shortlist_size] if len(rows) > shortlist_size else np.arange(len(rows))
+				shortlist, shortlist_distances = rows[chosen], squared[chosen]
+			candidates = shortlist
+		elif candidates is None:
+			candidates = np.arange(n_candidates)
+		distances = np.linalg.norm(self.vectors[candidates] - query, axis=1)
+		order = np.lexsort((candidates, distances))[:k]
+		return candidates[order], distances[order]
+
+# Index of the row of vectors (with squared norms norms) nearest to each row of queries, and their squared distance less
+# the query's squared norm
+def _nearest(vectors, norms, queries, memory_mb):
+	block = max(int(memory_mb * 2**20 / (8 * 4 * max(len(vectors), 1))), 1)
+	nearest = np.zeros(len(queries), dtype=np.int64)
+	squared = np.zeros(len(queries))
+	for start in range(0, len(queries), block):
+		distances = norms[None, :] - 2 * queries[start:start+block].dot(vectors.T)
+		nearest[start:start+block] = np.argmin(distances, axis=1)
+		squared[start:start+block] = distances[np.arange(len(distances)), nearest[start:start+block]]
+	return nearest, squared
+
+# Lloyd's k-means over a sample of at most sample rows, starting from distinct random rows; a cluster that empties is
+# restarted at the sample row farthest from its centroid
+def _kmeans(vectors, n_clusters, sample, iterations, random_state, memory_mb):
+	if len(vectors) > sample:
+		vectors = vectors[np.sort(random_state.choice(len(vectors), sample, replace=False))]
+	centroids = vectors[random_state.choice(len(vectors), n_clusters, replace=False)].copy()
+	for _ in range(iterations):
+		assigned, squared = _nearest(centroids, np.einsum("ij,ij->i", centroids, centroids), vectors, memory_mb)
+		counts = np.bincount(assigned, minlength=n_clusters)
+		sums = np.column_stack([np.bincount(assigned, weights=vectors[:, j], minlength=n_clusters) for j in range(vectors.shape[1])])
+		filled = counts > 0
+		centroids[filled] = sums[filled] / counts[filled, None]
+		for cluster in np.flatnonzero(~filled):
+			farthest = np.argmax(squared + np.einsum("ij,ij->i", vectors, vectors))
+			centroids[cluster] = vectors[farthest]
+			squared[farthest] = -np.inf
+	return centroids